@@ -36,6 +36,37 @@ class TestSimple(object):
         assert u.valid
         assert u.exists()
 
+    def test_get_userid(self):
+        name = u"getuserid"
+        assert user.get_userid(name) is None
+        user.create_user(name, u"barbaz4711", u"getuserid@example.org", validate=False)
+        userid = user.get_userid(name)
+        assert userid
+        assert user.get_userid([name, ]) == userid
+        # a user the in-memory user names do not know (yet) is found by an index query:
+        user_names = flaskg.unprotected_storage.user_names()
+        with user_names.lock:
+            user_names._remove(userid)
+        assert user_names.itemid(name) is None
+        assert user.get_userid(name) == userid
+        with user_names.lock:
+            user_names._remove(userid)
+        query = flaskg.unprotected_storage.query_parser([NAME, ]).parse(u'username:' + name)
+        assert userid in unicode(query)
+
+    def test_get_editor(self):
+        name = u"geteditor"
+        user.create_user(name, u"barbaz4711", u"geteditor@example.org", validate=False)
+        userid = user.get_userid(name)
+        editor = user.get_editor(userid, None, None)
+        assert editor != ('anon', '')
+        # a user the in-memory user names do not know (yet) is found by an index query:
+        user_names = flaskg.unprotected_storage.user_names()
+        with user_names.lock:
+            user_names._remove(userid)
+        assert user.get_editor(userid, None, None) == editor
+        assert user.get_editor(u'0' * 32, None, None) == ('anon', '')
+
 
 class TestUser(object):
     def setup_method(self, method):
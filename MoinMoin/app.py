@@ -12,6 +12,8 @@ Use create_app(config) to create the WSGI application (using Flask).
 
 from __future__ import absolute_import, division
 
+import atexit
+
 # do this early, but not in MoinMoin/__init__.py because we need to be able to
 # "import MoinMoin" from setup.py even before flask, werkzeug, ... is installed.
 from MoinMoin.util import monkeypatch
@@ -156,17 +158,22 @@ def create_app_ext(flask_config_file=None, flask_config_dict=None,
         ])
     app.register_error_handler(403, themed_error)
     clock.stop('create_app flask-themes')
+    init_outbox(app)
+    init_converter_pool(app)
     clock.stop('create_app total')
     del clock
     return app
 
 
 def destroy_app(app):
+    deinit_converter_pool(app)
+    deinit_outbox(app)
     deinit_backends(app)
 
 
 from MoinMoin.storage.middleware import protecting, indexing, routing
 from MoinMoin import auth, config, user
+from MoinMoin.datastruct.backends.cached_groups import CachedGroups
 
 
 def init_backends(app):
@@ -182,10 +189,20 @@ def init_backends(app):
     app.router.open()
     app.storage = indexing.IndexingMiddleware(app.cfg.index_storage, app.router,
                                               wiki_name=app.cfg.interwikiname,
-                                              acl_rights_contents=app.cfg.acl_rights_contents)
+                                              acl_rights_contents=app.cfg.acl_rights_contents,
+                                              commit_max_docs=app.cfg.index_commit_max_docs,
+                                              commit_max_delay=app.cfg.index_commit_max_delay,
+                                              acl_mapping=app.cfg.acl_mapping,
+                                              snapshot_interval=app.cfg.index_snapshot_interval)
     if app.cfg.create_index:
         app.storage.create()
     app.storage.open()
+    kind, cls, params, kw = app.storage.get_storage_params()
+    if kind == indexing.WHOOSH_RAMSTORAGE and params[0]:
+        # a wiki server usually does not call deinit_backends, snapshot the indexes at exit:
+        atexit.register(app.storage.snapshot)
+    app.acl_cache = protecting.AclCache()
+    app.group_cache = CachedGroups(app.cfg.groups)
 
 
 def deinit_backends(app):
@@ -197,6 +214,42 @@ def deinit_backends(app):
         app.router.destroy()
 
 
+def init_outbox(app):
+    """
+    initialize the notification outbox and start sending queued notifications
+    """
+    app.outbox = None
+    if app.cfg.mail_outbox:
+        from MoinMoin.util.notifications import NotificationOutbox
+        app.outbox = NotificationOutbox(app.cfg.mail_outbox, delay=app.cfg.mail_outbox_delay)
+        app.outbox.start(app)
+
+
+def deinit_outbox(app):
+    if app.outbox is not None:
+        app.outbox.stop()
+        app.outbox = None
+
+
+def init_converter_pool(app):
+    """
+    initialize the pool of worker processes for expensive converters
+    """
+    app.converter_pool = None
+    if app.cfg.converter_pool:
+        from MoinMoin.converter._pool import ConverterPool
+        app.converter_pool = ConverterPool(app.cfg.converter_pool, size=app.cfg.converter_pool_size,
+                                           time_limit=app.cfg.converter_pool_time_limit,
+                                           memory_limit=app.cfg.converter_pool_memory_limit)
+        app.converter_pool.start(app)
+
+
+def deinit_converter_pool(app):
+    if app.converter_pool is not None:
+        app.converter_pool.stop()
+        app.converter_pool = None
+
+
 def setup_user():
     """
     Try to retrieve a valid user object from the request, be it
@@ -244,21 +297,32 @@ def before_wiki():
     flaskg.clock.start('init')
     try:
         flaskg.unprotected_storage = app.storage
+        setup_wiki_env(setup_user())
+    finally:
+        flaskg.clock.stop('init')
 
-        flaskg.user = setup_user()
-        flaskg.storage = protecting.ProtectingMiddleware(app.storage, flaskg.user, app.cfg.acl_mapping)
+    # if return value is not None, it is the final response
 
-        flaskg.dicts = app.cfg.dicts()
-        flaskg.groups = app.cfg.groups()
 
-        flaskg.content_lang = app.cfg.language_default
-        flaskg.current_lang = app.cfg.language_default
+def setup_wiki_env(userobj):
+    """
+    Setup storage, groups, dicts, ... of the wiki environment for userobj.
 
-        setup_jinja_env()
-    finally:
-        flaskg.clock.stop('init')
+    Besides by before_wiki(), this is used to do work on behalf of a user
+    outside of the user's request (e.g. sending queued notifications).
+    """
+    flaskg.user = userobj
+    app.group_cache.validate(app.storage.index_generation())
+    flaskg.storage = protecting.ProtectingMiddleware(app.storage, flaskg.user, app.cfg.acl_mapping,
+                                                       acl_cache=app.acl_cache, group_cache=app.group_cache)
 
-    # if return value is not None, it is the final response
+    flaskg.dicts = app.cfg.dicts()
+    flaskg.groups = app.group_cache
+
+    flaskg.content_lang = app.cfg.language_default
+    flaskg.current_lang = app.cfg.language_default
+
+    setup_jinja_env()
 
 
 def teardown_wiki(response):
@@ -266,6 +330,8 @@ def teardown_wiki(response):
     Teardown environment of wiki requests, stop timers.
     """
     logging.debug("running teardown_wiki")
+    # the next request shall get up-to-date index searchers:
+    app.storage.release_searchers()
     try:
         flaskg.clock.stop('total')
         del flaskg.clock
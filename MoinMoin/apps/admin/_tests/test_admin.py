@@ -29,6 +29,12 @@ class TestAdmin(object):
     def test_wikiconfighelp(self):
         self._test_view_get(url_for('admin.wikiconfighelp'), status='403 FORBIDDEN')
 
+    def test_converterstats(self):
+        self._test_view_get(url_for('admin.converterstats'), status='403 FORBIDDEN')
+
+    def test_searcherstats(self):
+        self._test_view_get(url_for('admin.searcherstats'), status='403 FORBIDDEN')
+
     def test_interwikihelp(self):
         self._test_view_get(url_for('admin.interwikihelp'))
 
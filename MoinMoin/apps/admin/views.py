@@ -51,7 +51,8 @@ def userbrowser():
                           fqname=CompositeName(NAMESPACE_USERPROFILES, NAME_EXACT, rev.name),
                           email=rev.meta[EMAIL],
                           disabled=rev.meta[DISABLED],
-                          groups=[groupname for groupname in groups if rev.meta[NAME] in groups[groupname]],
+                          groups=sorted(set(groupname for name in rev.meta[NAME]
+                                            for groupname in groups.groups_with_member(name))),
                      ) for rev in revs]
     return render_template('admin/userbrowser.html', user_accounts=user_accounts, title_name=_(u"Users"))
 
@@ -177,6 +178,44 @@ def wikiconfighelp():
                            groups=groups)
 
 
+@admin.route('/converterstats', methods=['GET', ])
+@require_permission(SUPERUSER)
+def converterstats():
+    """display the lookup statistics of the converter registry (of this process)"""
+    from MoinMoin.converter import default_registry
+    stats = default_registry.stats()
+    headings = [
+        _('Registered converters'),
+        _('Remembered lookups'),
+        _('Hits'),
+        _('Misses'),
+    ]
+    rows = [(stats['entries'], stats['lookups'], stats['hits'], stats['misses'], ), ]
+    return render_template('admin/converterstats.html',
+                           title_name=_(u"Converter Statistics"),
+                           headings=headings,
+                           rows=rows)
+
+
+@admin.route('/searcherstats', methods=['GET', ])
+@require_permission(SUPERUSER)
+def searcherstats():
+    """display the counts of index searchers opened, reopened and reused (by this process)"""
+    stats = app.storage.searcher_stats()
+    headings = [
+        _('Index'),
+        _('Opened'),
+        _('Reopened'),
+        _('Reused'),
+    ]
+    rows = [(idx_name, stats[idx_name]['opened'], stats[idx_name]['reopened'], stats[idx_name]['reused'], )
+            for idx_name in sorted(stats)]
+    return render_template('admin/searcherstats.html',
+                           title_name=_(u"Index Searcher Statistics"),
+                           headings=headings,
+                           rows=rows)
+
+
 @admin.route('/highlighterhelp', methods=['GET', ])
 def highlighterhelp():
     """display a table with list of available Pygments lexers"""
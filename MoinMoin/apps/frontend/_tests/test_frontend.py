@@ -14,6 +14,9 @@ from werkzeug import ImmutableMultiDict, FileStorage
 
 from MoinMoin.apps.frontend import views
 from MoinMoin import user
+from MoinMoin._tests import update_item
+from MoinMoin.constants.keys import ACL, CONTENTTYPE, NAME
+from MoinMoin.storage.middleware.indexing import IndexingMiddleware
 
 
 class TestFrontend(object):
@@ -153,6 +156,24 @@ class TestFrontend(object):
     def test_search(self):
         self._test_view('frontend.search')
 
+    def test_search_contents(self, monkeypatch):
+        update_item(u'ReadableItem', {CONTENTTYPE: u'text/plain;charset=utf-8'}, u'searchword publicword')
+        update_item(u'SecretItem', {CONTENTTYPE: u'text/plain;charset=utf-8', ACL: u'All:'}, u'searchword secretword')
+        calls = []
+        indexed_content = IndexingMiddleware.indexed_content
+
+        def counting_indexed_content(self, doc):
+            calls.append(doc[NAME])
+            return indexed_content(self, doc)
+        monkeypatch.setattr(IndexingMiddleware, 'indexed_content', counting_indexed_content)
+        with self.app.test_client() as c:
+            rv = c.get(url_for('frontend.search', q='searchword'))
+        assert rv.status == '200 OK'
+        # got once for the key terms and the highlights, only if readable:
+        assert calls == [[u'ReadableItem'], ]
+        assert 'publicword' in rv.data
+        assert 'secretword' not in rv.data
+
     def test_revert_item(self):
         self._test_view('frontend.revert_item', status='404 NOT FOUND', viewopts=dict(item_name='DoesntExist', rev='000000'))
 
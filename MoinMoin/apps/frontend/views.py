@@ -38,7 +38,7 @@ from jinja2 import Markup
 import pytz
 from babel import Locale
 
-from whoosh.query import Term, Prefix, And, Or, DateRange, Every
+from whoosh.query import Term, Prefix, And, Or, DateRange
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
@@ -52,7 +52,7 @@ from MoinMoin.forms import (OptionalText, RequiredText, URL, YourOpenID, YourEma
                             validate_name, NameNotValidError)
 from MoinMoin.items import BaseChangeForm, Item, NonExistent, NameNotUniqueError, FieldNotUniqueError
 from MoinMoin.items.content import content_registry
-from MoinMoin import user, util
+from MoinMoin import user
 from MoinMoin.constants.keys import *
 from MoinMoin.constants.namespaces import *
 from MoinMoin.constants.itemtypes import ITEMTYPE_DEFAULT
@@ -214,7 +214,7 @@ def lookup():
             name_exact = lookup_form[NAME_EXACT].value or u''
             terms.append(Term(WIKINAME, app.cfg.interwikiname))
             q = And(terms)
-            with flaskg.storage.indexer.ix[idx_name].searcher() as searcher:
+            with flaskg.storage.indexer.searcher(idx_name) as searcher:
                 flaskg.clock.start('lookup')
                 results = searcher.search(q, limit=100)
                 flaskg.clock.stop('lookup')
@@ -249,24 +249,6 @@ def lookup():
     return Response(html, status)
 
 
-def _compute_item_transclusions(item_name):
-    """Compute which items are transcluded into item <item_name>.
-
-    :returns: a set of their item names.
-    """
-    with flaskg.storage.indexer.ix[LATEST_REVS].searcher() as searcher:
-        # The search process should be as fast as possible so use
-        # the indexer low-level documents instead of high-level Revisions.
-        doc = searcher.document(**{NAME_EXACT: item_name})
-        if not doc:
-            return set()
-        transcluded_names = set(doc[ITEMTRANSCLUSIONS])
-        for item_name in transcluded_names.copy():
-            transclusions = _compute_item_transclusions(item_name)
-            transcluded_names.update(transclusions)
-        return transcluded_names
-
-
 @frontend.route('/+search/<itemname:item_name>', methods=['GET', 'POST'])
 @frontend.route('/+search', defaults=dict(item_name=u''), methods=['GET', 'POST'])
 def search(item_name):
@@ -279,45 +261,51 @@ def search(item_name):
         qp = flaskg.storage.query_parser([NAME_EXACT, NAME, SUMMARY, CONTENT], idx_name=idx_name)
         q = qp.parse(query)
 
-        _filter = None
-        if item_name:  # Only search this item and subitems
-            prefix_name = item_name + u'/'
-            terms = [Term(NAME_EXACT, item_name), Prefix(NAME_EXACT, prefix_name), ]
-
-            show_transclusions = True
-            if show_transclusions:
-                # XXX Search subitems and all transcluded items (even recursively),
-                # still looks like a hack. Imaging you have "foo" on main page and
-                # "bar" on transcluded one. Then you search for "foo AND bar".
-                # Such stuff would only work if we expand transcluded items
-                # at indexing time (and we currently don't).
-                with flaskg.storage.indexer.ix[LATEST_REVS].searcher() as searcher:
-                    subq = Or([Term(NAME_EXACT, item_name), Prefix(NAME_EXACT, prefix_name), ])
-                    subq = And([subq, Every(ITEMTRANSCLUSIONS), ])
-                    flaskg.clock.start('search subitems with transclusions')
-                    results = searcher.search(subq, limit=None)
-                    flaskg.clock.stop('search subitems with transclusions')
-                    transcluded_names = set()
-                    for hit in results:
-                        name = hit[NAME]
-                        transclusions = _compute_item_transclusions(name)
-                        transcluded_names.update(transclusions)
-                # XXX Will whoosh cope with such a large filter query?
-                terms.extend([Term(NAME_EXACT, name) for name in transcluded_names])
-
-            _filter = Or(terms)
-
-        with flaskg.storage.indexer.ix[idx_name].searcher() as searcher:
+        indexer = flaskg.storage.indexer
+        with indexer.searcher(idx_name) as searcher:
+            _filter = None
+            if item_name:  # Only search this item, subitems and all transcluded items (even recursively)
+                # XXX Imagine you have "foo" on main page and "bar" on transcluded one.
+                # Then you search for "foo AND bar". Such stuff would only work if we
+                # expand transcluded items at indexing time (and we currently don't).
+                flaskg.clock.start('search scope')
+                _filter = flaskg.storage.indexer.scope_filter(searcher, item_name)
+                flaskg.clock.stop('search scope')
             flaskg.clock.start('search')
             results = searcher.search(q, filter=_filter, limit=100)
             flaskg.clock.stop('search')
+            readable = {}  # docnum -> whether the user may read the hit
+            contents = {}  # docnum -> indexed content of the hit
+
+            def may_read(hit):
+                if hit.docnum not in readable:
+                    fqname = CompositeName(hit[NAMESPACE], NAME_EXACT, hit[NAME][0])
+                    readable[hit.docnum] = flaskg.user.may.read(fqname)
+                return readable[hit.docnum]
+
+            def indexed_content(hit):
+                # the all revs index does not store the content, getting it might
+                # need a conversion, so we do it only once per hit and only for hits
+                # the user may read:
+                if hit.docnum not in contents:
+                    contents[hit.docnum] = indexer.indexed_content(hit.fields()) if may_read(hit) else u''
+                return contents[hit.docnum]
+
             flaskg.clock.start('search suggestions')
             name_suggestions = [word for word, score in results.key_terms(NAME, docs=20, numterms=10)]
-            content_suggestions = [word for word, score in results.key_terms(CONTENT, docs=20, numterms=10)]
+            text = u'\n'.join(indexed_content(hit) for hit in results[:20])
+            key_terms = searcher.key_terms_from_text(CONTENT, text, numterms=10)
+            content_suggestions = [word for word, score in key_terms]
             flaskg.clock.stop('search suggestions')
+
+            def highlights(hit):
+                return hit.highlights(CONTENT, text=indexed_content(hit))
+
             flaskg.clock.start('search render')
             html = render_template('search.html',
                                    results=results,
+                                   may_read=may_read,
+                                   highlights=highlights,
                                    name_suggestions=u', '.join(name_suggestions),
                                    content_suggestions=u', '.join(content_suggestions),
                                    query=query,
@@ -792,7 +780,7 @@ def jfu_server(item_name):
         item = Item.create(item_name)
         revid, size = item.modify({}, data, contenttype_guessed=contenttype)
         item_modified.send(app._get_current_object(),
-                           item_name=item_name, action=ACTION_SAVE)
+                           item_name=item_name, action=ACTION_SAVE, revid=revid)
         return jsonify(name=subitem_name,
                        size=size,
                        url=url_for('.show_item', item_name=item_name, rev=revid),
@@ -835,10 +823,24 @@ def index(item_name):
 
     selected_groups = form['contenttype'].value
     startswith = request.values.get("startswith")
+    offset = max(int(request.values.get('offset', 0)), 0)
+    if flaskg.user.valid:
+        results_per_page = flaskg.user.results_per_page
+    else:
+        results_per_page = app.cfg.results_per_page
 
-    initials = item.name_initial(item.get_subitem_revs(), uppercase=True)
-
-    dirs, files = item.get_index(startswith, selected_groups)
+    index_page = None
+    if set(selected_groups) >= set(ContenttypeGroup.member_schema.valid_values):
+        # no filtering by content type, just get the current page from the name tree
+        index_page = item.get_index_page(startswith, offset, results_per_page or None)
+    if index_page is None:
+        initials = item.name_initial(item.get_subitem_revs(), uppercase=True)
+        dirs, files = item.get_index(startswith, selected_groups)
+        next_offset, previous_offset = 0, -1
+    else:
+        dirs, files, initials, total = index_page
+        next_offset = offset + results_per_page if results_per_page and offset + results_per_page < total else 0
+        previous_offset = max(offset - results_per_page, 0) if results_per_page and offset else -1
     # index = sorted(index, key=lambda e: e.relname.lower())
     fqname = item.fqname
     if fqname.value == NAMESPACE_ALL:
@@ -852,6 +854,8 @@ def index(item_name):
                            dirs=dirs,
                            initials=initials,
                            startswith=startswith,
+                           next_offset=next_offset,
+                           previous_offset=previous_offset,
                            form=form,
                            title_name=_(u'Global Index'),
     )
@@ -901,7 +905,7 @@ def refs(item_name):
     return render_template('refs.html',
                            item_name=item_name,
                            fqname=split_fqname(item_name),
-                           refs=split_fqname_list(refs),
+                           refs=refs,
                            backrefs=backrefs
     )
 
@@ -920,27 +924,19 @@ def forwardrefs(item_name):
                            item_name=item_name,
                            fqname=split_fqname(item_name),
                            headline=_(u"Items that are referred by '%(item_name)s'", item_name=item_name),
-                           fq_names=split_fqname_list(refs),
+                           fq_names=refs,
     )
 
 
 def _forwardrefs(item_name):
     """
-    Returns a list with all names of items that get referenced from item_name
+    Returns a set with all fqnames of items that get referenced from item_name
 
     :param item_name: the name of the current item
     :type item_name: unicode
-    :returns: the list of all items which are referenced from this item
+    :returns: the set of all items which are referenced from this item
     """
-    fqname = split_fqname(item_name)
-    q = fqname.query
-    q[WIKINAME] = app.cfg.interwikiname
-    rev = flaskg.storage.document(**q)
-    if rev is None:
-        refs = []
-    else:
-        refs = rev.meta.get(ITEMLINKS, []) + rev.meta.get(ITEMTRANSCLUSIONS, [])
-    return set(refs)
+    return flaskg.storage.forwardrefs(split_fqname(item_name))
 
 
 @frontend.route('/+backrefs/<itemname:item_name>')
@@ -968,16 +964,13 @@ def backrefs(item_name):
 
 def _backrefs(item_name):
     """
-    Returns a list with all names of items which ref fq_name
+    Returns a set with all fqnames of items which ref fq_name
 
     :param item_name: the name of the item transcluded or linked
     :type item_name: unicode
-    :returns: the list of all items which ref fq_name
+    :returns: the set of all items which ref fq_name
     """
-    q = And([Term(WIKINAME, app.cfg.interwikiname),
-             Or([Term(ITEMTRANSCLUSIONS, item_name), Term(ITEMLINKS, item_name)])])
-    revs = flaskg.storage.search(q)
-    return set([fqname for rev in revs for fqname in rev.fqnames])
+    return flaskg.storage.backrefs(split_fqname(item_name))
 
 
 @frontend.route('/+history/<itemname:item_name>')
@@ -995,16 +988,13 @@ def history(item_name):
     if bookmark_time:
         terms.append(DateRange(MTIME, start=datetime.utcfromtimestamp(bookmark_time), end=None))
     query = And(terms)
-    # TODO: due to how getPageContent and the template works, we need to use limit=None -
-    # it would be better to use search_page (and an appropriate limit, if needed)
-    revs = flaskg.storage.search(query, idx_name=ALL_REVS, sortedby=[MTIME], reverse=True, limit=None)
-    # get rid of the content value to save potentially big amounts of memory:
-    history = []
-    for rev in revs:
-        entry = dict(rev.meta)
-        entry[FQNAME] = rev.fqname
-        history.append(entry)
-    history_page = util.getPageContent(history, offset, results_per_page)
+    # we only fetch the entries of the current page (all, if results_per_page is 0),
+    # made from the index only (no revisions loaded from the backend):
+    history, more = flaskg.storage.history(query, idx_name=ALL_REVS, offset=offset,
+                                           limit=results_per_page or None)
+    next_offset = offset + results_per_page if more else 0
+    previous_offset = max(offset - results_per_page, 0) if results_per_page and offset else -1
+    history_page = history, next_offset, previous_offset
     return render_template('history.html',
                            fqname=fqname,
                            item_name=item_name,  # XXX no item here
@@ -1056,28 +1046,6 @@ def global_history(namespace):
     )
 
 
-def _compute_item_sets():
-    """
-    compute sets of existing, linked, transcluded and no-revision item fqnames
-    """
-    linked = set()
-    transcluded = set()
-    existing = set()
-    revs = flaskg.storage.documents(wikiname=app.cfg.interwikiname)
-    for rev in revs:
-        existing |= set(rev.fqnames)
-        linked.update(rev.meta.get(ITEMLINKS, []))
-        transcluded.update(rev.meta.get(ITEMTRANSCLUSIONS, []))
-    return existing, set(split_fqname_list(linked)), set(split_fqname_list(transcluded))
-
-
-def split_fqname_list(names):
-    """
-    Converts a list of names to a list of fqnames.
-    """
-    return [split_fqname(name) for name in names]
-
-
 @frontend.route('/+wanteds')
 def wanted_items():
     """
@@ -1085,9 +1053,7 @@ def wanted_items():
     transcluded by other items. If you want to know by which items they are
     referred to, use the backrefs functionality of the item in question.
     """
-    existing, linked, transcluded = _compute_item_sets()
-    referred = linked | transcluded
-    wanteds = referred - existing
+    wanteds = flaskg.storage.wanted_items()
     title_name = _(u'Wanted Items')
     return render_template('link_list_no_item_panel.html',
                            headline=_(u'Wanted Items'),
@@ -1101,9 +1067,7 @@ def orphaned_items():
     Return a list view of existing items not being linked or transcluded
     by any other item (which makes them sometimes not discoverable).
     """
-    existing, linked, transcluded = _compute_item_sets()
-    referred = linked | transcluded
-    orphans = existing - referred
+    orphans = flaskg.storage.orphaned_items()
     title_name = _('Orphaned Items')
     return render_template('link_list_no_item_panel.html',
                            title_name=title_name,
@@ -1906,16 +1870,20 @@ def findMatches(fq_name, s_re=None, e_re=None):
     :returns: start word, end word, matches dict
     """
 
-    fq_names = [fqname for rev in flaskg.storage.documents(wikiname=app.cfg.interwikiname) for fqname in rev.fqnames
-                if rev.fqname is not None]
-    if fq_name in fq_names:
-        fq_names.remove(fq_name)
+    name_index = flaskg.unprotected_storage.name_index()
+
+    def readable(fq_names):
+        return [fqname for fqname in fq_names if fqname != fq_name and flaskg.user.may.read(fqname)]
+
     # Get matches using wiki way, start and end of word
+    start, end = wikiWords(fq_name, start_re=s_re, end_re=e_re)
+    fq_names = readable(name_index.prefixed(fq_name.value + u'/') |
+                        name_index.prefixed(start) | name_index.suffixed(end))
     start, end, matches = wikiMatches(fq_name, fq_names, start_re=s_re, end_re=e_re)
-    # Get the best 10 close matches
+    # Get the best 10 close matches (of the candidates sharing most trigrams)
     close_matches = {}
     found = 0
-    for fqname in closeMatches(fq_name, fq_names):
+    for fqname in closeMatches(fq_name, readable(name_index.similar(fq_name.value))):
         if fqname not in matches:
             # Skip fqname already in matches
             close_matches[fqname] = 8
@@ -1928,22 +1896,15 @@ def findMatches(fq_name, s_re=None, e_re=None):
     return start, end, matches
 
 
-def wikiMatches(fq_name, fq_names, start_re=None, end_re=None):
+def wikiWords(fq_name, start_re=None, end_re=None):
     """
-    Get fqnames that starts or ends with same word as this fq_name.
-
-    Matches are ranked like this:
-        4 - item is subitem of fq_name
-        3 - match both start and end
-        2 - match end
-        1 - match start
+    Get the start and end word of fq_name.
 
-    :param fq_name: fqname to match
-    :param fq_names: list of fqnames
+    :param fq_name: fqname to split
     :param start_re: start word re (compile regex)
     :param end_re: end word re (compile regex)
     :rtype: tuple
-    :returns: start, end, matches dict
+    :returns: start, end
     """
     if start_re is None:
         start_re = re.compile(u'([{0}][{1}]+)'.format(CHARS_UPPER, CHARS_LOWER))
@@ -1965,7 +1926,28 @@ def wikiMatches(fq_name, fq_names, start_re=None, end_re=None):
         end = match.group(1)
     else:
         end = words[-1]
+    return start, end
+
+
+def wikiMatches(fq_name, fq_names, start_re=None, end_re=None):
+    """
+    Get fqnames that starts or ends with same word as this fq_name.
 
+    Matches are ranked like this:
+        4 - item is subitem of fq_name
+        3 - match both start and end
+        2 - match end
+        1 - match start
+
+    :param fq_name: fqname to match
+    :param fq_names: list of fqnames
+    :param start_re: start word re (compile regex)
+    :param end_re: end word re (compile regex)
+    :rtype: tuple
+    :returns: start, end, matches dict
+    """
+    start, end = wikiWords(fq_name, start_re=start_re, end_re=end_re)
+    item_name = fq_name.value
     matches = {}
     subitem = item_name + '/'
 
@@ -1978,7 +1960,7 @@ def wikiMatches(fq_name, fq_names, start_re=None, end_re=None):
             if name.startswith(start):
                 matches[fqname] = 1
             if name.endswith(end):
-                matches[fqname] = matches.get(name, 0) + 2
+                matches[fqname] = matches.get(fqname, 0) + 2
 
     return start, end, matches
 
@@ -2057,19 +2039,14 @@ class NestedItemListBuilder(object):
 
     def childs(self, fq_name):
         # does not recurse
-        try:
-            item = flaskg.storage.get_item(**fq_name.query)
-            rev = item[CURRENT]
-        except (AccessDenied, KeyError):
-            return []
-        itemlinks = set(split_fqname_list(rev.meta.get(ITEMLINKS, [])))
+        itemlinks = flaskg.storage.forwardrefs(fq_name, transclusions=False)
         return [child for child in itemlinks if self.is_ok(child)]
 
     def is_ok(self, child):
         if child not in self.children:
             if not flaskg.user.may.read(child):
                 return False
-            if flaskg.storage.get_item(**child.query):
+            if flaskg.unprotected_storage.link_graph().exists(child):
                 self.children.add(child)
                 return True
         return False
@@ -2087,14 +2064,7 @@ def global_tags(namespace):
     if namespace != NAMESPACE_ALL:
         query[NAMESPACE] = namespace
         fqname = split_fqname(namespace)
-    revs = flaskg.storage.documents(**query)
-    tags_counts = {}
-    for rev in revs:
-        tags = rev.meta.get(TAGS, [])
-        logging.debug("name {0!r} rev {1} tags {2!r}".format(rev.name, rev.meta[REVID], tags))
-        for tag in tags:
-            tags_counts[tag] = tags_counts.setdefault(tag, 0) + 1
-    tags_counts = sorted(tags_counts.items())
+    tags_counts = sorted(flaskg.storage.tag_counts(**query).items())
     if tags_counts:
         # this is a simple linear scaling
         counts = [count for tags, count in tags_counts]
@@ -457,6 +457,14 @@ options_no_group_name = {
         ('destroy_index', False, "Destroy (empty) the index after using it."),
 
         ('mimetypes_to_index_as_empty', [], "List of mimetypes which are indexed as though they were empty."),
+        ('index_content_max_size', 1000000,
+         "Max. length (in characters) of the indexed content of a revision, the rest is not indexed (0 = no limit)."),
+        ('index_commit_max_docs', 100,
+         "Max. count of revisions the index commit queue commits in one batch (0 = no queue, commit every revision separately)."),
+        ('index_commit_max_delay', 0,
+         "Max. time [s] the index commit queue waits for more revisions before committing (this delays saving)."),
+        ('index_snapshot_interval', 300,
+         "Min. time [s] between snapshots of a RamStorage index_storage after index modifications (0 = only at shutdown and after index maintenance)."),
     )),
     # ==========================================================================
     'items': ('Special Item Names', None, (
@@ -586,12 +594,25 @@ options = {
         ('use_gravatar', False, "if True, gravatar.com will be used to find User's avatar")
     )),
 
+    'converter': ('Converters', 'These settings control how expensive conversions are run.', (
+        ('pool', [],
+         "Names of converter modules (e.g. 'pdf_in', 'opendocument_in') whose conversions run in a pool of worker processes (empty = no pool)."),
+        ('pool_size', 2, "Count of worker processes of the converter pool."),
+        ('pool_time_limit', 30, "Max. time [s] a conversion in the converter pool may take (0 = no limit)."),
+        ('pool_memory_limit', 512 * 1024 * 1024,
+         "Max. memory [bytes] a worker process of the converter pool may use (0 = no limit)."),
+    )),
+    # ==========================================================================
     'mail': ('Mail', 'These settings control outgoing and incoming email from and to the wiki.', (
         ('from', None, "Used as From: address for generated mail. [Unicode]"),
         ('username', None, "Username for SMTP server authentication (None = don't use auth)."),
         ('password', None, "Password for SMTP server authentication (None = don't use auth)."),
         ('smarthost', None, "Address of SMTP server to use for sending mail (None = don't use SMTP server)."),
         ('sendmail', None, "sendmail command to use for sending mail (None = don't use sendmail)"),
+        ('outbox', None,
+         "Directory where item change notifications are queued for sending them in the background (None = send them while saving)."),
+        ('outbox_delay', 60,
+         "Time [s] a queued notification waits for more changes of the same item, which then get sent together in one mail."),
     )),
 }
 
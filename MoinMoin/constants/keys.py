@@ -56,6 +56,8 @@ PARENTID = u"parentid"
 DATAID = u"dataid"
 WIKINAME = u"wikiname"
 CONTENT = u"content"
+# normalized effective ACL of the latest revision (see security.acl_index_terms):
+EFFECTIVE_ACL = u"effective_acl"
 
 # magic REVID for current revision:
 CURRENT = u"current"
@@ -43,6 +43,15 @@ class RegistryConverter(RegistryBase):
                 return False
             return NotImplemented
 
+    def _lookup_key(self, type_input, type_output, **kw):
+        # Type objects are not hashable (their parameters are a dict)
+        key = unicode(type_input), unicode(type_output), tuple(sorted(kw.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
     def register(self, factory, type_input, type_output, priority=RegistryBase.PRIORITY_MIDDLE):
         """
         Register a factory
@@ -0,0 +1,212 @@
+# Copyright: 2014 The MoinMoin development team
+# License: GNU GPL v2 (or any later version), see LICENSE.txt for details.
+
+"""
+MoinMoin - converter process pool
+
+Some converters (e.g. for pdf or office documents) can need a lot of cpu time
+and memory for some data. To not block the web server processes with that,
+they can be run in a pool of worker processes, with limits for the cpu time
+and memory a conversion may use (see the converter_pool* configuration).
+"""
+
+
+from __future__ import absolute_import, division
+
+import multiprocessing
+import resource
+import signal
+import threading
+from StringIO import StringIO
+
+from flask import current_app as app
+
+from MoinMoin.constants.keys import HASH_ALGORITHM, REVID
+from MoinMoin.i18n import _
+from MoinMoin.util.crypto import cache_key
+from MoinMoin.util.tree import moin_page
+
+from MoinMoin import log
+logging = log.getLogger(__name__)
+
+
+class ConversionLimitExceeded(Exception):
+    """
+    raised if a conversion in the converter pool does not finish within the
+    time limit or runs out of memory.
+    """
+
+
+class _PoolRevision(object):
+    """
+    The parts of a revision a converter needs, rebuilt in a worker process.
+    """
+    def __init__(self, meta, data, item_name):
+        self.meta = meta
+        self.data = StringIO(data)
+        self.revid = meta.get(REVID)
+
+        class PoolItem(object):
+            def __init__(self, name):
+                self.name = name
+        self.item = PoolItem(item_name)
+
+    def read(self, *args, **kw):
+        return self.data.read(*args, **kw)
+
+    def seek(self, *args, **kw):
+        return self.data.seek(*args, **kw)
+
+    def tell(self, *args, **kw):
+        return self.data.tell(*args, **kw)
+
+
+def _worker_init(flask_app, memory_limit):
+    """
+    Initialize a worker process of the converter pool.
+
+    :param flask_app: the moin wsgi application, converters need app.cfg
+    :param memory_limit: max. size [bytes] of the address space of the worker (0 = no limit)
+    """
+    flask_app.app_context().push()
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    signal.signal(signal.SIGALRM, _time_limit_exceeded)
+
+
+def _time_limit_exceeded(signum, frame):
+    raise ConversionLimitExceeded("conversion did not finish within the time limit")
+
+
+def _worker_convert(conv, meta, data, item_name, contenttype, time_limit):
+    """
+    Run a conversion in a worker process of the converter pool.
+
+    If the conversion takes more than time_limit seconds, it gets aborted by
+    raising ConversionLimitExceeded. If it uses more than about time_limit
+    seconds of cpu time without getting aborted (e.g. in a long running C
+    function), the operating system kills the worker (and the pool starts a
+    new one).
+    """
+    if time_limit:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = int(usage.ru_utime + usage.ru_stime) + 1
+        soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (used + time_limit, hard))
+        signal.alarm(time_limit)
+    try:
+        return conv(_PoolRevision(meta, data, item_name), contenttype)
+    finally:
+        if time_limit:
+            signal.alarm(0)
+
+
+class ConverterPool(object):
+    """
+    Run the conversions of some converters in a pool of worker processes.
+
+    Results are cached by data hash, so the same data does not get converted
+    again. If a conversion does not finish in time or runs out of memory,
+    the caller gets a ConversionLimitExceeded exception. The time limit only
+    applies to the conversion itself, not to waiting for a free worker.
+    """
+    def __init__(self, converters, size=2, time_limit=30, memory_limit=0):
+        """
+        :param converters: names of the converter modules to run in the pool (e.g. 'pdf_in')
+        :param size: count of worker processes
+        :param time_limit: max. time [s] a conversion may take (0 = no limit)
+        :param memory_limit: max. memory [bytes] a worker may use (0 = no limit)
+        """
+        self.converters = set(converters)
+        self.size = size
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.pool = None
+        # count of the conversions submitted to the pool and not finished yet:
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+
+    def start(self, flask_app):
+        self.pool = multiprocessing.Pool(self.size, _worker_init, (flask_app, self.memory_limit))
+
+    def stop(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+
+    def handles(self, conv):
+        """
+        Check if the conversions of converter conv shall run in the pool.
+        """
+        return conv.__class__.__module__.rsplit('.', 1)[-1] in self.converters
+
+    def convert(self, conv, rev, contenttype):
+        """
+        Return conv(rev, contenttype), computed by a worker process.
+
+        :raises ConversionLimitExceeded: if the conversion takes too long or
+                                         needs too much memory
+        """
+        hash_hexdigest = rev.meta.get(HASH_ALGORITHM)
+        if hash_hexdigest:
+            cid = cache_key(usage="converter_pool",
+                            converter='{0}.{1}'.format(conv.__class__.__module__, conv.__class__.__name__),
+                            hash_name=HASH_ALGORITHM,
+                            hash_hexdigest=hash_hexdigest,
+                            contenttype=contenttype,
+                            name=rev.item.name)
+            result = app.cache.get(cid)
+            if result is not None:
+                return result
+        else:
+            cid = None
+        with self.pending_lock:
+            ahead = self.pending
+            self.pending += 1
+        try:
+            job = self.pool.apply_async(_worker_convert,
+                                        (conv, dict(rev.meta), rev.data.read(), rev.item.name, contenttype,
+                                         self.time_limit))
+            if self.time_limit:
+                # the workers abort conversions after time_limit, so the conversions
+                # waiting ahead of ours are done within that time per worker. Timing
+                # out here (with some slack) means a worker got killed, losing our job:
+                timeout = (ahead // self.size + 2) * self.time_limit
+            else:
+                timeout = None
+            try:
+                result = job.get(timeout)
+            except (multiprocessing.TimeoutError, MemoryError, ConversionLimitExceeded):
+                logging.warning("Conversion of item {0!r} ({1}) by {2} did not finish within the limits.".format(
+                                rev.item.name, contenttype, conv.__class__.__module__))
+                raise ConversionLimitExceeded("conversion of {0!r} did not finish within the limits".format(
+                                              rev.item.name))
+        finally:
+            with self.pending_lock:
+                self.pending -= 1
+        if cid:
+            app.cache.set(cid, result)
+        return result
+
+
+def fallback_document():
+    """
+    Return a document telling that the data could not be converted (to be shown
+    instead of the internal document format if ConversionLimitExceeded).
+    """
+    message = _("This item could not be converted within the resource limits of this wiki.")
+    return moin_page.page(children=[moin_page.body(children=[moin_page.p(children=[message])])])
+
+
+def convert(conv, rev, contenttype):
+    """
+    Return conv(rev, contenttype), computed by the converter pool of the
+    application if it has one that handles conv (see ConverterPool.convert).
+
+    :raises ConversionLimitExceeded: if the conversion in the pool takes too
+                                     long or needs too much memory
+    """
+    pool = getattr(app, 'converter_pool', None)
+    if pool is not None and pool.handles(conv):
+        return pool.convert(conv, rev, contenttype)
+    return conv(rev, contenttype)
@@ -0,0 +1,85 @@
+# Copyright: 2014 The MoinMoin development team
+# License: GNU GPL v2 (or any later version), see LICENSE.txt for details.
+
+"""
+MoinMoin - Tests for MoinMoin.converter._pool
+"""
+
+
+import os
+import time
+import threading
+
+import pytest
+
+from flask import current_app as app
+
+from werkzeug.contrib.cache import SimpleCache
+
+from MoinMoin._tests import wikiconfig
+from MoinMoin.constants.keys import HASH_ALGORITHM
+from MoinMoin.converter._pool import convert, ConversionLimitExceeded, _PoolRevision
+
+
+class PidConverter(object):
+    def __call__(self, rev, contenttype=None, arguments=None):
+        return u'{0} {1}'.format(rev.read(), os.getpid())
+
+
+class SleepConverter(object):
+    def __call__(self, rev, contenttype=None, arguments=None):
+        time.sleep(0.6)
+        return rev.read()
+
+
+class LoopConverter(object):
+    def __call__(self, rev, contenttype=None, arguments=None):
+        while True:
+            pass
+
+
+class TestConverterPool(object):
+    class Config(wikiconfig.Config):
+        converter_pool = [__name__.rsplit('.', 1)[-1], ]
+        converter_pool_size = 1
+        converter_pool_time_limit = 1
+
+    def setup_method(self, method):
+        self.saved_cache = app.cache
+        app.cache = SimpleCache()
+
+    def teardown_method(self, method):
+        app.cache = self.saved_cache
+
+    def _rev(self, data):
+        return _PoolRevision({HASH_ALGORITHM: unicode(hash(data))}, data, u'foo')
+
+    def test_convert(self):
+        result = convert(PidConverter(), self._rev('data'), u'text/plain')
+        data, pid = result.split()
+        assert data == u'data'
+        assert int(pid) != os.getpid()
+        # the result is cached
+        assert convert(PidConverter(), self._rev('data'), u'text/plain') == result
+
+    def test_time_limit(self):
+        with pytest.raises(ConversionLimitExceeded):
+            convert(LoopConverter(), self._rev('loop'), u'text/plain')
+        # the worker aborted the conversion, it is ready for the next one:
+        result = convert(PidConverter(), self._rev('after loop'), u'text/plain')
+        assert result.startswith(u'after loop ')
+
+    def test_queue_wait(self):
+        # waiting for a free worker does not count for the time limit:
+        flask_app = app._get_current_object()
+        results = []
+
+        def run(data):
+            with flask_app.app_context():
+                results.append(convert(SleepConverter(), self._rev(data), u'text/plain'))
+        threads = [threading.Thread(target=run, args=(data, )) for data in ['first', 'second', ]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == [u'first', u'second']
@@ -11,8 +11,11 @@ import pytest
 from emeraldtree import tree as ET
 
 from flask import current_app as app
+from flask import g as flaskg
 
+from MoinMoin.constants.keys import CONTENTTYPE
 from MoinMoin.converter.link import *
+from MoinMoin.items import Item
 from MoinMoin.util.iri import Iri
 
 
@@ -76,6 +79,15 @@ class TestConverterExternOutput(object):
         for i in pairs:
             yield (self._do_wikiexternal, ) + i
 
+    def test_nonexistent(self):
+        Item.create(u'ExistingLinkTarget')._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'')
+        page = ET.Element(moin_page.page, attrib={moin_page.page_href: 'wiki:///Root'})
+        for target in [u'wiki.local:ExistingLinkTarget', u'wiki.local:MissingLinkTarget', u'wiki.local:', ]:
+            page.append(ET.Element(moin_page.a, attrib={xlink.href: target}))
+        self.conv(page)
+        assert [elem.get(moin_page.class_) for elem in page] == [None, 'moin-nonexistent', None]
+        assert flaskg.storage.existing_names([u'ExistingLinkTarget', u'MissingLinkTarget']) == set([u'ExistingLinkTarget'])
+
     def _do_wiki(self, input, output, skip=None):
         if skip:
             pytest.skip(skip)
@@ -315,6 +315,17 @@ class TestConverter(object):
         for i in data:
             yield (self.do, ) + i
 
+    def test_parse_stream(self):
+        bodies = []
+        self.conv.parse_stream(u'Text\n\n * a\n * b\n\nTest', 'text/x.moin.wiki;charset=utf-8',
+                               lambda body: bodies.append(self.serialize(body)))
+        assert bodies == [
+            '<body><p>Text</p></body>',
+            '<body><list item-label-generate="unordered"><list-item><list-item-body><p>a</p></list-item-body></list-item>'
+            '<list-item><list-item-body><p>b</p></list-item-body></list-item></list></body>',
+            '<body><p>Test</p></body>',
+        ]
+
     def serialize(self, elem, **options):
         from StringIO import StringIO
         buffer = StringIO()
@@ -57,5 +57,15 @@ class TestRegistry(object):
             conv = default_registry.get(type_moin_document, type_moin_document, **kwargs)
             assert isinstance(conv, ExpectedClass)
 
+    def testLookupCache(self):
+        type_input = Type('text/x.moin.wiki;charset=utf-8')
+        conv1 = default_registry.get(type_input, type_moin_document)
+        hits = default_registry.stats()['hits']
+        conv2 = default_registry.get(Type('text/x.moin.wiki;charset=utf-8'), type_moin_document)
+        assert default_registry.stats()['hits'] == hits + 1
+        # every lookup still creates a new converter
+        assert isinstance(conv2, MoinwikiInConverter)
+        assert conv2 is not conv1
+
 
 coverage_modules = ['MoinMoin.converter']
@@ -8,6 +8,8 @@ MoinMoin - converter utilities
 
 from __future__ import absolute_import, division
 
+import codecs
+
 from flask import request
 from flask import g as flaskg
 from emeraldtree import ElementTree as ET
@@ -18,6 +20,31 @@ from MoinMoin.util.mime import Type
 from MoinMoin.util.tree import html, moin_page
 
 
+class RenderDependencies(object):
+    """
+    What the expansion of a document depends on, besides the document itself.
+
+    While a document gets expanded, the include, macro and link converters
+    record here what they looked at, so a rendering can be reused as long
+    as all of this is unchanged (see Content._render_data).
+    """
+    def __init__(self):
+        self.links = {}  # name of a linked item -> did it exist?
+        self.transclusions = {}  # fqname of a transcluded item -> (name, revid or None, could the user read it?)
+        self.cacheable = True  # False if the expansion used something not recorded here
+
+
+def render_dependencies():
+    """
+    Return the RenderDependencies recorded for the current rendering (None if there is none).
+    """
+    try:
+        return getattr(flaskg, 'render_dependencies', None)
+    except RuntimeError:
+        # no application context
+        return None
+
+
 def allowed_uri_scheme(uri):
     parsed = Iri(uri)
     return not parsed.scheme or parsed.scheme in URI_SCHEMES
@@ -58,6 +85,36 @@ def normalize_split_text(text):
     return lines
 
 
+def iter_lines(data, contenttype=None, bufsize=65536):
+    """
+    read and decode data piece by piece, yield the lines of the unicode text
+
+    gives the same lines as normalize_split_text(decode_data(data, contenttype)),
+    but does not need to have all of the data in memory at once.
+    """
+    if isinstance(data, (str, unicode)):
+        for line in normalize_split_text(decode_data(data, contenttype)):
+            yield line
+        return
+    coding = 'utf-8'
+    if contenttype is not None:
+        ct = Type(contenttype)
+        coding = ct.parameters.get('charset', coding)
+    decoder = codecs.getincrementaldecoder(coding)()
+    pending = u''
+    while True:
+        chunk = data.data.read(bufsize)
+        text = pending + decoder.decode(chunk, final=not chunk)
+        lines = normalize_split_text(text)
+        # the last line might be incomplete, keep it (and a trailing \r) for the next round:
+        pending = lines.pop()
+        for line in lines:
+            yield line
+        if not chunk:
+            break
+    yield pending
+
+
 class _Iter(object):
     """
     Iterator with push back support
@@ -106,11 +163,17 @@ class _Stack(object):
             else:
                 self.name = None
 
-    def __init__(self, bottom=None, iter_content=None):
+    def __init__(self, bottom=None, iter_content=None, flush=None):
+        """
+        :param flush: if given, a callable the bottom element gets passed to
+                      whenever its children are complete, the children are
+                      removed afterwards (see parse_stream of the converters)
+        """
         self._list = []
         if bottom:
             self._list.append(self.Item(bottom))
         self.iter_content = iter_content
+        self.flush = flush
         self.last_lineno = 0
 
     def __len__(self):
@@ -151,6 +214,11 @@ class _Stack(object):
         return self._list[-1].elem
 
     def top_append(self, elem):
+        if self.flush is not None and len(self._list) == 1 and len(self.top()):
+            # nothing on the stack refers to the previous children of the
+            # bottom element any more, so they are complete
+            self.flush(self.top())
+            self.top().remove_all()
         if isinstance(elem, ET.Node):
             self.add_lineno(elem)
         self.top().append(elem)
@@ -33,7 +33,7 @@ from MoinMoin.util.tree import moin_page, xlink, xinclude
 
 from ._args_wiki import parse as parse_arguments
 from ._wiki_macro import ConverterMacro
-from ._util import decode_data, normalize_split_text, _Iter, _Stack
+from ._util import decode_data, normalize_split_text, iter_lines, _Iter, _Stack
 
 
 class Converter(ConverterMacro):
@@ -51,6 +51,18 @@ class Converter(ConverterMacro):
 
         return root
 
+    def parse_stream(self, data, contenttype, flush, arguments=None):
+        """
+        Parse data like __call__, but without building the complete document.
+
+        Whenever some children of the body are complete, the body gets passed
+        to flush and these children get removed from it afterwards, so memory
+        use does not grow with the size of data (used for indexing).
+        """
+        iter_content = _Iter(iter_lines(data, contenttype))
+        body = self.parse_block(iter_content, arguments, flush=flush)
+        flush(body)
+
     block_head = r"""
         (?P<head>
             ^
@@ -603,7 +615,7 @@ class Converter(ConverterMacro):
         data = dict(((k, v) for k, v in match.groupdict().iteritems() if v is not None))
         getattr(self, '{0}_{1}_repl'.format(prefix, match.lastgroup))(*args, **data)
 
-    def parse_block(self, iter_content, arguments):
+    def parse_block(self, iter_content, arguments, flush=None):
         attrib = {}
         if arguments:
             for key, value in arguments.keyword.iteritems():
@@ -612,7 +624,7 @@ class Converter(ConverterMacro):
 
         body = moin_page.body(attrib=attrib)
 
-        stack = _Stack(body, iter_content=iter_content)
+        stack = _Stack(body, iter_content=iter_content, flush=flush)
 
         # Please note that the iterator can be modified by other functions
         for line in iter_content:
@@ -104,6 +104,7 @@ from MoinMoin.util.iri import Iri, IriPath
 from MoinMoin.util.tree import html, moin_page, xinclude, xlink
 
 from MoinMoin.converter.html_out import mark_item_as_transclusion, Attributes
+from MoinMoin.converter._util import render_dependencies
 
 # elements generated by moin wiki markup that cannot have block children
 NO_BLOCK_CHILDREN = [
@@ -266,6 +267,7 @@ class Converter(object):
                             elif name == 'level':
                                 xp_include_level = data
 
+                dependencies = render_dependencies()
                 if href:
                     # We have a single page to transclude
                     href = Iri(href)
@@ -301,6 +303,9 @@ class Converter(object):
                     if xp_include_pages.startswith('^'):
                         # get rid of the leading ^ the Include macro needed to get into "regex mode"
                         xp_include_pages = xp_include_pages[1:]
+                    if dependencies is not None:
+                        # the search results are not recorded
+                        dependencies.cacheable = False
                     query = And([Term(WIKINAME, app.cfg.interwikiname), Wildcard(NAME_EXACT, xp_include_pages)])
                     reverse = xp_include_sort == 'descending'
                     results = flaskg.storage.search(query, sortedby=NAME_EXACT, reverse=reverse, limit=None)
@@ -326,7 +331,10 @@ class Converter(object):
                         included_elements.append(strong)
                         continue
                     # TODO: Is this correct?
-                    if not flaskg.user.may.read(page.name):
+                    readable = bool(flaskg.user.may.read(page.name))
+                    if dependencies is not None:
+                        dependencies.transclusions[page.fqname] = (page.name, page.rev.revid, readable)
+                    if not readable:
                         continue
 
                     if xp_include_heading is not None:
@@ -13,6 +13,7 @@ from __future__ import absolute_import, division
 
 from flask import g as flaskg
 
+from MoinMoin.converter._util import render_dependencies
 from MoinMoin.util.interwiki import is_known_wiki, url_for_item
 from MoinMoin.util.iri import Iri
 from MoinMoin.util.mime import Type, type_moin_document
@@ -105,6 +106,29 @@ class ConverterExternOutput(ConverterBase):
         if links == 'extern':
             return cls()
 
+    def __init__(self, **kw):
+        super(ConverterExternOutput, self).__init__(**kw)
+        self.wikilocal_links = []
+
+    def __call__(self, *args, **kw):
+        """
+        Expands the links, then marks links to non-existing items
+
+        Whether the link targets exist is looked up for all wikilocal links
+        of the document together (see ProtectingMiddleware.existing_names).
+        """
+        self.wikilocal_links = []  # (elem, item_name) tuples
+        elem = super(ConverterExternOutput, self).__call__(*args, **kw)
+        existing = flaskg.storage.existing_names(set(item_name for link_elem, item_name in self.wikilocal_links))
+        dependencies = render_dependencies()
+        if dependencies is not None:
+            dependencies.links.update((item_name, item_name in existing)
+                                      for link_elem, item_name in self.wikilocal_links)
+        for link_elem, item_name in self.wikilocal_links:
+            if item_name not in existing:
+                link_elem.set(moin_page.class_, 'moin-nonexistent')
+        return elem
+
     def _get_do_rev(self, query):
         """
         get 'do' and 'rev' values from query string and remove them from querystring
@@ -168,9 +192,8 @@ class ConverterExternOutput(ConverterBase):
             path = input.path
             path = self.absolute_path(path, page.path)
             item_name = unicode(path)
-            if not flaskg.storage.has_item(item_name):
-                # XXX these index accesses slow down the link converter quite a bit
-                elem.set(moin_page.class_, 'moin-nonexistent')
+            # __call__ marks it if the item does not exist:
+            self.wikilocal_links.append((elem, item_name))
         else:
             item_name = unicode(page.path[1:])
         endpoint, rev, query = self._get_do_rev(input.query)
@@ -20,6 +20,7 @@ logging = log.getLogger(__name__)
 from MoinMoin.util import plugins
 from MoinMoin.i18n import _, L_, N_
 from MoinMoin.converter._args import Arguments
+from MoinMoin.converter._util import render_dependencies
 from MoinMoin.util import iri
 from MoinMoin.util.mime import type_moin_document, Type
 from MoinMoin.util.tree import moin_page
@@ -71,13 +72,19 @@ class Converter(object):
         elem_body = context_block and moin_page.body() or moin_page.inline_body()
         elem_error = moin_page.error()
 
+        dependencies = render_dependencies()
         try:
             cls = plugins.importPlugin(app.cfg, 'macro', name, function='Macro')
+            if dependencies is not None and not cls.immutable:
+                # we do not know what the output depends on
+                dependencies.cacheable = False
             macro = cls()
             ret = macro((), args, page, alt, context_block)
             elem_body.append(ret)
 
         except PluginMissingError:
+            if dependencies is not None:
+                dependencies.cacheable = False
             elem_error.append('<<%s>> %s' % (name, _('Error: invalid macro name.')))
 
         except Exception as e:
@@ -86,6 +93,8 @@ class Converter(object):
             # thus, in case of exceptions, we just log the problem and return
             # some standard text.
             logging.exception("Macro {0} raised an exception:".format(name))
+            if dependencies is not None:
+                dependencies.cacheable = False
             elem_error.append(_('<<%(macro_name)s: execution failed [%(error_msg)s] (see also the log)>>',
                               macro_name=name, error_msg=unicode(e), ))
 
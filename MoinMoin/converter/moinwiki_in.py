@@ -28,7 +28,7 @@ from MoinMoin.i18n import _
 from ._args import Arguments
 from ._args_wiki import parse as parse_arguments
 from ._wiki_macro import ConverterMacro
-from ._util import decode_data, normalize_split_text, _Iter, _Stack
+from ._util import decode_data, normalize_split_text, iter_lines, _Iter, _Stack
 
 
 class _TableArguments(object):
@@ -146,6 +146,18 @@ class Converter(ConverterMacro):
 
         return root
 
+    def parse_stream(self, data, contenttype, flush, arguments=None):
+        """
+        Parse data like __call__, but without building the complete document.
+
+        Whenever some children of the body are complete, the body gets passed
+        to flush and these children get removed from it afterwards, so memory
+        use does not grow with the size of data (used for indexing).
+        """
+        iter_content = _Iter(iter_lines(data, contenttype))
+        body = self.parse_block(iter_content, arguments, flush=flush)
+        flush(body)
+
     block_comment = r"""
         (?P<comment>
             ^ \#\#
@@ -1016,7 +1028,7 @@ class Converter(ConverterMacro):
         #logging.debug("calling %s(%r, %r)" % (func, args, data))
         getattr(self, func)(*args, **data)
 
-    def parse_block(self, iter_content, arguments):
+    def parse_block(self, iter_content, arguments, flush=None):
         attrib = {}
         if arguments:
             for key, value in arguments.keyword.iteritems():
@@ -1027,7 +1039,7 @@ class Converter(ConverterMacro):
 
         body = moin_page.body(attrib=attrib)
 
-        stack = _Stack(body, iter_content=iter_content)
+        stack = _Stack(body, iter_content=iter_content, flush=flush)
 
         for line in iter_content:
             data = dict(((str(k), v) for k, v in self.indent_re.match(line).groupdict().iteritems() if v is not None))
@@ -9,9 +9,10 @@ MoinMoin - CSV text data to DOM converter
 from __future__ import absolute_import, division
 
 import csv
+from itertools import chain
 
 from ._table import TableMixin
-from ._util import decode_data, normalize_split_text
+from ._util import decode_data, normalize_split_text, iter_lines
 from MoinMoin.util.tree import moin_page
 
 
@@ -27,22 +28,43 @@ class Converter(TableMixin):
     def __call__(self, data, contenttype=None, arguments=None):
         text = decode_data(data, contenttype)
         content = normalize_split_text(text)
+        rows = list(self.iter_rows(content))
+        table = self.build_dom_table(rows)
+        body = moin_page.body(children=(table, ))
+        return moin_page.page(children=(body, ))
+
+    def iter_rows(self, lines):
+        """
+        Parse the unicode lines as csv, yield the non-empty rows (lists of unicode cells).
+        """
         # as of py 2.7.x (and in the year 2013), the csv module seems to still
         # have troubles with unicode, thus we encode to utf-8 ...
-        content = [line.encode('utf-8') for line in content]
-        dialect = csv.Sniffer().sniff(content[0])
-        reader = csv.reader(content, dialect)
+        content = (line.encode('utf-8') for line in lines)
+        first_line = next(content, '')
+        dialect = csv.Sniffer().sniff(first_line)
+        reader = csv.reader(chain([first_line], content), dialect)
         # ... and decode back to unicode
-        rows = []
         for encoded_row in reader:
             row = []
             for encoded_cell in encoded_row:
                 row.append(encoded_cell.decode('utf-8'))
             if row:
-                rows.append(row)
-        table = self.build_dom_table(rows)
-        body = moin_page.body(children=(table, ))
-        return moin_page.page(children=(body, ))
+                yield row
+
+    def parse_stream(self, data, contenttype, flush, arguments=None, rows_per_flush=100):
+        """
+        Parse data like __call__, but without building the complete document.
+
+        Bodies with tables of up to rows_per_flush rows get passed to flush,
+        so memory use does not grow with the size of data (used for indexing).
+        """
+        rows = []
+        for row in self.iter_rows(iter_lines(data, contenttype)):
+            rows.append(row)
+            if len(rows) == rows_per_flush:
+                flush(moin_page.body(children=(self.build_dom_table(rows), )))
+                rows = []
+        flush(moin_page.body(children=(self.build_dom_table(rows), )))
 
 
 from . import default_registry
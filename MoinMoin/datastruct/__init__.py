@@ -13,6 +13,7 @@ from MoinMoin.datastruct.backends.composite_dicts import CompositeDicts
 from MoinMoin.datastruct.backends.wiki_groups import WikiGroups
 from MoinMoin.datastruct.backends.config_groups import ConfigGroups
 from MoinMoin.datastruct.backends.composite_groups import CompositeGroups
+from MoinMoin.datastruct.backends.cached_groups import CachedGroups
 
 from MoinMoin.datastruct.backends import GroupDoesNotExistError
 from MoinMoin.datastruct.backends import DictDoesNotExistError
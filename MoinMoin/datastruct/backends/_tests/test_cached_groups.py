@@ -0,0 +1,61 @@
+# Copyright: 2014 The MoinMoin development team
+# License: GNU GPL v2 (or any later version), see LICENSE.txt for details.
+
+"""
+MoinMoin - MoinMoin.datastruct.backends.cached_groups tests
+"""
+
+
+from pytest import raises
+
+from MoinMoin._tests import update_item
+from MoinMoin.constants.keys import USERGROUP
+from MoinMoin.datastruct.backends._tests import GroupsBackendTest
+from MoinMoin.datastruct import ConfigGroups, CachedGroups, GroupDoesNotExistError
+
+
+class TestCachedGroups(object):
+    reinit_storage = True  # cleanup after each test method
+
+    def setup_method(self, method):
+        self.loads = 0
+        self.groups = CachedGroups(self.backend_factory)
+
+    def backend_factory(self):
+        self.loads += 1
+        return ConfigGroups(GroupsBackendTest.test_groups)
+
+    def test_closure(self):
+        assert u'Admin1' in self.groups[u'EditorGroup']
+        assert u'AdminGroup' in self.groups[u'EditorGroup']
+        assert u'Admin1' not in self.groups[u'OtherGroup']
+        assert u'Anything' in self.groups[u'RecursiveGroup']
+        assert sorted(self.groups[u'RecursiveGroup']) == [u'Anything', u'NotExistingGroup', u'Something']
+        raises(GroupDoesNotExistError, lambda: self.groups[u'NotExistingGroup'])
+
+    def test_groups_with_member(self):
+        assert sorted(self.groups.groups_with_member(u'Admin1')) == [u'AdminGroup', u'EditorGroup']
+        assert sorted(self.groups.groups_with_member(u'Banana')) == [u'ThirdRecursiveGroup']
+        assert list(self.groups.groups_with_member(u'Nobody')) == []
+
+    def test_invalidation(self):
+        self.groups.validate(1)
+        assert u'AdminGroup' in self.groups
+        assert u'John' in self.groups[u'AdminGroup']
+        assert self.loads == 1
+        self.groups.validate(1)
+        assert u'AdminGroup' in self.groups
+        assert self.loads == 1
+        # other items changed:
+        update_item(u'SomeItem', {}, u'')
+        self.groups.validate(2)
+        assert u'AdminGroup' in self.groups
+        assert self.loads == 1
+        # a group item changed:
+        update_item(u'SomeGroup', {USERGROUP: [u'John', ]}, u'')
+        self.groups.validate(3)
+        assert u'AdminGroup' in self.groups
+        assert self.loads == 2
+        self.groups.invalidate()
+        assert u'AdminGroup' in self.groups
+        assert self.loads == 3
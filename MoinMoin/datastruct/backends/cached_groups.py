@@ -0,0 +1,161 @@
+# Copyright: 2014 The MoinMoin development team
+# License: GNU GPL v2 (or any later version), see LICENSE.txt for details.
+
+"""
+MoinMoin - cached groups
+
+The cached_groups backend keeps the groups of another backend (as configured
+by the groups setting) in memory, shared by all requests of a wiki process.
+
+It computes the transitive member closure of all groups in one go, so
+checking if someone is member of a group (also via nested groups) and
+finding all groups of a member are simple lookups.
+"""
+
+
+import threading
+
+from flask import current_app as app
+from flask import g as flaskg
+
+from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT
+from MoinMoin.datastruct.backends import BaseGroup, GreedyGroup, BaseGroupsBackend, GroupDoesNotExistError
+
+
+class CachedGroup(BaseGroup):
+    """
+    A group of CachedGroups, it knows all members of its nested groups, too.
+    """
+    def __init__(self, name, backend, closure, members):
+        """
+        :param closure: all members (including the names of nested groups) [frozenset]
+        :param members: members to iterate over (nested groups expanded) [list]
+        """
+        super(CachedGroup, self).__init__(name, backend)
+        self.closure = closure
+        self.members = members
+
+    def __contains__(self, member, processed_groups=None):
+        return member in self.closure
+
+    def __iter__(self, yielded_members=None, processed_groups=None):
+        if yielded_members is None:
+            yielded_members = set()
+        for member in self.members:
+            if member not in yielded_members:
+                yielded_members.add(member)
+                yield member
+
+    def __repr__(self):
+        return "<{0!r} name={1!r} members={2!r}>".format(self.__class__, self.name, self.members)
+
+
+class CachedGroups(BaseGroupsBackend):
+    """
+    Process-wide cache of the groups of the backend made by backend_factory.
+
+    The groups get loaded when needed and are kept until the cache gets
+    invalidated, that is when a group item is modified via the storage (see
+    invalidate, called by ProtectingMiddleware) or when the latest revisions
+    of the group items changed after the index generation changed (see
+    validate, e.g. another process modified a group item).
+    """
+    def __init__(self, backend_factory):
+        """
+        :param backend_factory: callable returning the groups backend to cache
+        """
+        # the base class init needs an app context, we look the regex up when needed
+        self.backend_factory = backend_factory
+        self.lock = threading.RLock()
+        self.generation = None  # index generation the group items were checked at
+        self.group_revids = None  # group item fqname -> revid of its latest revision (at that generation)
+        self._groups = None  # group name -> CachedGroup
+        self._member_groups = None  # member -> names of the groups it is a (transitive) member of
+
+    @property
+    def item_group_regex(self):
+        return app.cfg.cache.item_group_regexact
+
+    def _group_revids(self):
+        storage = flaskg.unprotected_storage
+        fqnames = [fqname for fqname in storage.name_index().matching(self.item_group_regex)
+                   if fqname.namespace == NAMESPACE_DEFAULT]
+        return storage.latest_revids(fqnames)
+
+    def validate(self, generation):
+        """
+        invalidate the cache if the index generation changed and some group item
+        got modified, created or removed since the last check
+        """
+        with self.lock:
+            if generation != self.generation:
+                group_revids = self._group_revids()
+                if group_revids != self.group_revids:
+                    self._groups = None
+                    self.group_revids = group_revids
+                self.generation = generation
+
+    def invalidate(self):
+        """
+        invalidate the cache (call this when group definitions were modified)
+        """
+        with self.lock:
+            self._groups = None
+
+    def _load(self):
+        """
+        Return the groups (group name -> CachedGroup) and the member -> group names
+        mapping, load them from the backend if needed.
+        """
+        with self.lock:
+            if self._groups is None:
+                self._groups, self._member_groups = self._load_groups(self.backend_factory())
+            return self._groups, self._member_groups
+
+    def _load_groups(self, backend):
+        direct = {}  # group name -> direct members (including names of member groups)
+        for group_name in backend:
+            try:
+                group = backend[group_name]
+            except GroupDoesNotExistError:
+                continue
+            if isinstance(group, GreedyGroup):
+                direct[group_name] = group.members | group.member_groups
+            else:
+                direct[group_name] = set(group)
+        groups = {}
+        member_groups = {}
+        for group_name in direct:
+            # members of member groups are members, too (groups may be nested recursively):
+            closure = set()
+            todo, seen = [group_name], set([group_name])
+            while todo:
+                for member in direct[todo.pop()]:
+                    closure.add(member)
+                    if member in direct and member not in seen:
+                        seen.add(member)
+                        todo.append(member)
+            members = sorted(member for member in closure if member not in direct)
+            groups[group_name] = CachedGroup(group_name, self, frozenset(closure), members)
+            for member in closure:
+                member_groups.setdefault(member, set()).add(group_name)
+        return groups, member_groups
+
+    def __contains__(self, group_name):
+        groups, member_groups = self._load()
+        return group_name in groups
+
+    def __iter__(self):
+        groups, member_groups = self._load()
+        return iter(list(groups))
+
+    def __getitem__(self, group_name):
+        groups, member_groups = self._load()
+        try:
+            return groups[group_name]
+        except KeyError:
+            raise GroupDoesNotExistError(group_name)
+
+    def groups_with_member(self, member):
+        groups, member_groups = self._load()
+        return iter(list(member_groups.get(member, ())))
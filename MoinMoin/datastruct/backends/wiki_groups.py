@@ -17,6 +17,7 @@ HelpOnConfiguration.
 from flask import g as flaskg
 
 from MoinMoin.constants.keys import CURRENT, USERGROUP
+from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT
 from MoinMoin.datastruct.backends import GreedyGroup, BaseGroupsBackend, GroupDoesNotExistError
 
 
@@ -40,9 +41,9 @@ class WikiGroups(BaseGroupsBackend):
         """
         To find group pages, app.cfg.cache.item_group_regexact pattern is used.
         """
-        # TODO: use whoosh to search for group_regex matching items
-        item_list = [rev.name for rev in flaskg.unprotected_storage.documents()
-                     if self.item_group_regex.search(rev.name)]
+        name_index = flaskg.unprotected_storage.name_index()
+        item_list = sorted(fqname.value for fqname in name_index.matching(self.item_group_regex)
+                           if fqname.namespace == NAMESPACE_DEFAULT)
         return iter(item_list)
 
     def __getitem__(self, group_name):
@@ -36,7 +36,7 @@ from MoinMoin import log
 logging = log.getLogger(__name__)
 
 from MoinMoin.security.textcha import TextCha, TextChaizedForm
-from MoinMoin.signalling import item_modified
+from MoinMoin.signalling import item_modified, items_modified
 from MoinMoin.storage.middleware.protecting import AccessDenied
 from MoinMoin.i18n import L_
 from MoinMoin.themes import render_template
@@ -405,38 +405,61 @@ class Item(object):
             meta[PARENTID] = revid
         return meta
 
-    def _rename(self, name, comment, action, delete=False):
+    def _rename(self, name, comment, action, delete=False, progress=None):
         self._save(self.meta, self.content.data, name=name, action=action, comment=comment, delete=delete)
         old_prefix = self.subitem_prefixes[0]
         old_prefixlen = len(old_prefix)
         if not delete:
             new_prefix = name + '/'
+        # a subitem might have multiple names below this item, we give it all new names at once:
+        children = []  # (a matching old name, corresponding new name, all new names) of the subitems
         for child in self.get_subitem_revs():
+            child_names = []
+            child_newnames = []
             for child_oldname in child.meta[NAME]:
-                if child_oldname.startswith(old_prefix):
-                    if delete:
-                        child_newname = None
-                    else:  # rename
-                        child_newname = new_prefix + child_oldname[old_prefixlen:]
-                    old_fqname = CompositeName(self.fqname.namespace, self.fqname.field, child_oldname)
-                    item = Item.create(old_fqname.fullname)
-                    item._save(item.meta, item.content.data,
-                               name=child_newname, action=action, comment=comment, delete=delete)
-
-    def rename(self, name, comment=u''):
+                if not child_oldname.startswith(old_prefix):
+                    child_newnames.append(child_oldname)
+                    continue
+                child_newname = None if delete else new_prefix + child_oldname[old_prefixlen:]
+                child_names.append((child_oldname, child_newname))
+                if not delete:
+                    child_newnames.append(child_newname)
+            if child_names:
+                children.append(child_names[0] + (child_newnames, ))
+        # store the subitems' revisions as one batch and send one signal for all of them:
+        item_names = []
+        with flaskg.storage.batch():
+            for count, (child_oldname, child_newname, child_newnames) in enumerate(children, 1):
+                old_fqname = CompositeName(self.fqname.namespace, self.fqname.field, child_oldname)
+                item = Item.create(old_fqname.fullname)
+                meta = dict(item.meta)
+                meta[NAME] = child_newnames
+                item._save(meta, item.content.data, name=child_newname, action=action, comment=comment,
+                           delete=delete, send_signal=False)
+                item_names.append(child_newname or child_oldname)
+                if progress is not None:
+                    progress(count, len(children))
+        if item_names:
+            items_modified.send(app, item_names=item_names, action=action, comment=comment)
+
+    def rename(self, name, comment=u'', progress=None):
         """
         rename this item to item <name> (replace current name by another name in the NAME list)
+
+        :param progress: function called with (count of subitems renamed so far, count of subitems)
         """
         fqname = CompositeName(self.fqname.namespace, self.fqname.field, name)
         if flaskg.storage.get_item(**fqname.query):
             raise NameNotUniqueError(L_("An item named %s already exists in the namespace %s." % (name, fqname.namespace)))
-        return self._rename(name, comment, action=ACTION_RENAME)
+        return self._rename(name, comment, action=ACTION_RENAME, progress=progress)
 
-    def delete(self, comment=u''):
+    def delete(self, comment=u'', progress=None):
         """
         delete this item (remove current name from NAME list)
+
+        :param progress: function called with (count of subitems deleted so far, count of subitems)
         """
-        return self._rename(None, comment, action=ACTION_TRASH, delete=True)
+        return self._rename(None, comment, action=ACTION_TRASH, delete=True, progress=progress)
 
     def revert(self, comment=u''):
         return self._save(self.meta, self.content.data, action=ACTION_REVERT, comment=comment)
@@ -515,7 +538,7 @@ class Item(object):
         raise NotImplementedError
 
     def _save(self, meta, data=None, name=None, action=ACTION_SAVE, contenttype_guessed=None, comment=None,
-              overwrite=False, delete=False):
+              overwrite=False, delete=False, send_signal=True):
         backend = flaskg.storage
         storage_item = backend.get_item(**self.fqname.query)
         try:
@@ -590,7 +613,8 @@ class Item(object):
         # maybe this needs to be changed so a fqname is used instead of
         # a simple name
         assert name is not None  # fail early
-        item_modified.send(app, item_name=name, action=action)
+        if send_signal:
+            item_modified.send(app, item_name=name, action=action, revid=newrev.revid)
         return newrev.revid, newrev.meta[SIZE]
 
     @property
@@ -700,6 +724,67 @@ class Item(object):
         revs = flaskg.storage.search(query, sortedby=NAME_EXACT, limit=None)
         return self.make_flat_index(revs, isglobalindex)
 
+    def get_index_page(self, startswith=None, offset=0, limit=None):
+        """
+        Like get_index (but without content type filtering), but only for the
+        direct subitems offset ... offset + limit - 1, made from the name tree of
+        the indexer, so the effort does not depend on the count of all subitems.
+
+        Note: subitems with subitems are in ``dirs`` if the user may read their
+              name (no matter whether there are readable subitems below).
+
+        :returns: tuple (dirs, files, initials, total count of direct subitems) or
+                  None if the name tree can't be used (for the index of all
+                  namespaces or if the item is not given by its name)
+        """
+        fqname = self.fqname
+        if (fqname.field != NAME_EXACT or
+                fqname.value == NAMESPACE_ALL or fqname.value.startswith(NAMESPACE_ALL + '/')):
+            return None
+        namespace, name = fqname.namespace, fqname.value
+        tree = flaskg.storage.indexer.name_tree()
+        entries, total = tree.subitems(namespace, name, startswith, offset, limit)
+        prefix = name + u'/' if name else u''
+        initials = self._readable_initials(namespace, prefix, tree.name_initials(namespace, name))
+        metas = {}
+        if entries:
+            query = And([Term(WIKINAME, app.cfg.interwikiname), Term(NAMESPACE, namespace),
+                         Or([Term(NAME_EXACT, prefix + relname) for relname, exists, below in entries]), ])
+            for rev in flaskg.storage.search(query, limit=None):
+                for fullname in rev.meta[NAME]:
+                    metas[fullname] = rev.meta
+        dirs = []
+        files = []
+        for relname, exists, below in entries:
+            fullname = prefix + relname
+            fullname_fqname = CompositeName(namespace, NAME_EXACT, fullname)
+            meta = metas.get(fullname)
+            if exists and meta is not None:
+                files.append(IndexEntry(relname, fullname_fqname, meta))
+            if below and flaskg.user.may.read(fullname_fqname):
+                if meta is None:
+                    meta = get_storage_revision(fullname_fqname).meta
+                dirs.append(IndexEntry(relname, fullname_fqname, meta))
+        return dirs, files, initials, total
+
+    def _readable_initials(self, namespace, prefix, initials):
+        """
+        Return the sorted uppercased initials of the subitem names of the name
+        tree the user may read some item with a name starting with prefix + initial.
+        """
+        readable = set()
+        for initial in initials:
+            if initial.upper() in readable:
+                continue
+            query = And([Term(WIKINAME, app.cfg.interwikiname), Term(NAMESPACE, namespace),
+                         Prefix(NAME_EXACT, prefix + initial), ])
+            revs = flaskg.storage.search(query, limit=None, scored=False)
+            # the first readable item is enough, close the search to release the searcher
+            if next(revs, None) is not None:
+                readable.add(initial.upper())
+            revs.close()
+        return sorted(readable)
+
     def get_mixed_index(self):
         dirs, files = self.make_flat_index(self.get_subitem_revs())
         dirs_dict = dict([(e.fullname, MixedIndexEntry(*e, hassubitems=True)) for e in dirs])
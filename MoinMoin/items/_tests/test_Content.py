@@ -11,10 +11,14 @@ import pytest
 from io import BytesIO
 
 from flask import Markup
+from flask import current_app as app
 
 from werkzeug import escape
+from werkzeug.contrib.cache import SimpleCache
 
 from MoinMoin.util import diff_html
+from MoinMoin.util.crypto import cache_key
+from MoinMoin.i18n import get_locale
 
 from MoinMoin._tests import become_trusted, update_item
 from MoinMoin.items import Item
@@ -66,6 +70,53 @@ class TestContent(object):
         assert result2 == [item_name3]
 
 
+class TestRenderDataCache(object):
+    """ Test for the cache of rendered documents """
+    reinit_storage = True
+
+    def setup_method(self, method):
+        self.saved_cache = app.cache
+        app.cache = SimpleCache()
+
+    def teardown_method(self, method):
+        app.cache = self.saved_cache
+
+    def _render(self, name):
+        return Item.create(name).content._render_data()
+
+    def _cached(self, name):
+        item = Item.create(name)
+        cid = cache_key(usage="rendered_data", revid=item.rev.revid, name=name, locale=unicode(get_locale()))
+        return app.cache.get(cid) is not None
+
+    def test_dependencies(self):
+        meta = {CONTENTTYPE: u'text/x.moin.wiki;charset=utf-8'}
+        update_item(u'Incl', meta, u'first include')
+        update_item(u'Page', meta, u'[[Other]] {{Incl}}')
+        result = self._render(u'Page')
+        assert u'first include' in result
+        assert u'moin-nonexistent' in result
+        assert self._cached(u'Page')
+        assert self._render(u'Page') == result
+        # a link target appears
+        update_item(u'Other', meta, u'other')
+        result = self._render(u'Page')
+        assert u'moin-nonexistent' not in result
+        # a transcluded item changes
+        update_item(u'Incl', meta, u'second include')
+        result = self._render(u'Page')
+        assert u'second include' in result
+
+    def test_uncacheable(self):
+        meta = {CONTENTTYPE: u'text/x.moin.wiki;charset=utf-8'}
+        update_item(u'Page', meta, u'<<Anchor(here)>>')
+        self._render(u'Page')
+        assert self._cached(u'Page')
+        update_item(u'Page', meta, u'<<Date>>')
+        self._render(u'Page')
+        assert not self._cached(u'Page')
+
+
 class TestTarItems(object):
     """
     tests for the container items
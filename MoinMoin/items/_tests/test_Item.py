@@ -12,10 +12,11 @@ from werkzeug import escape
 
 from MoinMoin._tests import become_trusted, update_item
 from MoinMoin.items import Item, NonExistent, IndexEntry, MixedIndexEntry
+from MoinMoin.signalling import items_modified
 from MoinMoin.util.interwiki import CompositeName
 from MoinMoin.constants.keys import (ITEMTYPE, CONTENTTYPE, NAME, NAME_OLD, COMMENT,
-                                     ADDRESS, TRASH, ITEMID, NAME_EXACT,
-                                     ACTION, ACTION_REVERT)
+                                     ADDRESS, TRASH, ITEMID, NAME_EXACT, ACL,
+                                     ACTION, ACTION_REVERT, ACTION_RENAME)
 from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT
 from MoinMoin.constants.contenttypes import CONTENTTYPE_NONEXISTENT
 from MoinMoin.constants.itemtypes import ITEMTYPE_NONEXISTENT
@@ -129,6 +130,45 @@ class TestItem(object):
         assert dirs == build_index(basename, [u'cd', u'ij'])
         assert files == build_index(basename, [u'ab', u'gh', u'ij'])
 
+    def test_index_page(self):
+        basename = u'IndexPage'
+        for name in ['', '/ab', '/cd/ef', '/gh', '/ij', '/ij/kl', '/Aa', ]:
+            item = Item.create(basename + name)
+            item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, "foo")
+        baseitem = Item.create(basename)
+
+        dirs, files, initials, total = baseitem.get_index_page()
+        assert dirs == build_index(basename, [u'cd', u'ij'])
+        assert files == build_index(basename, [u'Aa', u'ab', u'gh', u'ij'])
+        assert initials == [u'A', u'C', u'G', u'I', ]
+        assert total == 5
+
+        # paging
+        dirs, files, initials, total = baseitem.get_index_page(offset=1, limit=2)
+        assert dirs == build_index(basename, [u'cd'])
+        assert files == build_index(basename, [u'ab'])
+        assert total == 5
+
+        # startswith matches both cases
+        dirs, files, initials, total = baseitem.get_index_page(startswith=u'a')
+        assert dirs == []
+        assert files == build_index(basename, [u'Aa', u'ab'])
+        assert total == 2
+
+        # the name tree gets updated when items get renamed
+        item = Item.create(basename + u'/cd/ef')
+        item.rename(basename + u'/xy', comment=u'renamed')
+        dirs, files, initials, total = baseitem.get_index_page()
+        assert dirs == build_index(basename, [u'ij'])
+        assert files == build_index(basename, [u'Aa', u'ab', u'gh', u'ij', u'xy'])
+
+        # initials are only shown for names the user may read
+        update_item(basename + u'/mn', {CONTENTTYPE: u'text/plain;charset=utf-8', ACL: u'All:'}, u'foo')
+        dirs, files, initials, total = baseitem.get_index_page()
+        assert files == build_index(basename, [u'Aa', u'ab', u'gh', u'ij', u'xy'])
+        assert initials == [u'A', u'G', u'I', u'X', ]
+        assert total == 6
+
     def test_meta_filter(self):
         name = u'Test_item'
         contenttype = u'text/plain;charset=utf-8'
@@ -303,6 +343,28 @@ class TestItem(object):
         assert Item.create(u'Other/Child2').content.data == u'Child of Other'
         assert Item.create(u'Another/Child').content.data == u'Child of Another'
 
+    def test_rename_batch(self):
+        update_item(u'BatchPage', {CONTENTTYPE: u'text/x.moin.wiki;charset=utf-8'}, u'BatchPage 1')
+        for name in [u'BatchPage/Child', u'BatchPage/Child/Another', u'BatchPage/Third', ]:
+            update_item(name, {CONTENTTYPE: u'text/x.moin.wiki;charset=utf-8'}, name)
+        signals = []
+
+        def receiver(sender, **kwargs):
+            signals.append(kwargs)
+
+        progress = []
+        item = Item.create(u'BatchPage')
+        with items_modified.connected_to(receiver):
+            item.rename(u'BatchRenamed', comment=u'renamed', progress=lambda count, total: progress.append((count, total)))
+        assert progress == [(1, 3), (2, 3), (3, 3), ]
+        assert len(signals) == 1
+        assert sorted(signals[0]['item_names']) == [u'BatchRenamed/Child', u'BatchRenamed/Child/Another', u'BatchRenamed/Third', ]
+        assert signals[0]['action'] == ACTION_RENAME
+        # the index knows all the renamed subitems
+        dirs, files = Item.create(u'BatchRenamed').get_index()
+        assert [e.relname for e in files] == [u'Child', u'Third', ]
+        assert Item.create(u'BatchRenamed/Child/Another').content.data == u'BatchPage/Child/Another'
+
     def test_delete(self):
         name = u'Test_Item2'
         contenttype = u'text/plain;charset=utf-8'
@@ -51,7 +51,7 @@ from MoinMoin import log
 logging = log.getLogger(__name__)
 
 from MoinMoin import wikiutil
-from MoinMoin.i18n import _, L_
+from MoinMoin.i18n import _, L_, get_locale
 from MoinMoin.themes import render_template
 from MoinMoin.storage.error import StorageError
 from MoinMoin.util.send_file import send_file
@@ -199,6 +199,7 @@ class Content(object):
             # FROM_mimetype --> DOM
             # if so we perform the transformation, otherwise we don't
             from MoinMoin.converter import default_registry as reg
+            from MoinMoin.converter._pool import convert as pooled_convert, fallback_document, ConversionLimitExceeded
             input_conv = reg.get(Type(self.contenttype), type_moin_document)
             if not input_conv:
                 raise TypeError("We cannot handle the conversion from {0} to the DOM tree".format(self.contenttype))
@@ -206,7 +207,15 @@ class Content(object):
 
             # We can process the conversion
             links = Iri(scheme='wiki', authority='', path='/' + self.name)
-            doc = input_conv(self.rev, self.contenttype)
+            try:
+                doc = pooled_convert(input_conv, self.rev, self.contenttype)
+            except ConversionLimitExceeded:
+                # neither cache the fallback nor renderings of it, converting
+                # might work later (e.g. with less load on the converter pool):
+                doc = fallback_document()
+                cid = None
+                if getattr(flaskg, 'render_dependencies', None) is not None:
+                    flaskg.render_dependencies.cacheable = False
             # XXX is the following assuming that the top element of the doc tree
             # is a moin_page.page element? if yes, this is the wrong place to do that
             # as not every doc will have that element (e.g. for images, we just get
@@ -236,6 +245,60 @@ class Content(object):
         return doc
 
     def _render_data(self):
+        """
+        Render the expanded document as html.
+
+        The result is cached per revision, item name and locale, together with
+        what the expansion depended on (see RenderDependencies). A cached
+        rendering is only reused if those dependencies are unchanged for the
+        current user.
+        """
+        revid = getattr(self.rev, 'revid', None)
+        if revid is not None:
+            cid = cache_key(usage="rendered_data",
+                            revid=revid,
+                            name=self.name,
+                            locale=unicode(get_locale()))
+            cached = app.cache.get(cid)
+            if cached is not None:
+                rendered_data, dependencies = cached
+                if self._dependencies_unchanged(dependencies):
+                    return rendered_data
+        else:
+            # likely a non-existing item
+            cid = None
+        from MoinMoin.converter._util import RenderDependencies
+        dependencies = RenderDependencies()
+        previous_dependencies = getattr(flaskg, 'render_dependencies', None)
+        flaskg.render_dependencies = dependencies
+        try:
+            rendered_data = self._render_data_uncached()
+        finally:
+            flaskg.render_dependencies = previous_dependencies
+        if cid and dependencies.cacheable:
+            app.cache.set(cid, (rendered_data, dependencies))
+        return rendered_data
+
+    def _dependencies_unchanged(self, dependencies):
+        """
+        Check if the link targets and transclusions of a cached rendering are
+        still the same, as seen by the current user
+        """
+        if not dependencies.cacheable:
+            return False
+        if dependencies.links:
+            existing = flaskg.storage.existing_names(dependencies.links)
+            for name, existed in dependencies.links.items():
+                if (name in existing) != existed:
+                    return False
+        if dependencies.transclusions:
+            revids = flaskg.unprotected_storage.latest_revids(dependencies.transclusions)
+            for fqname, (name, revid, readable) in dependencies.transclusions.items():
+                if revids.get(fqname) != revid or bool(flaskg.user.may.read(name)) != readable:
+                    return False
+        return True
+
+    def _render_data_uncached(self):
         try:
             from MoinMoin.converter import default_registry as reg
             # TODO: Real output format
@@ -254,6 +317,7 @@ class Content(object):
             import uuid
             error_id = uuid.uuid4()
             logging.exception("An exception happened in _render_data (error_id = %s ):" % error_id)
+            flaskg.render_dependencies.cacheable = False
             rendered_data = render_template('crash.html',
                                             server_time=time.strftime("%Y-%m-%d %H:%M:%S %Z"),
                                             url=request.url,
@@ -11,6 +11,8 @@ from MoinMoin.macro._base import MacroInlineBase
 
 
 class Macro(MacroInlineBase):
+    immutable = True
+
     def macro(self, content, arguments, page_url, alternative):
         if not arguments:
             raise ValueError("Anchor: you need to specify an anchor name.")
@@ -18,6 +18,8 @@ from MoinMoin.macro._base import MacroInlineBase
 
 class Macro(MacroInlineBase):
     """ Return a translation of args, or args as is """
+    immutable = True
+
     def macro(self, content, arguments, page_url, alternative):
         translation = ' '.join(arguments.positional)
         translation = _(translation)
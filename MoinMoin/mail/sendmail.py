@@ -10,6 +10,8 @@
 
 import os
 import re
+import smtplib
+import socket
 from email.header import Header
 
 from MoinMoin import log
@@ -59,7 +61,71 @@ def encodeAddress(address, charset):
         return str(address)
 
 
-def sendmail(subject, text, to=None, cc=None, bcc=None, mail_from=None, html=None):
+class SMTPConnection(object):
+    """
+    A connection to the configured SMTP server (mail_smarthost), opened on first
+    use and kept open, so many mails can be sent without reconnecting each time.
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.server = None
+
+    def connect(self):
+        cfg = self.cfg
+        logging.debug("trying to send mail (smtp) via smtp server '{0}'".format(cfg.mail_smarthost))
+        host, port = (cfg.mail_smarthost + ':25').split(':')[:2]
+        server = smtplib.SMTP(host, int(port))
+        try:
+            #server.set_debuglevel(1)
+            if cfg.mail_username is not None and cfg.mail_password is not None:
+                try:  # try to do TLS
+                    server.ehlo()
+                    if server.has_extn('starttls'):
+                        server.starttls()
+                        server.ehlo()
+                        logging.debug("tls connection to smtp server established")
+                except:
+                    logging.debug("could not establish a tls connection to smtp server, continuing without tls")
+                logging.debug("trying to log in to smtp server using account '{0}'".format(cfg.mail_username))
+                server.login(cfg.mail_username, cfg.mail_password)
+        except:
+            self._quit(server)
+            raise
+        self.server = server
+
+    def sendmail(self, mail_from, recipients, msg):
+        """
+        Send a mail, (re)connect to the SMTP server if needed.
+
+        :param recipients: list of recipient addresses
+        :param msg: the complete mail message
+        :type msg: str
+        """
+        if self.server is not None:
+            try:
+                self.server.sendmail(mail_from, recipients, msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                # the server closed our idle connection, try again with a new one
+                logging.debug("smtp server closed the connection, reconnecting")
+                self.server = None
+        self.connect()
+        self.server.sendmail(mail_from, recipients, msg)
+
+    def close(self):
+        if self.server is not None:
+            self._quit(self.server)
+            self.server = None
+
+    def _quit(self, server):
+        try:
+            server.quit()
+        except (AttributeError, smtplib.SMTPServerDisconnected):
+            # in case the connection failed, SMTP has no "sock" attribute
+            pass
+
+
+def sendmail(subject, text, to=None, cc=None, bcc=None, mail_from=None, html=None, connection=None):
     """ Create and send a text/plain message
 
     Return a tuple of success or error indicator and message.
@@ -78,12 +144,12 @@ def sendmail(subject, text, to=None, cc=None, bcc=None, mail_from=None, html=Non
     :type mail_from: unicode
     :param html: html email body text
     :type html: unicode
+    :param connection: SMTP connection to reuse (default: open a new one just for this mail)
+    :type connection: SMTPConnection
 
     :rtype: tuple
     :returns: (is_ok, Description of error or OK message)
     """
-    import smtplib
-    import socket
     from email.message import Message
     from email.mime.multipart import MIMEMultipart
     from email.mime.text import MIMEText
@@ -155,39 +221,27 @@ def sendmail(subject, text, to=None, cc=None, bcc=None, mail_from=None, html=Non
 
     # Send the message
     if not cfg.mail_sendmail:
+        if connection is None:
+            connection = SMTPConnection(cfg)
+            close = True
+        else:
+            close = False
         try:
-            logging.debug("trying to send mail (smtp) via smtp server '{0}'".format(cfg.mail_smarthost))
-            host, port = (cfg.mail_smarthost + ':25').split(':')[:2]
-            server = smtplib.SMTP(host, int(port))
-            try:
-                #server.set_debuglevel(1)
-                if cfg.mail_username is not None and cfg.mail_password is not None:
-                    try:  # try to do TLS
-                        server.ehlo()
-                        if server.has_extn('starttls'):
-                            server.starttls()
-                            server.ehlo()
-                            logging.debug("tls connection to smtp server established")
-                    except:
-                        logging.debug("could not establish a tls connection to smtp server, continuing without tls")
-                    logging.debug("trying to log in to smtp server using account '{0}'".format(cfg.mail_username))
-                    server.login(cfg.mail_username, cfg.mail_password)
-                server.sendmail(mail_from, (to or []) + (cc or []) + (bcc or []), msg.as_string())
-            finally:
-                try:
-                    server.quit()
-                except AttributeError:
-                    # in case the connection failed, SMTP has no "sock" attribute
-                    pass
+            connection.sendmail(mail_from, (to or []) + (cc or []) + (bcc or []), msg.as_string())
         except smtplib.SMTPException as e:
             logging.exception("smtp mail failed with an exception.")
+            connection.close()  # start over with a fresh connection next time
             return 0, str(e)
         except (os.error, socket.error) as e:
             logging.exception("smtp mail failed with an exception.")
+            connection.close()
             return (0, _("Connection to mailserver '%(server)s' failed: %(reason)s",
                     server=cfg.mail_smarthost,
                     reason=str(e)
             ))
+        finally:
+            if close:
+                connection.close()
     else:
         try:
             logging.debug("trying to send mail (sendmail)")
@@ -13,6 +13,7 @@ from MoinMoin import log
 logging = log.getLogger(__name__)
 
 from MoinMoin.constants.keys import LATEST_REVS, ALL_REVS
+from MoinMoin.storage.middleware.indexing import REBUILD_CHECKPOINT
 
 
 class IndexCreate(Command):
@@ -49,10 +50,17 @@ class IndexBuild(Command):
                help='Number of processors the writer will use.'),
         Option('--limitmb', '-l', required=False, dest='limitmb', type=int, default=10,
                help='Maximum memory (in megabytes) each index-writer will use for the indexing pool.'),
+        Option('--workers', '-w', required=False, dest='workers', type=int, default=1,
+               help='Number of processes retrieving and converting revisions in parallel.'),
+        Option('--resume', '-r', action="store_true", required=False, dest='resume', default=False,
+               help='Resume an interrupted build, skip revisions that are already indexed.'),
+        Option('--checkpoint', required=False, dest='checkpoint', type=int, default=REBUILD_CHECKPOINT,
+               help='Commit the index every that many revisions (a resumed build continues from there).'),
     ]
 
-    def run(self, tmp, procs, limitmb):
-        app.storage.rebuild(tmp=tmp, procs=procs, limitmb=limitmb)
+    def run(self, tmp, procs, limitmb, workers, resume, checkpoint):
+        app.storage.rebuild(tmp=tmp, procs=procs, limitmb=limitmb,
+                            workers=workers, resume=resume, checkpoint=checkpoint)
 
 
 class IndexUpdate(Command):
@@ -61,10 +69,12 @@ class IndexUpdate(Command):
     option_list = [
         Option('--tmp', action="store_true", required=False, dest='tmp', default=False,
                help='use the temporary location.'),
+        Option('--journal', '-j', action="store_true", required=False, dest='journal', default=False,
+               help='only replay the backend change journal since the last rebuild/update.'),
     ]
 
-    def run(self, tmp):
-        app.storage.update(tmp=tmp)
+    def run(self, tmp, journal):
+        app.storage.update(tmp=tmp, journal=journal)
 
 
 class IndexMove(Command):
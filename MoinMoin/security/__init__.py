@@ -271,7 +271,7 @@ class AccessControlList(AutoNe):
             that means that there is a valid user account present.
             works for subscription emails.
         """
-        if user.search_users(**{NAME_EXACT: name}):  # is a user with this name known?
+        if user.get_userid(name):  # is a user with this name known?
             return rightsdict.get(dowhat)
         return None
 
@@ -367,3 +367,43 @@ class ACLStringIterator(object):
             rights = [r for r in rights.split(',') if r in self.rights]
 
         return modifier, entries, rights
+
+
+def get_configured_acls(acl_mapping, fqname):
+    """
+    for a fully-qualified itemname (namespace:name), get the acl configuration
+    for that (part of the) namespace.
+
+    @param acl_mapping: list of (name_prefix, acls) tuples, longest prefix first, '' last
+    @param fqname: fully qualified itemname
+    @returns: acl configuration (acl dict from the acl_mapping)
+    """
+    itemname = fqname.value if fqname.field == NAME_EXACT else u''
+    for prefix, acls in acl_mapping:
+        if itemname.startswith(prefix):
+            return acls
+    else:
+        raise ValueError('No acl_mapping entry found for item {0!r}'.format(fqname))
+
+
+def acl_index_terms(full_acls, default, valid_rights):
+    """
+    normalize the (alternatively valid) full acls of an item to index terms.
+
+    For each entry and right, only the first rule is decisive, so we get one
+    u'<entry>:+<right>' or u'<entry>:-<right>' term per entry and right.
+    A user may have a right only if a term <principal>:+<right> is present
+    for some principal (user name, group, special user) applying to the user.
+    The reverse is not always true (e.g. an earlier rule for another
+    principal of the user might deny), so results still need checking.
+    """
+    terms = set()
+    for full_acl in full_acls:
+        aclobj = AccessControlList([full_acl, ], default=default, valid=valid_rights)
+        decided = set()
+        for entry, rightsdict in aclobj.acl:
+            for right, allowed in rightsdict.items():
+                if (entry, right) not in decided:
+                    decided.add((entry, right))
+                    terms.add(u'{0}:{1}{2}'.format(entry, u'+' if allowed else u'-', right))
+    return sorted(terms)
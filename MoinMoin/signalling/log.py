@@ -25,6 +25,12 @@ def log_item_modified(app, item_name, **kwargs):
     logging.info(u"item {0}:{1} modified".format(wiki_name, item_name))
 
 
+@items_modified.connect_via(ANY)
+def log_items_modified(app, item_names, **kwargs):
+    wiki_name = app.cfg.interwikiname
+    logging.info(u"{0} items of {1} modified".format(len(item_names), wiki_name))
+
+
 @got_request_exception.connect_via(ANY)
 def log_exception(sender, exception, **extra):
     logging.exception(exception)
@@ -14,3 +14,5 @@ _signals = Namespace()
 
 item_displayed = _signals.signal('item_displayed')
 item_modified = _signals.signal('item_modified')
+# sent once for many items modified by a bulk operation (instead of item_modified for each item):
+items_modified = _signals.signal('items_modified')
@@ -29,23 +29,27 @@ from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT, NAMESPACE_USERPROFI
 BACKEND_DEFAULT, BACKEND_USERPROFILES = u'default', u'userprofiles'
 
 
-def backend_from_uri(uri):
+def backend_from_uri(uri, journal=False):
     """
     create a backend instance for uri
+
+    :param journal: if True, the backend shall keep a change journal
     """
     backend_name_uri = uri.split(':', 1)
     if len(backend_name_uri) != 2:
         raise ValueError("malformed backend uri: {0}".format(uri))
     backend_name, backend_uri = backend_name_uri
     module = __import__(BACKENDS_PACKAGE + '.' + backend_name, globals(), locals(), ['MutableBackend', ])
+    if journal:
+        return module.MutableBackend.from_uri(backend_uri, journal=True)
     return module.MutableBackend.from_uri(backend_uri)
 
 
-def create_mapping(uri, namespaces, backends, acls):
+def create_mapping(uri, namespaces, backends, acls, journal=False):
     namespace_mapping = namespaces.items()
     acl_mapping = acls.items()
     backend_mapping = [
-        (backend_name, backend_from_uri(uri % dict(backend=backend_name, kind="%(kind)s")))
+        (backend_name, backend_from_uri(uri % dict(backend=backend_name, kind="%(kind)s"), journal))
         for backend_name in backends]
     # we need the longest mountpoints first, shortest last (-> '' is very last)
     namespace_mapping = sorted(namespace_mapping, key=lambda x: len(x[0]), reverse=True)
@@ -54,7 +58,7 @@ def create_mapping(uri, namespaces, backends, acls):
 
 
 def create_simple_mapping(uri='stores:fs:instance',
-                          default_acl=None, userprofiles_acl=None):
+                          default_acl=None, userprofiles_acl=None, journal=False):
     """
     When configuring storage, the admin needs to provide a namespace_mapping.
     To ease creation of such a mapping, this function provides sane defaults
@@ -77,6 +81,11 @@ def create_simple_mapping(uri='stores:fs:instance',
                  'stores:fs:/path/to/store/%(backend)s/%(kind)s' will create a mapping
                  using the 'stores' backend with 'fs' stores and everything will be stored
                  to below /path/to/store/.
+
+    :params journal: if True, the backends keep a change journal (for the 'stores'
+                     backend, %(kind)s also gets replaced by 'journal' to create the
+                     journal store), so the index can be updated incrementally
+                     (see moin index-update --journal).
     """
     # if no acls are given, use something mostly harmless:
     if not default_acl:
@@ -95,4 +104,4 @@ def create_simple_mapping(uri='stores:fs:instance',
         NAMESPACE_USERPROFILES + '/': userprofiles_acl,
         NAMESPACE_DEFAULT: default_acl,
     }
-    return create_mapping(uri, namespaces, backends, acls)
+    return create_mapping(uri, namespaces, backends, acls, journal)
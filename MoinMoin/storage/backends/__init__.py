@@ -9,8 +9,28 @@ MoinMoin - backend base classes
 
 from __future__ import absolute_import, division
 
+import time
+import threading
 from abc import abstractmethod, ABCMeta
 
+_journal_seq_lock = threading.Lock()
+_journal_seq_last = 0
+
+
+def journal_seq():
+    """
+    return a change journal sequence number for a change happening now
+
+    We use microseconds since the epoch, so journal entries sort roughly in
+    the order of the changes. Within a process, sequence numbers strictly
+    increase, but the clocks of different processes might differ or jump, so
+    nothing must depend on their order (see MutableBackendBase.journal).
+    """
+    global _journal_seq_last
+    with _journal_seq_lock:
+        _journal_seq_last = max(int(time.time() * 1000000), _journal_seq_last + 1)
+        return _journal_seq_last
+
 
 class BackendBase(object):
     """
@@ -54,6 +74,9 @@ class MutableBackendBase(BackendBase):
     """
     same as Backend, but read/write
     """
+    # True if store() and remove() append entries to a change journal
+    journaling = False
+
     @abstractmethod
     def create(self):
         """
@@ -77,3 +100,29 @@ class MutableBackendBase(BackendBase):
         """
         delete meta, data related to metaid from the backend
         """
+
+    def journal_keys(self):
+        """
+        return the set of the keys of the change journal entries
+        """
+        raise NotImplementedError("backend does not keep a change journal")
+
+    def journal(self, keys=None):
+        """
+        iterate over (key, entry) tuples of the change journal entries with these
+        keys (all entries if keys is None), ordered by key. Entries pruned
+        meanwhile are skipped.
+
+        Entries are dicts with the keys 'op' ('store' or 'remove'), REVID and ITEMID.
+
+        Keys start with a sequence number (see journal_seq), so the order is
+        roughly the order of the changes, but a later change might get a smaller
+        key: to find the entries added since some point, compare the sets of keys.
+        """
+        raise NotImplementedError("backend does not keep a change journal")
+
+    def prune_journal(self, keys):
+        """
+        remove the change journal entries with these keys
+        """
+        raise NotImplementedError("backend does not keep a change journal")
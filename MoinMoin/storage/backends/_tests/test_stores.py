@@ -11,6 +11,10 @@ Note: theoretically, it should be enough to test with one kind of store,
 
 from __future__ import absolute_import, division
 
+from StringIO import StringIO
+
+from MoinMoin.constants.keys import REVID, ITEMID
+
 from ..stores import MutableBackend
 from . import MutableBackendTestBase
 
@@ -26,6 +30,29 @@ class TestMemoryBackend(MutableBackendTestBase):
         self.be.create()
         self.be.open()
 
+
+class TestMemoryJournalBackend(TestMemoryBackend):
+    def setup_method(self, method):
+        self.be = MutableBackend(MemoryBytesStore(), MemoryFileStore(), MemoryBytesStore())
+        self.be.create()
+        self.be.open()
+
+    def test_journal(self):
+        assert self.be.journaling
+        metaid1 = self.be.store(dict(itemid=u'i1'), StringIO('1'))
+        metaid2 = self.be.store(dict(itemid=u'i2'), StringIO('2'))
+        self.be.remove(metaid1, destroy_data=True)
+        journal = list(self.be.journal())
+        assert [(entry['op'], entry[REVID], entry[ITEMID]) for key, entry in journal] == [
+            ('store', metaid1, u'i1'), ('store', metaid2, u'i2'), ('remove', metaid1, u'i1'), ]
+        keys = [key for key, entry in journal]
+        assert self.be.journal_keys() == set(keys)
+        assert [entry[REVID] for key, entry in self.be.journal(keys[1:])] == [metaid2, metaid1]
+        self.be.prune_journal(keys[:2])
+        assert [key for key, entry in self.be.journal()] == keys[2:]
+        # entries pruned meanwhile are skipped:
+        assert [key for key, entry in self.be.journal(keys)] == keys[2:]
+
 import os
 import tempfile
 
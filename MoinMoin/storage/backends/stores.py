@@ -15,6 +15,11 @@ A data store (a FileStore):
 - key = dataid UUID (bytes, ascii)
 - value = file (gets/returns open file instances, to read/write binary data)
 
+A journal store (a ByteStore, optional):
+
+- key = sequence number (zero padded, so keys sort in order) + '.' + UUID (bytes, ascii)
+- value = change journal entry (bytes, utf-8)
+
 See the stores package for already implemented key/value stores.
 """
 
@@ -23,10 +28,10 @@ from __future__ import absolute_import, division
 
 import json
 
-from MoinMoin.constants.keys import REVID, DATAID, SIZE, HASH_ALGORITHM
+from MoinMoin.constants.keys import REVID, ITEMID, DATAID, SIZE, HASH_ALGORITHM
 from MoinMoin.util.crypto import make_uuid
 
-from . import BackendBase, MutableBackendBase
+from . import BackendBase, MutableBackendBase, journal_seq
 from ._util import TrackingFileWrapper
 
 STORES_PACKAGE = 'MoinMoin.storage.stores'
@@ -37,12 +42,17 @@ class Backend(BackendBase):
     ties together a store for metadata and a store for data, readonly
     """
     @classmethod
-    def from_uri(cls, uri):
+    def _stores_module_uri(cls, uri):
         store_name_uri = uri.split(':', 1)
         if len(store_name_uri) != 2:
             raise ValueError("malformed store uri: {0}".format(uri))
         store_name, store_uri = store_name_uri
         module = __import__(STORES_PACKAGE + '.' + store_name, globals(), locals(), ['BytesStore', 'FileStore', ])
+        return module, store_uri
+
+    @classmethod
+    def from_uri(cls, uri):
+        module, store_uri = cls._stores_module_uri(uri)
         meta_store_uri = store_uri % dict(kind='meta')
         data_store_uri = store_uri % dict(kind='data')
         return cls(module.BytesStore.from_uri(meta_store_uri), module.FileStore.from_uri(data_store_uri))
@@ -98,13 +108,54 @@ class MutableBackend(Backend, MutableBackendBase):
     """
     same as Backend, but read/write
     """
+    @classmethod
+    def from_uri(cls, uri, journal=False):
+        """
+        :param journal: if True, also use a journal store (kind 'journal')
+        """
+        module, store_uri = cls._stores_module_uri(uri)
+        meta_store_uri = store_uri % dict(kind='meta')
+        data_store_uri = store_uri % dict(kind='data')
+        journal_store = None
+        if journal:
+            journal_store = module.BytesStore.from_uri(store_uri % dict(kind='journal'))
+        return cls(module.BytesStore.from_uri(meta_store_uri), module.FileStore.from_uri(data_store_uri),
+                   journal_store)
+
+    def __init__(self, meta_store, data_store, journal_store=None):
+        """
+        :param meta_store: a ByteStore for metadata
+        :param data_store: a FileStore for data
+        :param journal_store: a ByteStore for the change journal (optional)
+        """
+        super(MutableBackend, self).__init__(meta_store, data_store)
+        self.journal_store = journal_store
+
+    @property
+    def journaling(self):
+        return self.journal_store is not None
+
+    def open(self):
+        super(MutableBackend, self).open()
+        if self.journal_store is not None:
+            self.journal_store.open()
+
+    def close(self):
+        super(MutableBackend, self).close()
+        if self.journal_store is not None:
+            self.journal_store.close()
+
     def create(self):
         self.meta_store.create()
         self.data_store.create()
+        if self.journal_store is not None:
+            self.journal_store.create()
 
     def destroy(self):
         self.meta_store.destroy()
         self.data_store.destroy()
+        if self.journal_store is not None:
+            self.journal_store.destroy()
 
     def _serialize(self, meta):
         text = json.dumps(meta, ensure_ascii=False)
@@ -160,6 +211,8 @@ class MutableBackend(Backend, MutableBackendBase):
 
         # if something goes wrong below, the data shall be purged by a garbage collection
         metaid = self._store_meta(meta)
+        # journal after storing, so a journaled revision is always visible in the meta store:
+        self._append_journal('store', meta)
         return metaid
 
     def _del_meta(self, metaid):
@@ -174,3 +227,34 @@ class MutableBackend(Backend, MutableBackendBase):
         self._del_meta(metaid)
         if destroy_data:
             self._del_data(dataid)
+        self._append_journal('remove', meta)
+
+    def _append_journal(self, op, meta):
+        if self.journal_store is not None:
+            entry = {'op': op, REVID: meta[REVID], ITEMID: meta.get(ITEMID)}
+            key = '{0:020d}.{1}'.format(journal_seq(), make_uuid())
+            self.journal_store[key] = self._serialize(entry)
+
+    def journal_keys(self):
+        if self.journal_store is None:
+            raise NotImplementedError("backend has no journal store")
+        return set(self.journal_store)
+
+    def journal(self, keys=None):
+        if keys is None:
+            keys = self.journal_keys()
+        for key in sorted(keys):
+            try:
+                entry = self._deserialize(self.journal_store[key])
+            except KeyError:
+                # pruned meanwhile
+                continue
+            yield key, entry
+
+    def prune_journal(self, keys):
+        for key in keys:
+            try:
+                del self.journal_store[key]
+            except KeyError:
+                # pruned meanwhile
+                pass
@@ -45,3 +45,9 @@ class RevisionAlreadyExistsError(BackendError):
     """
     Raised if the Revision you are trying to create already exists.
     """
+
+
+class ReadOnlyError(StorageError):
+    """
+    Raised if something shall be modified in a read-only storage (e.g. the index of a replica).
+    """
@@ -10,16 +10,34 @@ from __future__ import absolute_import, division
 
 from StringIO import StringIO
 import hashlib
+import re
+import threading
 
 import pytest
 
 from flask import g as flaskg
+from flask import current_app as app
+
+from werkzeug.contrib.cache import NullCache, SimpleCache
 
 from MoinMoin.constants.keys import (NAME, SIZE, ITEMID, REVID, DATAID, HASH_ALGORITHM, CONTENT, COMMENT,
-                                     LATEST_REVS, ALL_REVS, NAMESPACE, NAMERE, NAMEPREFIX)
-from MoinMoin.constants.namespaces import NAMESPACE_USERPROFILES
+                                     LATEST_REVS, ALL_REVS, NAMESPACE, NAMERE, NAMEPREFIX,
+                                     CONTENTTYPE, ITEMLINKS, NAME_EXACT, EFFECTIVE_ACL, MTIME, FQNAME)
+from MoinMoin.constants.contenttypes import CONTENTTYPE_USER
+from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT, NAMESPACE_USERPROFILES
+
+from whoosh.query import Every, Term
 
 from MoinMoin.util.interwiki import split_fqname
+from MoinMoin.util.crypto import make_uuid
+from MoinMoin.storage.middleware.indexing import (convert_to_indexable, SubscriptionPatterns, UserNames,
+                                                  IndexingMiddleware, WHOOSH_FILESTORAGE, WHOOSH_RAMSTORAGE)
+from MoinMoin.storage.middleware.routing import Backend as RoutingBackend
+from MoinMoin.storage.backends import stores
+from MoinMoin.storage.backends.stores import MutableBackend
+from MoinMoin.storage.stores.memory import BytesStore as MemoryBytesStore
+from MoinMoin.storage.stores.memory import FileStore as MemoryFileStore
+from MoinMoin.storage.error import ReadOnlyError
 
 from MoinMoin.auth import GivenAuth
 from MoinMoin._tests import wikiconfig
@@ -239,6 +257,58 @@ class TestIndexingMiddleware(object):
         assert sorted(expected_latest_revs) == sorted(latest_revs)
         assert sorted(latest_revids) == sorted(expected_latest_revids)
 
+    def test_index_rebuild_parallel(self):
+        expected_latest_revids = []
+        for item_name in [u'foo', u'bar', u'baz', ]:
+            item = self.imw[item_name]
+            item.store_revision(dict(name=[item_name, ], mtime=1),
+                                StringIO('1st ' + str(item_name)), trusted=True)
+            r = item.store_revision(dict(name=[item_name, ], mtime=2),
+                                    StringIO('2nd ' + str(item_name)), trusted=True, return_rev=True)
+            expected_latest_revids.append(r.revid)
+        expected_all_revs = list(self.imw.documents(idx_name=ALL_REVS))
+
+        self.imw.close()
+        self.imw.destroy()
+        self.imw.create()
+        self.imw.rebuild(workers=2, checkpoint=2)
+        self.imw.open()
+
+        all_revs = list(self.imw.documents(idx_name=ALL_REVS))
+        latest_revids = [rev.revid for rev in self.imw.documents()]
+        assert sorted(expected_all_revs) == sorted(all_revs)
+        assert sorted(latest_revids) == sorted(expected_latest_revids)
+
+    def test_index_rebuild_resume(self):
+        expected_latest_revids = []
+        for item_name in [u'foo', u'bar', ]:
+            item = self.imw[item_name]
+            item.store_revision(dict(name=[item_name, ], mtime=1),
+                                StringIO('1st ' + str(item_name)), trusted=True)
+            r = item.store_revision(dict(name=[item_name, ], mtime=2),
+                                    StringIO('2nd ' + str(item_name)), trusted=True, return_rev=True)
+            expected_latest_revids.append(r.revid)
+        all_revids = sorted(doc[REVID] for doc in self.imw._documents(idx_name=ALL_REVS))
+
+        self.imw.close()
+        self.imw.destroy()
+        self.imw.create()
+        # simulate an interrupted rebuild that only committed some revisions:
+        index = self.imw.get_storage().open_index(ALL_REVS)
+        try:
+            revids = [(backend_name, revid) for backend_name, revid in self.imw.backend
+                      if revid in all_revids[:2]]
+            self.imw._add_documents(index, ALL_REVS, revids)
+        finally:
+            index.close()
+        self.imw.rebuild(resume=True)
+        self.imw.open()
+
+        # every revision must be indexed exactly once:
+        assert sorted(doc[REVID] for doc in self.imw._documents(idx_name=ALL_REVS)) == all_revids
+        latest_revids = [doc[REVID] for doc in self.imw._documents()]
+        assert sorted(latest_revids) == sorted(expected_latest_revids)
+
     def test_index_update(self):
         # first we index some stuff the slow "on-the-fly" way:
         expected_all_revids = []
@@ -337,6 +407,120 @@ class TestIndexingMiddleware(object):
         assert sorted(all_revids) == sorted(expected_all_revids)
         assert sorted(latest_revids) == sorted(expected_latest_revids)
 
+    def test_index_update_journal(self, monkeypatch):
+        # give the backends a change journal:
+        for backend in self.imw.backend.backends.values():
+            backend.journal_store = MemoryBytesStore()
+            backend.journal_store.create()
+            backend.journal_store.open()
+        item_name = u'updated'
+        item = self.imw[item_name]
+        r = item.store_revision(dict(name=[item_name, ], mtime=1),
+                                StringIO('updated 1st'),
+                                trusted=True, return_rev=True)
+        updated_revid1 = r.revid
+        item_name = u'destroyed'
+        item = self.imw[item_name]
+        r = item.store_revision(dict(name=[item_name, ], mtime=1),
+                                StringIO('destroyed 1st'),
+                                trusted=True, return_rev=True)
+        destroy_revid = r.revid
+
+        # build a fresh index at tmp location, this records the journal position:
+        self.imw.create(tmp=True)
+        self.imw.rebuild(tmp=True)
+
+        # these changes only go to the old index (and to the journal), with
+        # a clock that is behind the one of the rebuild:
+        monkeypatch.setattr(stores, 'journal_seq', lambda: 1)
+        item_name = u'updated'
+        item = self.imw[item_name]
+        r = item.store_revision(dict(name=[item_name, ], mtime=2),
+                                StringIO('updated 2nd'),
+                                trusted=True, return_rev=True)
+        updated_revid2 = r.revid
+        item_name = u'added'
+        item = self.imw[item_name]
+        r = item.store_revision(dict(name=[item_name, ], mtime=1),
+                                StringIO('added 1st'),
+                                trusted=True, return_rev=True)
+        added_revid = r.revid
+        item_name = u'destroyed'
+        item = self.imw[item_name]
+        item.destroy_revision(destroy_revid)
+
+        self.imw.close()
+        self.imw.move_index()
+        self.imw.update(journal=True)
+        self.imw.open()
+
+        all_revids = [doc[REVID] for doc in self.imw._documents(idx_name=ALL_REVS)]
+        latest_revids = [doc[REVID] for doc in self.imw._documents()]
+        assert sorted(all_revids) == sorted([updated_revid1, updated_revid2, added_revid])
+        assert sorted(latest_revids) == sorted([updated_revid2, added_revid])
+        # the replayed entries got pruned:
+        assert not self.imw.backend.journal_keys()
+
+    def test_commit_queue(self):
+        metas = [{NAME: [u'item{0}'.format(i), ], NAMESPACE: u'', ITEMID: make_uuid(), REVID: make_uuid()}
+                 for i in range(20)]
+        threads = [threading.Thread(target=self.imw.index_revision, args=(meta, u'content', u'default'))
+                   for meta in metas]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the searchers of this thread still show the index before the other threads' writes
+        self.imw.release_searchers()
+        expected_revids = sorted(meta[REVID] for meta in metas)
+        assert sorted(doc[REVID] for doc in self.imw._documents(idx_name=ALL_REVS)) == expected_revids
+        assert sorted(doc[REVID] for doc in self.imw._documents()) == expected_revids
+
+    def test_commit_queue_coalesce(self):
+        docs = [{ITEMID: u'1', REVID: u'a'}, {ITEMID: u'2', REVID: u'b'}, {ITEMID: u'1', REVID: u'c'}]
+        queue = self.imw.commit_queue
+        # later revisions of the same item replace earlier ones in the latest revs index:
+        assert queue._coalesce(LATEST_REVS, docs) == docs[1:]
+        assert queue._coalesce(ALL_REVS, docs) == docs
+
+    def test_history(self):
+        item_name = u'foo'
+        item = self.imw[item_name]
+        revids = []
+        for mtime in [1, 2, 3, ]:
+            rev = item.store_revision(dict(name=[item_name, ], mtime=mtime, comment=unicode(mtime)),
+                                      StringIO(str(mtime)), trusted=True, return_rev=True)
+            revids.append(rev.revid)
+        q = Term(ITEMID, rev.meta[ITEMID])
+        entries, more = self.imw.history(q, offset=0, limit=2)
+        assert [entry[REVID] for entry in entries] == [revids[2], revids[1], ]
+        assert [entry[MTIME] for entry in entries] == [3, 2, ]
+        assert entries[0][COMMENT] == u'3'
+        assert entries[0][FQNAME] == split_fqname(item_name)
+        assert CONTENT not in entries[0]
+        assert more
+        entries, more = self.imw.history(q, offset=2, limit=2)
+        assert [entry[REVID] for entry in entries] == [revids[0], ]
+        assert not more
+        entries, more = self.imw.history(q)
+        assert len(entries) == 3
+        assert not more
+
+    def test_batch(self):
+        indexer = getattr(self.imw, 'indexer', self.imw)
+        generation = indexer.index_generation()
+        with self.imw.batch():
+            for item_name in [u'foo', u'bar', ]:
+                item = self.imw[item_name]
+                rev = item.store_revision(dict(name=[item_name, ], contenttype=u'text/plain;charset=utf-8'),
+                                          StringIO(str(item_name)), return_rev=True)
+                assert rev.name == item_name
+                # not indexed before the end of the batch
+                assert self.imw.document(name_exact=item_name) is None
+        assert indexer.index_generation() == generation + 1  # one commit
+        assert self.imw.document(name_exact=u'foo').revid is not None
+        assert self.imw.document(name_exact=u'bar').revid == rev.revid
+
     def test_revision_contextmanager(self):
         # check if rev.data is closed after leaving the with-block
         item_name = u'foo'
@@ -369,6 +553,73 @@ class TestIndexingMiddleware(object):
         assert expected_revid == doc[REVID]
         assert unicode(data) == doc[CONTENT]
 
+    def test_all_revs_content(self):
+        item = self.imw[u'foo']
+        meta = dict(name=[u'foo', ], contenttype=u'text/plain;charset=utf-8')
+        r1 = item.store_revision(meta, StringIO('old content\n'), return_rev=True)
+        r2 = item.store_revision(meta, StringIO('new content\n'), return_rev=True)
+        # the content of all revisions is searchable, but not stored in the all revs index
+        doc1 = self.imw._document(idx_name=ALL_REVS, content=u'old')
+        assert doc1[REVID] == r1.revid
+        assert CONTENT not in doc1
+        assert self.imw.indexed_content(doc1) == u'old content\n'
+        doc2 = self.imw._document(idx_name=ALL_REVS, revid=r2.revid)
+        assert self.imw.indexed_content(doc2) == u'new content\n'
+        # the latest revs index has it, with the latest revision removed, we get the content of r1
+        item.destroy_revision(r2.revid)
+        assert self.imw._document(itemid=r1.meta[ITEMID])[CONTENT] == u'old content\n'
+
+    def test_indexable_cache(self):
+        meta = {NAME: [u'foo', ], CONTENTTYPE: u'text/x.moin.wiki;charset=utf-8', HASH_ALGORITHM: u'0' * 40}
+        saved_cache = app.cache
+        app.cache = SimpleCache()
+        try:
+            content = convert_to_indexable(dict(meta), StringIO('some [[bar]] text'), is_new=True)
+            assert u'some' in content
+            # same data hash: the cached content and links are used, data is not converted again
+            cached_meta = dict(meta)
+            assert convert_to_indexable(cached_meta, StringIO('other text'), is_new=True) == content
+            assert cached_meta[ITEMLINKS] == [u'bar', ]
+            assert convert_to_indexable(dict(meta), StringIO('other text')) == content
+            # different contenttype: data gets converted
+            meta[CONTENTTYPE] = u'text/plain;charset=utf-8'
+            assert convert_to_indexable(meta, StringIO('other text')).startswith(u'other text')
+        finally:
+            app.cache = saved_cache
+
+    def test_preprocess_hash(self):
+        item = self.imw[u'foo']
+        item = getattr(item, 'item', item)  # the unprotected item
+        meta = {NAME: [u'foo', ], CONTENTTYPE: u'text/plain;charset=utf-8'}
+        # no cache: the data hash only gets computed (once) when storing
+        assert isinstance(app.cache.cache, NullCache)
+        meta, data, content = item.preprocess(dict(meta), StringIO('some text'))
+        assert HASH_ALGORITHM not in meta
+        saved_cache = app.cache
+        app.cache = SimpleCache()
+        try:
+            # the hash is the cache key for the indexable content
+            meta, data, content = item.preprocess(dict(meta), StringIO('some text'))
+            assert meta[HASH_ALGORITHM] == hashlib.new(HASH_ALGORITHM, 'some text').hexdigest()
+        finally:
+            app.cache = saved_cache
+
+    def test_indexable_max_size(self):
+        meta = {NAME: [u'foo', ], CONTENTTYPE: u'text/x.moin.wiki;charset=utf-8'}
+        # more than one buffer full of data, links at the start and at the end:
+        data = u'[[bar]]\n\n' + u'some text\n\n' * 10000 + u'[[baz]]\n'
+        saved_max_size = app.cfg.index_content_max_size
+        app.cfg.index_content_max_size = 1000
+        try:
+            content = convert_to_indexable(meta, StringIO(data.encode('utf-8')), is_new=True)
+            assert content.startswith(u'bar\nsome text\nsome text\n')
+            assert len(content) == 1000
+            # links and transclusions are extracted from all of the data
+            assert sorted(meta[ITEMLINKS]) == [u'bar', u'baz', ]
+            assert convert_to_indexable(dict(meta), StringIO(data.encode('utf-8'))) == content
+        finally:
+            app.cfg.index_content_max_size = saved_max_size
+
     def test_indexing_subscriptions(self):
         item_name = u"foo"
         meta = dict(name=[item_name, ], subscriptions=[u"{0}::foo".format(NAME),
@@ -412,6 +663,455 @@ class TestIndexingMiddleware(object):
         item = self.imw[item_name]
         assert item.parentnames == [u'p1', u'p2', u'p3/p4', ]  # one p2 duplicate removed
 
+    def test_tag_counts(self):
+        item = self.imw[u'a']
+        item.store_revision(dict(name=[u'a', ], tags=[u'x', u'y', ]), StringIO(''))
+        item = self.imw[u'b']
+        item.store_revision(dict(name=[u'b', ], tags=[u'x', ]), StringIO(''))
+        item = self.imw[u'c']
+        item.store_revision(dict(name=[u'c', ]), StringIO(''))
+        assert self.imw.tag_counts() == {u'x': 2, u'y': 1}
+        assert self.imw.tag_counts(name_exact=u'a') == {u'x': 1, u'y': 1}
+        # cached counts get invalidated when the index changes
+        item = self.imw[u'c']
+        item.store_revision(dict(name=[u'c', ], tags=[u'z', ]), StringIO(''))
+        assert self.imw.tag_counts() == {u'x': 2, u'y': 1, u'z': 1}
+
+    def test_link_graph(self):
+        def store(name, data):
+            item = self.imw[name]
+            return item.store_revision(dict(name=[name, ], contenttype=u'text/x.moin.wiki;charset=utf-8'),
+                                       StringIO(data), return_rev=True)
+
+        fq = split_fqname
+        store(u'a', '[[b]] [[c]]')
+        store(u'b', '{{d}}')
+        graph = self.imw.link_graph()
+        assert graph.wanted_items() == set([fq(u'c'), fq(u'd')])
+        assert graph.orphaned_items() == set([fq(u'a')])
+        assert graph.forwardrefs(fq(u'a')) == set([fq(u'b'), fq(u'c')])
+        assert graph.forwardrefs(fq(u'b'), transclusions=False) == set()
+        assert graph.backrefs(fq(u'd')) == set([fq(u'b')])
+        assert graph.exists(fq(u'b'))
+        assert not graph.exists(fq(u'c'))
+        # graph gets updated by index_revision
+        store(u'c', '[[a]]')
+        assert self.imw.link_graph() is graph
+        assert graph.wanted_items() == set([fq(u'd')])
+        assert graph.orphaned_items() == set()
+        assert graph.backrefs(fq(u'a')) == set([fq(u'c')])
+        # ... and by remove_revision
+        rev = store(u'b', '')
+        assert graph.wanted_items() == set()
+        assert graph.backrefs(fq(u'd')) == set()
+        self.imw[u'b'].destroy_revision(rev.revid)
+        assert graph.wanted_items() == set([fq(u'd')])
+        self.imw[u'c'].destroy_all_revisions()
+        assert graph.wanted_items() == set([fq(u'c'), fq(u'd')])
+        assert graph.orphaned_items() == set([fq(u'a')])
+        # a rebuilt index gets loaded into a fresh graph
+        self.imw.rebuild()
+        self.imw.close()
+        self.imw.open()
+        graph = self.imw.link_graph()
+        assert graph.wanted_items() == set([fq(u'c'), fq(u'd')])
+        assert graph.backrefs(fq(u'c')) == set([fq(u'a')])
+
+    def test_transclusion_closure(self):
+        def store(name, data):
+            item = self.imw[name]
+            return item.store_revision(dict(name=[name, ], contenttype=u'text/x.moin.wiki;charset=utf-8'),
+                                       StringIO(data), return_rev=True).meta[ITEMID]
+
+        fq = split_fqname
+        a = store(u'a', '{{b}}')
+        b = store(u'b', '{{c}}')
+        c = store(u'c', '{{a}} {{x}}')  # a cycle and a non-existing item
+        d = store(u'd', '{{b}}')
+        e = store(u'a/e', '{{e}}')
+        store(u'e', '')
+        graph = self.imw.link_graph()
+        assert graph.transclusion_closure([fq(u'a'), ]) == set([b, c])
+        assert graph.transclusion_closure([fq(u'd'), ]) == set([a, b, c])
+        assert graph.reverse_transclusion_closure(fq(u'c')) == set([a, b, d])
+        # closures get updated when transclusions change
+        store(u'b', '')
+        assert graph.transclusion_closure([fq(u'a'), ]) == set([b])
+        assert graph.reverse_transclusion_closure(fq(u'c')) == set()
+        # scope: item, sub items and their transclusions
+        with self.imw.ix[LATEST_REVS].searcher() as searcher:
+            docnums = self.imw.scope_filter(searcher, u'a')
+            itemids = set(searcher.stored_fields(docnum)[ITEMID] for docnum in docnums)
+        assert itemids == set([a, b, e, self.imw[u'e'].itemid])
+
+    def test_name_tree(self):
+        for name in [u'a', u'a/b/c', u'a/d', u'B', ]:
+            item = self.imw[name]
+            item.store_revision(dict(name=[name, ], contenttype=u'text/plain;charset=utf-8'), StringIO(''))
+        tree = self.imw.name_tree()
+        assert tree.subitems(u'', u'') == ([(u'B', True, 0), (u'a', True, 2), ], 2)
+        assert tree.subitems(u'', u'a') == ([(u'b', False, 1), (u'd', True, 0), ], 2)
+        assert tree.subitems(u'', u'a', offset=1, limit=1) == ([(u'd', True, 0), ], 2)
+        assert tree.subitems(u'', u'', startswith=u'b') == ([(u'B', True, 0), ], 1)
+        assert tree.name_initials(u'', u'a') == [u'b', u'd', ]
+        # nodes without names below vanish when the names get removed
+        self.imw[u'a/b/c'].destroy_all_revisions()
+        assert tree.subitems(u'', u'a') == ([(u'd', True, 0), ], 1)
+        assert tree.name_initials(u'', u'a') == [u'd', ]
+        assert not tree.exists(u'', u'a/b/c')
+
+    def test_latest_revids(self):
+        item = self.imw[u'foo']
+        r1 = item.store_revision(dict(name=[u'foo', ], contenttype=u'text/plain;charset=utf-8'), StringIO('1'), return_rev=True)
+        r2 = item.store_revision(dict(name=[u'foo', ], contenttype=u'text/plain;charset=utf-8'), StringIO('2'), return_rev=True)
+        foo, bar = split_fqname(u'foo'), split_fqname(u'bar')
+        assert self.imw.latest_revids([foo, bar]) == {foo: r2.revid}
+        assert self.imw.latest_revids([]) == {}
+
+    def test_searcher_pool(self):
+        def store(name):
+            item = self.imw[name]
+            item.store_revision(dict(name=[name, ], contenttype=u'text/plain;charset=utf-8'), StringIO(''))
+
+        self.imw.release_searchers()
+        with self.imw.searcher() as searcher:
+            pass
+        # the thread keeps using its searcher
+        with self.imw.searcher() as pinned:
+            assert pinned is searcher
+        # but sees its own modifications
+        store(u'foo')
+        with self.imw.searcher() as searcher:
+            assert searcher.document(name_exact=u'foo') is not None
+        with self.imw.searcher() as outer:
+            store(u'bar')
+            # the outer searcher is still in use, it does not get refreshed
+            with self.imw.searcher() as inner:
+                assert inner is not outer
+                assert inner.document(name_exact=u'bar') is not None
+            assert outer.document(name_exact=u'bar') is None
+        # after modifying the index, the thread also sees later commits (e.g. an
+        # AsyncWriter might commit its modification after it returned):
+        self.imw._index_modified()
+        with self.imw.searcher() as searcher:
+            assert searcher.document(name_exact=u'baz') is None
+        meta = {NAME: [u'baz', ], NAMESPACE: u'', ITEMID: make_uuid(), REVID: make_uuid()}
+        thread = threading.Thread(target=self.imw.index_revision, args=(meta, u'content', u'default'))
+        thread.start()
+        thread.join()
+        with self.imw.searcher() as searcher:
+            assert searcher.document(name_exact=u'baz') is not None
+        stats = self.imw.searcher_stats()[LATEST_REVS]
+        assert stats['reused'] >= 1
+        assert stats['reopened'] >= 1
+        # released searchers are reused by the next request (reopened if outdated)
+        self.imw.release_searchers()
+        opened = stats['opened']
+        with self.imw.searcher() as searcher:
+            assert searcher.document(name_exact=u'bar') is not None
+        assert self.imw.searcher_stats()[LATEST_REVS]['opened'] == opened
+
+    def test_subscription_patterns(self):
+        patterns = SubscriptionPatterns()
+        patterns.load([dict(itemid=u'u1', subscription_patterns=[u'nameprefix::Front', u'namere::Pag+e$', ]),
+                       dict(itemid=u'u2', subscription_patterns=[u'nameprefix::Front', u'namere:other:.*', ]),
+                       dict(itemid=u'u3', subscription_patterns=[u'namere::(', ]),  # invalid regex
+                       dict(itemid=u'i1', name=[u'FrontPage', ]), ], 1)
+        assert patterns.matches(u'', [u'FrontPage', ]) == set([u'nameprefix::Front', u'namere::Pag+e$', ])
+        assert patterns.matches(u'', [u'Fro', u'BackPage', ]) == set([u'namere::Pag+e$', ])
+        assert patterns.matches(u'other', [u'FrontPage', ]) == set([u'namere:other:.*', ])
+        # subscriptions are kept as long as some user has them
+        patterns.update(u'u1', dict(itemid=u'u1', subscription_patterns=[u'nameprefix::', ]))
+        assert patterns.matches(u'', [u'FrontPage', ]) == set([u'nameprefix::Front', u'nameprefix::', ])
+        patterns.update(u'u2', None)
+        assert patterns.matches(u'', [u'FrontPage', ]) == set([u'nameprefix::', ])
+        assert patterns.matches(u'other', [u'FrontPage', ]) == set()
+
+    def test_user_names(self):
+        def profile(itemid, name):
+            return dict(itemid=itemid, namespace=NAMESPACE_USERPROFILES, contenttype=CONTENTTYPE_USER, name=[name, ])
+
+        names = UserNames()
+        names.load([profile(u'u1', u'JoeDoe'), dict(itemid=u'i1', name=[u'JaneDoe', ]), ], 1)
+        assert names.itemid(u'JoeDoe') == u'u1'
+        assert names.get_names(u'u1') == [u'JoeDoe', ]
+        assert names.itemid(u'JaneDoe') is None
+        # renamed user:
+        names.update(u'u1', profile(u'u1', u'JohnDoe'))
+        assert names.itemid(u'JoeDoe') is None
+        assert names.itemid(u'JohnDoe') == u'u1'
+        names.update(u'u1', None)
+        assert names.itemid(u'JohnDoe') is None
+        assert names.get_names(u'u1') == []
+
+    def test_name_index(self):
+        def store(names):
+            item = self.imw[names[0]]
+            return item.store_revision(dict(name=names, contenttype=u'text/plain;charset=utf-8'),
+                                       StringIO(''), return_rev=True)
+
+        fq = split_fqname
+        store([u'FrontPage', ])
+        store([u'FrontPage/Sub', u'Other', ])
+        store([u'BackPage', ])
+        index = self.imw.name_index()
+        assert index.prefixed(u'Front') == set([fq(u'FrontPage'), fq(u'FrontPage/Sub')])
+        assert index.prefixed(u'FrontPage/') == set([fq(u'FrontPage/Sub')])
+        assert index.suffixed(u'Page') == set([fq(u'FrontPage'), fq(u'BackPage')])
+        assert index.matching(re.compile(u'^[A-Z][a-z]+Page$')) == set([fq(u'FrontPage'), fq(u'BackPage')])
+        assert index.similar(u'frontpag')[0] == fq(u'FrontPage')
+        assert fq(u'Other') not in index.similar(u'FrontPage')
+        # index gets updated by index_revision and remove_revision
+        rev = store([u'FrontPage/Sub', ])
+        assert self.imw.name_index() is index
+        assert index.prefixed(u'O') == set()
+        self.imw[u'FrontPage/Sub'].destroy_revision(rev.revid)
+        assert index.prefixed(u'O') == set([fq(u'Other')])
+        self.imw[u'BackPage'].destroy_all_revisions()
+        assert index.suffixed(u'Page') == set([fq(u'FrontPage')])
+        assert index.similar(u'BackPage')[0] == fq(u'FrontPage')
+        assert fq(u'BackPage') not in index.similar(u'BackPage')
+
+    def test_memory_index_other_process(self):
+        store = lambda imw, name: imw[name].store_revision(dict(name=[name, ]), StringIO(''))
+        store(self.imw, u'Local1')
+        index = self.imw.name_index()
+        assert index.prefixed(u'Local') == set([split_fqname(u'Local1')])
+        # another process modifies the index, then we do:
+        other = IndexingMiddleware(self.imw.index_storage, self.imw.backend, wiki_name=self.imw.wikiname,
+                                   commit_max_docs=0)
+        other.open()
+        try:
+            store(other, u'Other')
+            itemid = make_uuid()
+            other.get_item(itemid=itemid).store_revision(dict(itemid=itemid, name=[u'JoeDoe', ],
+                                                              namespace=NAMESPACE_USERPROFILES,
+                                                              contenttype=CONTENTTYPE_USER), StringIO(''))
+        finally:
+            other.close()
+        store(self.imw, u'Local2')
+        # we must not take the other process' modifications for our own:
+        assert self.imw.name_index().prefixed(u'Other') == set([split_fqname(u'Other')])
+        assert self.imw.name_index().prefixed(u'Local') == set([split_fqname(u'Local1'), split_fqname(u'Local2')])
+        assert self.imw.user_names().itemid(u'JoeDoe') == itemid
+        # our own modifications do not need a sync:
+        index = self.imw.name_index()
+        segments = self.imw._memory_segments
+        store(self.imw, u'Local3')
+        assert self.imw.name_index() is index
+        assert self.imw._memory_segments is segments
+        assert index.generation == self.imw.index_generation()
+        assert u'Local3' in [fqname.value for fqname in index.prefixed(u'Local3')]
+
+    def test_memory_index_sync(self, monkeypatch):
+        store = lambda imw, name, itemid=None: imw.get_item(itemid=itemid or make_uuid()).store_revision(
+            dict(name=[name, ], contenttype=u'text/plain;charset=utf-8'), StringIO(''), return_rev=True)
+
+        def other_process(modify):
+            other = IndexingMiddleware(self.imw.index_storage, self.imw.backend, wiki_name=self.imw.wikiname,
+                                       commit_max_docs=0)
+            other.open()
+            try:
+                modify(other)
+            finally:
+                other.close()
+
+        for i in range(10):
+            store(self.imw, u'Local{0}'.format(i))
+        renamed = store(self.imw, u'Renamed')
+        other_process(lambda other: store(other, u'Other'))
+        assert len(self.imw.name_index().prefixed(u'Local')) == 10
+        # another process adds, renames and removes items:
+
+        def modify(other):
+            store(other, u'Other2')
+            store(other, u'Renamed2', renamed.meta[ITEMID])
+            other[u'Local1'].destroy_all_revisions()
+        other_process(modify)
+        # we only read the changed documents, not all:
+        documents = []
+        memory_document = self.imw._memory_document
+
+        def counting_memory_document(doc):
+            documents.append(doc[NAME])
+            return memory_document(doc)
+        monkeypatch.setattr(self.imw, '_memory_document', counting_memory_document)
+        index = self.imw.name_index()
+        assert set(fqname.value for fqname in index.prefixed(u'')) == set(
+            [u'Local{0}'.format(i) for i in range(10) if i != 1] + [u'Other', u'Other2', u'Renamed2', ])
+        assert self.imw.name_tree().exists(u'', u'Renamed2')
+        assert not self.imw.name_tree().exists(u'', u'Renamed')
+        assert self.imw.link_graph().exists(split_fqname(u'Other2'))
+        assert sorted(documents) == [[u'Other2', ], [u'Renamed2', ], ]
+
+    def test_changed_names(self):
+        change, names = self.imw.changed_names(None)
+        assert names is None  # we do not know what changed before
+        item = self.imw[u'Local']
+        rev = item.store_revision(dict(name=[u'Local', ], contenttype=u'text/plain;charset=utf-8'), StringIO(''),
+                                  return_rev=True)
+        change, names = self.imw.changed_names(change)
+        assert names == set([u'Local', ])
+        assert self.imw.changed_names(change) == (change, set())
+        # another process renames it:
+        other = IndexingMiddleware(self.imw.index_storage, self.imw.backend, wiki_name=self.imw.wikiname,
+                                   commit_max_docs=0)
+        other.open()
+        try:
+            other.get_item(itemid=rev.meta[ITEMID]).store_revision(
+                dict(name=[u'Renamed', ], contenttype=u'text/plain;charset=utf-8'), StringIO(''))
+        finally:
+            other.close()
+        assert self.imw.changed_names(change)[1] == set([u'Local', u'Renamed', ])
+
+
+class TestEffectiveAcl(object):
+    reinit_storage = True  # cleanup after each test method
+
+    class Config(wikiconfig.Config):
+        default_acl = dict(before=u'', default=u'All:read,write,create', after=u'', hierarchic=True)
+
+    def setup_method(self, method):
+        self.imw = flaskg.unprotected_storage
+
+    def effective_acl(self, item_name):
+        return self.imw._document(**{NAME_EXACT: item_name})[EFFECTIVE_ACL]
+
+    def test_effective_acl(self):
+        item = self.imw[u'noacl']
+        item.store_revision(dict(name=[u'noacl', ]), StringIO(''))
+        assert u'All:+read' in self.effective_acl(u'noacl')
+        item = self.imw[u'acl']
+        item.store_revision(dict(name=[u'acl', ], acl=u'joe:read'), StringIO(''))
+        effective_acl = self.effective_acl(u'acl')
+        assert u'joe:+read' in effective_acl
+        assert u'joe:-write' in effective_acl
+        assert u'All:+read' not in effective_acl
+
+    def test_effective_acl_hierarchic(self):
+        item = self.imw[u'p']
+        item.store_revision(dict(name=[u'p', ], acl=u'boss:read', mtime=1), StringIO(''), trusted=True)
+        item = self.imw[u'p/c']
+        item.store_revision(dict(name=[u'p/c', ]), StringIO(''))
+        item = self.imw[u'p/c/g']
+        item.store_revision(dict(name=[u'p/c/g', ]), StringIO(''))
+        assert u'boss:+read' in self.effective_acl(u'p/c')
+        assert u'boss:+read' in self.effective_acl(u'p/c/g')
+        # changing the parent's ACL changes the effective ACLs of all sub items
+        # (determined from their stored index fields, without backend access):
+        sub_revids = set(self.imw._document(**{NAME_EXACT: name})[REVID] for name in [u'p/c', u'p/c/g', ])
+        retrieved = []
+        retrieve = self.imw.backend.retrieve
+        self.imw.backend.retrieve = lambda backend_name, revid: retrieved.append(revid) or retrieve(backend_name, revid)
+        try:
+            item = self.imw[u'p']
+            item.store_revision(dict(name=[u'p', ], acl=u'joe:read', mtime=2), StringIO(''), trusted=True)
+        finally:
+            del self.imw.backend.retrieve
+        assert not sub_revids & set(retrieved)
+        for item_name in [u'p/c', u'p/c/g', ]:
+            effective_acl = self.effective_acl(item_name)
+            assert u'joe:+read' in effective_acl
+            assert u'boss:+read' not in effective_acl
+        # a rebuilt index has the same effective ACLs:
+        expected = dict((item_name, self.effective_acl(item_name)) for item_name in [u'p', u'p/c', u'p/c/g', ])
+        self.imw.close()
+        self.imw.destroy()
+        self.imw.create()
+        self.imw.rebuild()
+        self.imw.open()
+        for item_name, effective_acl in expected.items():
+            assert self.effective_acl(item_name) == effective_acl
+
+
+class TestIndexStorage(object):
+    def setup_method(self, method):
+        self.backend = RoutingBackend([(NAMESPACE_DEFAULT, u'backend')],
+                                      {u'backend': MutableBackend(MemoryBytesStore(), MemoryFileStore())})
+        self.backend.create()
+        self.backend.open()
+
+    def teardown_method(self, method):
+        self.backend.close()
+        self.backend.destroy()
+
+    def names(self, imw):
+        return sorted(rev.name for rev in imw.documents())
+
+    def test_ram_storage(self, tmpdir):
+        snapshot_dir = str(tmpdir / 'index')
+        imw = IndexingMiddleware((WHOOSH_RAMSTORAGE, (snapshot_dir, ), {}), self.backend)
+        imw.create()
+        imw.open()
+        imw[u'foo'].store_revision(dict(name=[u'foo', ]), StringIO('foo'))
+        assert self.names(imw) == [u'foo']
+        imw.close()
+        # another process (e.g. after a restart) loads the snapshot written by close:
+        imw = IndexingMiddleware((WHOOSH_RAMSTORAGE, (snapshot_dir, ), {}), self.backend)
+        imw.open()
+        assert self.names(imw) == [u'foo']
+        imw[u'bar'].store_revision(dict(name=[u'bar', ]), StringIO('bar'))
+        imw.close()
+        # rebuild at the tmp location and move the indexes:
+        imw = IndexingMiddleware((WHOOSH_RAMSTORAGE, (snapshot_dir, ), {}), self.backend)
+        imw.create(tmp=True)
+        imw.rebuild(tmp=True, procs=2)
+        imw.move_index()
+        assert not tmpdir.join('index.temp').check()
+        imw.open()
+        assert self.names(imw) == [u'bar', u'foo']
+        imw.close()
+        imw.destroy()
+        assert not tmpdir.join('index').check()
+
+    def test_ram_storage_snapshot_interval(self, tmpdir):
+        snapshot_dir = str(tmpdir / 'index')
+        imw = IndexingMiddleware((WHOOSH_RAMSTORAGE, (snapshot_dir, ), {}), self.backend, snapshot_interval=1)
+        imw.create()
+        imw.open()
+        imw._snapshot_time -= 2
+        imw[u'foo'].store_revision(dict(name=[u'foo', ]), StringIO('foo'))
+        # the snapshot is done in a background thread, not by the saving request:
+        imw._snapshot_thread.join()
+        # not closed (e.g. killed), but we have a snapshot with the new revision:
+        restarted = IndexingMiddleware((WHOOSH_RAMSTORAGE, (snapshot_dir, ), {}), self.backend)
+        restarted.open()
+        assert self.names(restarted) == [u'foo']
+        restarted.close()
+        imw.close()
+
+    def test_ram_storage_no_snapshot(self):
+        imw = IndexingMiddleware((WHOOSH_RAMSTORAGE, (), {}), self.backend)
+        imw.create()
+        imw.open()
+        imw[u'foo'].store_revision(dict(name=[u'foo', ]), StringIO('foo'))
+        assert self.names(imw) == [u'foo']
+        imw.close()
+        imw.destroy()
+
+    def test_readonly_file_storage(self, tmpdir):
+        index_dir = str(tmpdir / 'index')
+        primary = IndexingMiddleware((WHOOSH_FILESTORAGE, (index_dir, ), {}), self.backend)
+        primary.create()
+        primary.open()
+        primary[u'foo'].store_revision(dict(name=[u'foo', ]), StringIO('foo'))
+        replica = IndexingMiddleware((WHOOSH_FILESTORAGE, (index_dir, ), dict(readonly=True)), self.backend)
+        replica.open()
+        try:
+            assert replica.commit_queue is None
+            assert self.names(replica) == [u'foo']
+            with pytest.raises(ReadOnlyError):
+                replica[u'bar'].store_revision(dict(name=[u'bar', ]), StringIO('bar'))
+            assert len(list(self.backend)) == 1  # nothing stored
+            # the replica sees modifications of the primary:
+            primary[u'baz'].store_revision(dict(name=[u'baz', ]), StringIO('baz'))
+            replica.release_searchers()
+            assert self.names(replica) == [u'baz', u'foo']
+        finally:
+            replica.close()
+            primary.close()
+            primary.destroy()
+
 
 class TestProtectedIndexingMiddleware(object):
     reinit_storage = True  # cleanup after each test method
@@ -435,6 +1135,38 @@ class TestProtectedIndexingMiddleware(object):
                   if rev.name != u'joe']  # the user profile is a revision in the backend
         assert revids == [revid_public]
 
+    def test_search_page_acl_filter(self):
+        revids_public = []
+        for i in range(3):
+            item_name = u'public{0}'.format(i)
+            r = self.imw[item_name].store_revision(dict(name=[item_name, ], acl=u'joe:read,write'),
+                                                   StringIO('public content'), return_rev=True)
+            revids_public.append(r.revid)
+            item_name = u'private{0}'.format(i)
+            self.imw.indexer[item_name].store_revision(dict(name=[item_name, ], acl=u'boss:read'),
+                                                       StringIO('private content'))
+        # filtering happens in the index, so we get full pages of readable revisions:
+        revids = [rev.revid for rev in self.imw.search_page(Every(), pagelen=2)]
+        assert len(revids) == 2
+        revids = [rev.revid for rev in self.imw.search(Every(), limit=3)]
+        assert sorted(revids) == sorted(revids_public)
+
+    def test_tag_counts(self):
+        self.imw[u'public'].store_revision(dict(name=[u'public', ], acl=u'joe:read,write', tags=[u'a', u'b', ]),
+                                           StringIO(''))
+        self.imw.indexer[u'private'].store_revision(dict(name=[u'private', ], acl=u'boss:read', tags=[u'b', ]),
+                                                    StringIO(''))
+        assert self.imw.tag_counts() == {u'a': 1, u'b': 1}
+        assert self.imw.indexer.tag_counts() == {u'a': 1, u'b': 2}
+        # joe is denied before All gets the read right, the index has All:+read:
+        self.imw.indexer[u'denied'].store_revision(dict(name=[u'denied', ], acl=u'joe: All:read', tags=[u'a', u'c', ]),
+                                                   StringIO(''))
+        # joe is denied after All got the read right:
+        self.imw.indexer[u'allowed'].store_revision(dict(name=[u'allowed', ], acl=u'All:read joe:', tags=[u'c', ]),
+                                                    StringIO(''))
+        assert self.imw.tag_counts() == {u'a': 1, u'b': 1, u'c': 1}
+        assert self.imw.indexer.tag_counts() == {u'a': 2, u'b': 2, u'c': 2}
+
     def test_getitem(self):
         item_name = u'public'
         item = self.imw[item_name]
@@ -12,7 +12,9 @@ from StringIO import StringIO
 
 import pytest
 
-from ..protecting import ProtectingMiddleware, AccessDenied
+from MoinMoin.constants.rights import READ
+
+from ..protecting import ProtectingMiddleware, AccessDenied, AclCache, clear_acl_cache
 
 from .test_indexing import TestIndexingMiddleware
 
@@ -53,8 +55,23 @@ class TestProtectingMiddleware(TestIndexingMiddleware):
         pass
 
     test_index_rebuild = _dummy
+    test_index_rebuild_parallel = _dummy
+    test_index_rebuild_resume = _dummy
     test_index_update = _dummy
+    test_index_update_journal = _dummy
     test_indexed_content = _dummy
+    test_commit_queue = _dummy
+    test_commit_queue_coalesce = _dummy
+    test_link_graph = _dummy
+    test_name_index = _dummy
+    test_memory_index_other_process = _dummy
+    test_memory_index_sync = _dummy
+    test_changed_names = _dummy
+    test_name_tree = _dummy
+    test_searcher_pool = _dummy
+    test_all_revs_content = _dummy
+    test_latest_revids = _dummy
+    test_transclusion_closure = _dummy
 
     def make_items(self, unprotected_acl, protected_acl):
         items = [(UNPROTECTED, unprotected_acl, UNPROTECTED_CONTENT),
@@ -126,3 +143,46 @@ class TestProtectingMiddleware(TestIndexingMiddleware):
         item = self.imw[PROTECTED]
         with pytest.raises(AccessDenied):
             item.destroy_all_revisions()
+
+    def test_shared_acl_cache(self):
+        acl_cache = AclCache()
+        indexer = self.imw.indexer
+        for name, acl in [(UNPROTECTED, u'joe:read'), (PROTECTED, u'boss:read'), ]:
+            indexer[name].store_revision(dict(name=[name, ], acl=acl, contenttype=u'text/plain;charset=utf-8'),
+                                         StringIO(UNPROTECTED_CONTENT))
+        # 1st request fills the cache:
+        pmw = ProtectingMiddleware(indexer, FakeUser(u'joe'), acl_mapping=acl_mapping, acl_cache=acl_cache)
+        assert pmw[UNPROTECTED].allows(READ)
+        assert not pmw[PROTECTED].allows(READ)
+        assert len(acl_cache.acls) == 2 and acl_cache.parsed
+        # 2nd request uses it:
+        pmw = ProtectingMiddleware(indexer, FakeUser(u'joe'), acl_mapping=acl_mapping, acl_cache=acl_cache)
+        assert len(acl_cache.acls) == 2
+        # the item gets modified without any signal (e.g. by another process):
+        item = indexer[UNPROTECTED]
+        item.store_revision(dict(name=[UNPROTECTED, ], acl=u'boss:read', contenttype=u'text/plain;charset=utf-8'),
+                            StringIO(UNPROTECTED_CONTENT))
+        # next request must notice that, the entry of the other item stays:
+        pmw = ProtectingMiddleware(indexer, FakeUser(u'joe'), acl_mapping=acl_mapping, acl_cache=acl_cache)
+        assert len(acl_cache.acls) == 1
+        assert not pmw[UNPROTECTED].allows(READ)
+        # the item_modified signal handler invalidates the entries of the modified item immediately:
+        class FakeApp(object):
+            pass
+        sender = FakeApp()
+        sender.acl_cache = acl_cache
+        assert len(acl_cache.acls) == 2
+        clear_acl_cache(sender, item_name=UNPROTECTED)
+        assert len(acl_cache.acls) == 1
+        clear_acl_cache(sender, item_names=[PROTECTED, ])
+        assert not acl_cache.acls
+
+    def test_acl_cache_invalidate(self):
+        acl_cache = AclCache()
+        for key, names in [(1, [u'Parent', ]), (2, [u'Parent/Child', u'Other']), (3, [u'ParentSibling', ]), ]:
+            acl_cache.get_acls(key, lambda: ([None, ], names))
+        # the effective ACLs of sub items depend on the ones of their parents:
+        acl_cache.invalidate([u'Parent', ])
+        assert acl_cache.acls.keys() == [3, ]
+        acl_cache.invalidate([u'ParentSibling', ])
+        assert not acl_cache.acls and not acl_cache.keys
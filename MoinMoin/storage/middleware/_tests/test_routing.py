@@ -12,7 +12,7 @@ from StringIO import StringIO
 
 import pytest
 
-from MoinMoin.constants.keys import NAME, NAMESPACE
+from MoinMoin.constants.keys import NAME, NAMESPACE, REVID
 
 from ..routing import Backend as RoutingBackend
 
@@ -98,3 +98,33 @@ def test_iter(router):
     other_be_name, other_revid = router.store(dict(name=[u'other:bar', ]), StringIO(''))
     existing_now = set([revid for be_name, revid in router])
     assert existing_now == set([default_revid, other_revid]) | existing_before
+
+
+def test_journal():
+    default_be = StoreBackend(MemoryBytesStore(), MemoryFileStore(), MemoryBytesStore())
+    other_be = StoreBackend(MemoryBytesStore(), MemoryFileStore(), MemoryBytesStore())
+    namespaces = [(u'other:', 'other'), (u'', 'default')]
+    router = RoutingBackend(namespaces, dict(other=other_be, default=default_be))
+    router.create()
+    router.open()
+    try:
+        assert router.journaling
+        default_backend_name, default_revid = router.store(dict(name=[u'foo', ]), StringIO(''))
+        other_backend_name, other_revid = router.store(dict(name=[u'other:bar', ]), StringIO(''))
+        router.remove(default_backend_name, default_revid, destroy_data=True)
+        journal = list(router.journal())
+        assert [(key[0], entry['op'], entry[REVID]) for key, entry in journal] == [
+            ('default', 'store', default_revid), ('other', 'store', other_revid), ('default', 'remove', default_revid), ]
+        keys = [key for key, entry in journal]
+        assert router.journal_keys() == set(keys)
+        router.prune_journal(keys[:2])
+        assert [key for key, entry in router.journal()] == keys[2:]
+    finally:
+        router.close()
+        router.destroy()
+
+
+def test_journal_missing(router):
+    assert not router.journaling
+    with pytest.raises(NotImplementedError):
+        list(router.journal())
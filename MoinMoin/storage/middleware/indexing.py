@@ -52,8 +52,18 @@ usually it is even just the small and thus quick latest-revs index.
 from __future__ import absolute_import, division
 
 import os
+import re
+import json
 import shutil
+import bisect
 import datetime
+import hashlib
+import time
+import multiprocessing
+import threading
+import Queue
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
@@ -62,34 +72,63 @@ from flask import request
 from flask import g as flaskg
 from flask import current_app as app
 
+from werkzeug.contrib.cache import NullCache
+
 from whoosh.fields import Schema, TEXT, ID, IDLIST, NUMERIC, DATETIME, KEYWORD, BOOLEAN
 from whoosh.writing import AsyncWriter
 from whoosh.qparser import QueryParser, MultifieldParser, RegexPlugin, PseudoFieldPlugin
 from whoosh.qparser import WordNode
-from whoosh.query import Every, Term
-from whoosh.sorting import FieldFacet
+from whoosh.query import Every, Term, Prefix, And, Or
+from whoosh.sorting import FieldFacet, Count
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
 
 from MoinMoin.constants.keys import *
 from MoinMoin.constants.contenttypes import CONTENTTYPE_USER
-from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT
+from MoinMoin.constants.namespaces import NAMESPACE_DEFAULT, NAMESPACE_USERPROFILES
 
-from MoinMoin import user
 from MoinMoin.search.analyzers import item_name_analyzer, MimeTokenizer, AclTokenizer
 from MoinMoin.themes import utctimestamp
 from MoinMoin.storage.middleware.validation import ContentMetaSchema, UserMetaSchema, validate_data
-from MoinMoin.storage.error import NoSuchItemError, ItemAlreadyExistsError
+from MoinMoin.storage.error import NoSuchItemError, ItemAlreadyExistsError, ReadOnlyError
+from MoinMoin.security import get_configured_acls, acl_index_terms
 from MoinMoin.util.interwiki import split_fqname, CompositeName
+from MoinMoin.util.crypto import cache_key
 
 WHOOSH_FILESTORAGE = 'FileStorage'
+WHOOSH_RAMSTORAGE = 'RamStorage'
 INDEXES = [LATEST_REVS, ALL_REVS, ]
 
 VALIDATION_HANDLING_STRICT = 'strict'
 VALIDATION_HANDLING_WARN = 'warn'
 VALIDATION_HANDLING = VALIDATION_HANDLING_WARN
 
+# index rebuild: commit the index writer after that many documents (an interrupted
+# rebuild can be resumed from the last commit):
+REBUILD_CHECKPOINT = 1000
+# index rebuild: how many revisions a worker process converts per task:
+REBUILD_CHUNKSIZE = 10
+
+# version of the indexable content (increase this if the conversion of revision
+# data to indexable content changes, so cached indexable content is not used):
+INDEXABLE_VERSION = 2
+
+# name of the file in the index storage that records the keys of the change journal
+# entries whose backend changes are contained in the index:
+JOURNAL_KEYS_FILE = 'journal.keys'
+
+# max. count of (query, filter) combinations IndexingMiddleware.tag_counts caches
+TAG_COUNTS_CACHE_SIZE = 100
+
+# max. count of item changes IndexingMiddleware.changed_names remembers
+MEMORY_CHANGES = 1000
+
+# the history projection: stored fields of both indexes that IndexingMiddleware.history
+# returns, so showing the history does not need to load revisions from the backend:
+HISTORY_FIELDS = [WIKINAME, NAMESPACE, NAME, ITEMID, REVID, PARENTID, MTIME, SIZE, ITEMTYPE, CONTENTTYPE,
+                  COMMENT, SUMMARY, ACTION, USERID, ADDRESS, HOSTNAME, TRASH, ]
+
 
 def get_names(meta):
     """
@@ -122,6 +161,23 @@ def get_names(meta):
     return names
 
 
+def get_parent_names(names):
+    """
+    compute list of parent names (same order as in names, but no dupes)
+
+    :param names: list of item names
+    :return: parent names (list of unicode)
+    """
+    parent_names = []
+    for name in names:
+        parentname_tail = name.rsplit('/', 1)
+        if len(parentname_tail) == 2:
+            parent_name = parentname_tail[0]
+            if parent_name not in parent_names:
+                parent_names.append(parent_name)
+    return parent_names
+
+
 def backend_to_index(meta, content, schema, wikiname, backend_name):
     """
     Convert backend metadata/data to a whoosh document.
@@ -170,13 +226,83 @@ def backend_subscriptions_to_index(subscriptions):
 from MoinMoin.util.mime import Type, type_moin_document
 from MoinMoin.util.tree import moin_page
 from MoinMoin.converter import default_registry
+from MoinMoin.converter._pool import convert as pooled_convert, ConversionLimitExceeded
 from MoinMoin.util.iri import Iri
 
 
+def indexable_cache_keys(meta, item_name):
+    """
+    Compute the cache keys for the indexable content of a revision.
+
+    The indexable content only depends on the revision data and its contenttype,
+    so it is content addressed (by the data hash). The links and transclusions
+    extracted from a new revision also depend on the item name (relative links).
+
+    :returns: tuple (content key, refs key), (None, None) if meta has no data hash
+    """
+    hash_hexdigest = meta.get(HASH_ALGORITHM)
+    if not hash_hexdigest:
+        return None, None
+    kw = dict(usage="indexable",
+              version=INDEXABLE_VERSION,
+              hash_name=HASH_ALGORITHM,
+              hash_hexdigest=hash_hexdigest,
+              contenttype=meta[CONTENTTYPE],
+              max_size=app.cfg.index_content_max_size)
+    return cache_key(**kw), cache_key(item_name=item_name, **kw)
+
+
+def indexable_cache_enabled():
+    """
+    Return whether indexable content gets cached at all (flask-cache's default
+    null cache caches nothing, so computing cache keys would be wasted effort).
+    """
+    cache = getattr(app.cache, 'cache', app.cache)  # flask-cache or a werkzeug cache
+    return not isinstance(cache, NullCache)
+
+
+class _EnoughText(Exception):
+    """
+    raised to stop converting when the max. indexable content size is reached
+    """
+
+
+class _IndexableTextCollector(object):
+    """
+    Collect the text (and the links and transclusions, if a refs converter is
+    given) of the bodies a parse_stream method of an input converter flushes.
+    """
+    def __init__(self, output_conv, refs_conv, page, max_size):
+        self.output_conv = output_conv
+        self.refs_conv = refs_conv
+        self.page = page
+        self.max_size = max_size
+        self.texts = []
+        self.size = 0
+
+    def __call__(self, body):
+        if self.refs_conv is not None:
+            self.refs_conv.traverse_tree(body, self.page)
+        if not self.max_size or self.size < self.max_size:
+            text = self.output_conv(body)
+            if text:
+                self.texts.append(text)
+                self.size += len(text) + 1
+        elif self.refs_conv is None:
+            # we neither need more text nor refs
+            raise _EnoughText
+
+    def get_text(self):
+        return u'\n'.join(self.texts)
+
+
 def convert_to_indexable(meta, data, item_name=None, is_new=False):
     """
     Convert revision data to a indexable content.
 
+    Results are cached (see indexable_cache_keys), so revisions sharing the
+    same data do not need to get converted again.
+
     :param meta: revision metadata (gets updated as a side effect)
     :param data: revision data (file-like)
                  please make sure that the content file is
@@ -185,7 +311,8 @@ def convert_to_indexable(meta, data, item_name=None, is_new=False):
                  rev.seek(0) before calling convert_to_indexable(rev).
     :param is_new: if this is for a new revision and we shall modify
                    metadata as a side effect
-    :returns: indexable content, text/plain, unicode object
+    :returns: indexable content, text/plain, unicode object (not longer than
+              index_content_max_size, if configured)
     """
     fqname = split_fqname(item_name)
 
@@ -220,7 +347,17 @@ def convert_to_indexable(meta, data, item_name=None, is_new=False):
         except IndexError:
             item_name = u'DoesNotExist'
 
+    content_cid, refs_cid = indexable_cache_keys(meta, item_name)
+    if content_cid:
+        doc = app.cache.get(content_cid)
+        refs = app.cache.get(refs_cid) if is_new else {}
+        if doc is not None and refs is not None:
+            # side effect: we update some metadata (same as below):
+            meta.update(refs)
+            return doc
+
     rev = PseudoRev(meta, data)
+    refs = {}
     try:
         # TODO use different converter mode?
         # Maybe we want some special mode for the input converters so they emit
@@ -235,48 +372,968 @@ def convert_to_indexable(meta, data, item_name=None, is_new=False):
         # of (meta)data from binary types, like from images or audio):
         conv = reg.get(type_input_contenttype, type_output_contenttype)
         if conv:
-            doc = conv(rev, input_contenttype)
-            return doc
-        # otherwise try via DOM as intermediate format (this is useful if
-        # input type is markup, to get rid of the markup):
-        input_conv = reg.get(type_input_contenttype, type_moin_document)
-        refs_conv = reg.get(type_moin_document, type_moin_document, items='refs')
-        output_conv = reg.get(type_moin_document, type_output_contenttype)
-        if input_conv and output_conv:
-            doc = input_conv(rev, input_contenttype)
+            doc = pooled_convert(conv, rev, input_contenttype)
+        else:
+            # otherwise try via DOM as intermediate format (this is useful if
+            # input type is markup, to get rid of the markup):
+            input_conv = reg.get(type_input_contenttype, type_moin_document)
+            refs_conv = reg.get(type_moin_document, type_moin_document, items='refs')
+            output_conv = reg.get(type_moin_document, type_output_contenttype)
+            if not (input_conv and output_conv):
+                # no way
+                raise TypeError("No converter for {0} --> {1}".format(input_contenttype, output_contenttype))
             # We do not convert smileys, includes, macros, links, because
             # it does not improve search results or even makes results worse.
             # We do run the referenced converter, though, to extract links and
             # transclusions.
+            i = Iri(scheme='wiki', authority='', path='/' + item_name)
+            if hasattr(input_conv, 'parse_stream'):
+                # markup converters can give us the document piece by piece,
+                # so we never have the complete DOM of big documents in memory:
+                collector = _IndexableTextCollector(output_conv, refs_conv if is_new else None,
+                                                    i, app.cfg.index_content_max_size)
+                try:
+                    input_conv.parse_stream(rev, input_contenttype, collector)
+                except _EnoughText:
+                    pass
+                doc = collector.get_text()
+            else:
+                doc = pooled_convert(input_conv, rev, input_contenttype)
+                if is_new:
+                    doc.set(moin_page.page_href, unicode(i))
+                    refs_conv(doc)
+                doc = output_conv(doc)
             if is_new:
                 # we only can modify new, uncommitted revisions, not stored revs
-                i = Iri(scheme='wiki', authority='', path='/' + item_name)
-                doc.set(moin_page.page_href, unicode(i))
-                refs_conv(doc)
                 # side effect: we update some metadata:
-                meta[ITEMLINKS] = refs_conv.get_links()
-                meta[ITEMTRANSCLUSIONS] = refs_conv.get_transclusions()
-                meta[EXTERNALLINKS] = refs_conv.get_external_links()
-            doc = output_conv(doc)
-            return doc
-        # no way
-        raise TypeError("No converter for {0} --> {1}".format(input_contenttype, output_contenttype))
+                refs = {
+                    ITEMLINKS: refs_conv.get_links(),
+                    ITEMTRANSCLUSIONS: refs_conv.get_transclusions(),
+                    EXTERNALLINKS: refs_conv.get_external_links(),
+                }
+                meta.update(refs)
+    except ConversionLimitExceeded:
+        # index no content, but do not cache that, converting might work later
+        return u''
     except Exception as e:  # catch all exceptions, we don't want to break an indexing run
         logging.exception("Exception happened in conversion of item {0!r} rev {1} contenttype {2}:".format(
                           item_name, meta.get(REVID, 'new'), meta.get(CONTENTTYPE, '')))
         doc = u'ERROR [{0!s}]'.format(e)
         return doc
+    max_size = app.cfg.index_content_max_size
+    if max_size and len(doc) > max_size:
+        doc = doc[:max_size]
+    if content_cid:
+        app.cache.set(content_cid, doc)
+        if is_new:
+            app.cache.set(refs_cid, refs)
+    return doc
+
+
+# the indexer used by a rebuild worker process, see _rebuild_worker_init:
+_rebuild_indexer = None
+
+
+def _rebuild_worker_init(indexer, flask_app):
+    """
+    Initialize a worker process of a parallel index rebuild.
+
+    :param indexer: indexing middleware instance (inherited from the parent process)
+    :param flask_app: the moin wsgi application, converters need app.cfg
+    """
+    global _rebuild_indexer
+    _rebuild_indexer = indexer
+    flask_app.app_context().push()
+    # reopen the backend, so we do not share connections with the parent process:
+    indexer.backend.open()
+
+
+def _rebuild_worker(task):
+    """
+    Retrieve and convert a revision in a rebuild worker process.
+
+    :param task: (idx_name, backend_name, revid) tuple
+    :returns: whoosh document (or None if the revision is gone)
+    """
+    return _rebuild_indexer._indexable_document(*task)
+
+
+class IndexCommitQueue(object):
+    """
+    Index documents for many (concurrent) requests with a single writer thread.
+
+    Documents queued while the writer thread is busy get committed together,
+    so a batch of them costs only one writer lock acquisition and one commit
+    per index. put() returns after the given documents are committed, so the
+    caller can read its own writes from the index afterwards.
+    """
+    def __init__(self, ix, schemas, max_docs=100, max_delay=0, committed=None):
+        """
+        :param ix: dict idx_name -> open whoosh index
+        :param schemas: dict idx_name -> whoosh schema
+        :param max_docs: max. count of documents committed in one batch
+        :param max_delay: max. time [s] to wait for more documents before committing
+        :param committed: callable(idx_name, writer), called after each commit
+        """
+        self.ix = ix
+        self.committed = committed
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.unique_fields = dict((idx_name, [name for name, field in schema.items() if field.unique])
+                                  for idx_name, schema in schemas.items())
+        self.queue = Queue.Queue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='IndexCommitQueue')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Commit everything queued so far, then stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def put(self, docs):
+        """
+        Queue documents for indexing, wait until they are committed.
+
+        :param docs: list of (idx_name, doc) tuples, doc replaces existing documents
+                     with the same value of a unique field
+        """
+        job = _IndexCommitJob(docs)
+        self.queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+
+    def flush(self):
+        """
+        Wait until everything queued so far is committed.
+        """
+        self.put([])
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            job = self.queue.get()
+            if job is None:
+                break
+            jobs = [job]
+            count = len(job.docs)
+            deadline = time.time() + self.max_delay
+            while count < self.max_docs:
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        job = self.queue.get(timeout=timeout)
+                    else:
+                        job = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                jobs.append(job)
+                count += len(job.docs)
+            self._commit(jobs)
+
+    def _coalesce(self, idx_name, docs):
+        """
+        drop documents that get replaced by a later document of the same batch
+        (whoosh does not replace uncommitted documents in update_document)
+        """
+        unique_fields = self.unique_fields[idx_name]
+        seen = set()
+        coalesced = []
+        for doc in reversed(docs):
+            keys = set((name, doc.get(name)) for name in unique_fields if doc.get(name) is not None)
+            if not keys & seen:
+                coalesced.append(doc)
+            seen |= keys
+        coalesced.reverse()
+        return coalesced
+
+    def _commit(self, jobs):
+        error = None
+        try:
+            for idx_name in [ALL_REVS, LATEST_REVS, ]:
+                docs = [doc for job in jobs for name, doc in job.docs if name == idx_name]
+                if docs:
+                    with self.ix[idx_name].writer() as writer:
+                        for doc in self._coalesce(idx_name, docs):
+                            writer.update_document(**doc)
+                    if self.committed is not None:
+                        self.committed(idx_name, writer)
+        except Exception as e:
+            logging.exception("committing {0} index jobs failed".format(len(jobs)))
+            error = e
+        for job in jobs:
+            job.error = error
+            job.done.set()
+
+
+class _IndexCommitJob(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.done = threading.Event()
+        self.error = None
+
+
+class _PinnedSearcher(object):
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.users = 0  # count of with-blocks (or suspended generators) using the searcher
+        self.stale = False  # the thread modified the index after the searcher was opened
+        self.released = False  # the thread is done with it, check it in when it is unused
+
+
+class SearcherPool(object):
+    """
+    Long-lived whoosh searchers for an index, shared by the threads of a process.
+
+    Opening a searcher reads the index metadata and opens all segments, so
+    instead of opening one per index access, a thread checks out a searcher
+    from the pool on its first access and keeps it (pinned) until it calls
+    release (usually at the end of a request). So all accesses of a request
+    see the same version of the index, except for modifications done by the
+    request itself (see modified). At checkout, a searcher for an outdated
+    version of the index gets reopened (whoosh does not reuse the readers of
+    unchanged segments when refreshing a searcher, so this costs about as much
+    as opening a new one, but it saves opening searchers for unchanged indexes).
+    """
+    def __init__(self, index):
+        """
+        :param index: an open whoosh index
+        """
+        self.index = index
+        self.lock = threading.Lock()
+        self.idle = []  # searchers not pinned by a thread
+        self.searchers = set()  # all searchers opened by the pool
+        self._local = threading.local()  # .pinned: _PinnedSearcher of the thread
+        self.stats = Counter()  # searchers opened / reopened for a newer index version / reused
+
+    def _open(self):
+        searcher = self.index.searcher()
+        with self.lock:
+            self.stats['opened'] += 1
+            self.searchers.add(searcher)
+        return searcher
+
+    def _refresh(self, searcher):
+        refreshed = searcher.refresh()
+        if refreshed is not searcher:
+            # refresh closed the old searcher
+            with self.lock:
+                self.stats['reopened'] += 1
+                self.searchers.discard(searcher)
+                self.searchers.add(refreshed)
+        return refreshed
+
+    def _checkout(self):
+        with self.lock:
+            searcher = self.idle.pop() if self.idle else None
+        if searcher is None:
+            return self._open()
+        return self._refresh(searcher)
+
+    def _checkin(self, searcher):
+        with self.lock:
+            if searcher in self.searchers:  # not closed meanwhile
+                self.idle.append(searcher)
+
+    @contextmanager
+    def searcher(self):
+        """
+        Yield the searcher of the current thread, do not close it.
+        """
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is None:
+            pinned = self._local.pinned = _PinnedSearcher(self._checkout())
+        elif pinned.stale:
+            if pinned.users:
+                # still used by an outer caller, refreshing would close its segments
+                searcher = self._open()
+                try:
+                    yield searcher
+                finally:
+                    with self.lock:
+                        self.searchers.discard(searcher)
+                    searcher.close()
+                return
+            # stays stale: the modification might get committed later (e.g. by
+            # an AsyncWriter), so we check for a newer index version at each access
+            # (refresh just returns the searcher if the index did not change)
+            pinned.searcher = self._refresh(pinned.searcher)
+        else:
+            with self.lock:
+                self.stats['reused'] += 1
+        pinned.users += 1
+        try:
+            yield pinned.searcher
+        finally:
+            pinned.users -= 1
+            if pinned.released and not pinned.users:
+                self._checkin(pinned.searcher)
+
+    def modified(self):
+        """
+        The current thread modified the index, it shall see the modification
+        (from now on, its searcher gets refreshed whenever the index changed).
+        """
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is not None:
+            pinned.stale = True
+
+    def release(self):
+        """
+        Unpin the searcher of the current thread, it goes back to the pool.
+        """
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is not None:
+            self._local.pinned = None
+            pinned.released = True
+            if not pinned.users:
+                self._checkin(pinned.searcher)
+
+    def close(self):
+        """
+        Close all searchers of the pool (also those pinned by some thread).
+        """
+        with self.lock:
+            searchers, self.searchers, self.idle = self.searchers, set(), []
+        for searcher in searchers:
+            searcher.close()
+
+
+class MemoryIndex(object):
+    """
+    Base class of the indexes of the latest revisions of the items of a wiki
+    that are kept in memory.
+
+    They get loaded from the latest revs index documents and then updated
+    item by item: for the revisions indexed or removed by this process and for
+    the documents other processes changed (see
+    IndexingMiddleware._sync_memory_indexes). Subclasses implement _reset,
+    _add and _remove, the lock protects all accesses.
+    """
+    # stored fields of the latest revs index documents _add needs (besides ITEMID):
+    fields = []
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.generation = None  # latest revs index generation the index is up-to-date with
+        self._reset()
+
+    def _reset(self):
+        """
+        Initialize the (empty) index data structures.
+        """
+        raise NotImplementedError
+
+    def load(self, docs, generation):
+        """
+        Build the index from latest revs index documents.
+        """
+        with self.lock:
+            self._clear()
+            for doc in docs:
+                self._add(doc)
+            self._loaded()
+            self.generation = generation
+
+    def _loaded(self):
+        """
+        Called by load after all documents were added.
+        """
+
+    def update(self, itemid, doc):
+        """
+        Update the index for an item, doc is its new latest revs index document
+        (or None if the item has no revisions any more).
+        """
+        with self.lock:
+            self._remove(itemid)
+            if doc is not None:
+                self._add(doc)
+
+    def _add(self, doc):
+        raise NotImplementedError
+
+    def _remove(self, itemid):
+        raise NotImplementedError
+
+
+class LinkGraph(MemoryIndex):
+    """
+    Graph of the links and transclusions between the latest revisions of the
+    items of a wiki, kept in memory and updated when revisions get indexed.
+
+    It answers questions about wanted items, orphaned items and references
+    without going over all documents. All items (fqnames) are included, the
+    caller has to check permissions of what it gets.
+    """
+    fields = [NAMESPACE, NAME, ITEMLINKS, ITEMTRANSCLUSIONS, ]
+
+    def _reset(self):
+        self.names = {}  # itemid -> fqnames of the item
+        self.itemids = {}  # fqname -> itemid
+        self.links = {}  # itemid -> fqnames linked from the item
+        self.transclusions = {}  # itemid -> fqnames transcluded by the item
+        self.referrers = {}  # fqname -> itemids linking to or transcluding it
+        self.transcluders = {}  # fqname -> itemids transcluding it
+        self.closures = {}  # itemid -> itemids of the items it transcludes, directly or indirectly
+        self.reverse_closures = {}  # itemid -> itemids of the items transcluding it, directly or indirectly
+        self.wanted = set()  # referred fqnames that do not exist
+        self.orphaned = set()  # existing fqnames that are not referred
+
+    def update(self, itemid, doc):
+        """
+        Update the graph for an item, doc is its new latest revs index document
+        (or None if the item has no revisions any more).
+        """
+        with self.lock:
+            names, transclusions = self.names.get(itemid), self.transclusions.get(itemid)
+            super(LinkGraph, self).update(itemid, doc)
+            if self.names.get(itemid) != names or self.transclusions.get(itemid) != transclusions:
+                self.closures.clear()
+                self.reverse_closures.clear()
+
+    def _add(self, doc):
+        itemid = doc[ITEMID]
+        namespace = doc.get(NAMESPACE, u'')
+        fqnames = set(CompositeName(namespace, NAME_EXACT, name) for name in doc.get(NAME) or [])
+        self.names[itemid] = fqnames
+        for fqname in fqnames:
+            self.itemids[fqname] = itemid
+            self.wanted.discard(fqname)
+            if not self.referrers.get(fqname):
+                self.orphaned.add(fqname)
+        self.links[itemid] = set(split_fqname(name) for name in doc.get(ITEMLINKS) or [])
+        self.transclusions[itemid] = set(split_fqname(name) for name in doc.get(ITEMTRANSCLUSIONS) or [])
+        for fqname in self.links[itemid] | self.transclusions[itemid]:
+            self.referrers.setdefault(fqname, set()).add(itemid)
+            self.orphaned.discard(fqname)
+            if fqname not in self.itemids:
+                self.wanted.add(fqname)
+        for fqname in self.transclusions[itemid]:
+            self.transcluders.setdefault(fqname, set()).add(itemid)
+
+    def _remove(self, itemid):
+        for fqname in self.transclusions.get(itemid, set()):
+            transcluders = self.transcluders[fqname]
+            transcluders.discard(itemid)
+            if not transcluders:
+                del self.transcluders[fqname]
+        refs = self.links.pop(itemid, set()) | self.transclusions.pop(itemid, set())
+        for fqname in refs:
+            referrers = self.referrers[fqname]
+            referrers.discard(itemid)
+            if not referrers:
+                del self.referrers[fqname]
+                self.wanted.discard(fqname)
+                if fqname in self.itemids:
+                    self.orphaned.add(fqname)
+        for fqname in self.names.pop(itemid, set()):
+            if self.itemids.get(fqname) == itemid:
+                del self.itemids[fqname]
+                self.orphaned.discard(fqname)
+                if fqname in self.referrers:
+                    self.wanted.add(fqname)
+
+    def _itemid(self, fqname):
+        if fqname.field == ITEMID:
+            return fqname.value
+        return self.itemids.get(CompositeName(fqname.namespace, NAME_EXACT, fqname.value))
+
+    def exists(self, fqname):
+        """
+        Does the item fqname exist?
+        """
+        with self.lock:
+            return self._itemid(fqname) in self.names
+
+    def wanted_items(self):
+        """
+        Return fqnames of non-existing items that are linked or transcluded.
+        """
+        with self.lock:
+            return set(self.wanted)
+
+    def orphaned_items(self):
+        """
+        Return fqnames of existing items that are not linked or transcluded.
+        """
+        with self.lock:
+            return set(self.orphaned)
+
+    def forwardrefs(self, fqname, links=True, transclusions=True):
+        """
+        Return fqnames linked / transcluded by item fqname.
+        """
+        with self.lock:
+            itemid = self._itemid(fqname)
+            refs = set()
+            if links:
+                refs |= self.links.get(itemid, set())
+            if transclusions:
+                refs |= self.transclusions.get(itemid, set())
+            return refs
+
+    def backrefs(self, fqname):
+        """
+        Return fqnames of the items linking to / transcluding fqname.
+        """
+        with self.lock:
+            return set(name for itemid in self.referrers.get(fqname, set()) for name in self.names[itemid])
+
+    def _closure(self, itemid, closures, neighbours):
+        closure = closures.get(itemid)
+        if closure is None:
+            # breadth first search, visiting each item once (so cycles are no problem)
+            closure = set()
+            todo = [itemid, ]
+            while todo:
+                for neighbour in neighbours(todo.pop()):
+                    if neighbour not in closure:
+                        closure.add(neighbour)
+                        todo.append(neighbour)
+            closure.discard(itemid)
+            closures[itemid] = closure = frozenset(closure)
+        return closure
+
+    def _transcluded(self, itemid):
+        itemids = (self._itemid(fqname) for fqname in self.transclusions.get(itemid, ()))
+        return [itemid for itemid in itemids if itemid is not None]
+
+    def _transcluding(self, itemid):
+        return [transcluder for fqname in self.names.get(itemid, ())
+                for transcluder in self.transcluders.get(fqname, ())]
+
+    def transclusion_closure(self, fqnames):
+        """
+        Return itemids of the items transcluded by the items fqnames, directly
+        or indirectly (the closures get computed once and are kept until some
+        transclusion changes).
+        """
+        with self.lock:
+            itemids = set()
+            for fqname in fqnames:
+                itemid = self._itemid(fqname)
+                if itemid in self.names:
+                    itemids |= self._closure(itemid, self.closures, self._transcluded)
+            return itemids
+
+    def reverse_transclusion_closure(self, fqname):
+        """
+        Return itemids of the items transcluding item fqname, directly or indirectly.
+        """
+        with self.lock:
+            itemid = self._itemid(fqname)
+            if itemid not in self.names:
+                return set()
+            return set(self._closure(itemid, self.reverse_closures, self._transcluding))
+
+
+class NameIndex(MemoryIndex):
+    """
+    Index of the names of the latest revisions of the items of a wiki, kept in
+    memory and updated when revisions get indexed.
+
+    It has trigram postings and sorted lists of the names and of the reversed
+    names, so it finds similar names, names with some prefix or names with some
+    suffix without going over all names. All items (fqnames) are included, the
+    caller has to check permissions of what it gets.
+    """
+    fields = [NAMESPACE, NAME, ]
+
+    def _reset(self):
+        self.names = {}  # itemid -> fqnames of the item
+        self.fqnames = {}  # name -> fqnames with this name (in any namespace)
+        self.postings = {}  # trigram of lowercased name -> names
+        self.sorted_names = []  # for prefix lookups
+        self.sorted_reversed_names = []  # for suffix lookups
+
+    @staticmethod
+    def trigrams(name):
+        """
+        Return the set of trigrams of the lowercased name (padded, so that
+        short names and the start / end of names give trigrams, too).
+        """
+        padded = u'  {0} '.format(name.lower())
+        return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def _loaded(self):
+        # load adds the names unsorted, sorting all at once is faster:
+        self.sorted_names = sorted(self.fqnames)
+        self.sorted_reversed_names = sorted(name[::-1] for name in self.fqnames)
+
+    def _add(self, doc):
+        itemid = doc[ITEMID]
+        namespace = doc.get(NAMESPACE, u'')
+        fqnames = set(CompositeName(namespace, NAME_EXACT, name) for name in doc.get(NAME) or [])
+        self.names[itemid] = fqnames
+        for fqname in fqnames:
+            name = fqname.value
+            if name not in self.fqnames:
+                self.fqnames[name] = set()
+                for trigram in self.trigrams(name):
+                    self.postings.setdefault(trigram, set()).add(name)
+                if self.generation is not None:  # not loading
+                    bisect.insort(self.sorted_names, name)
+                    bisect.insort(self.sorted_reversed_names, name[::-1])
+            self.fqnames[name].add(fqname)
+
+    def _remove(self, itemid):
+        for fqname in self.names.pop(itemid, set()):
+            name = fqname.value
+            fqnames = self.fqnames[name]
+            fqnames.discard(fqname)
+            if not fqnames:
+                del self.fqnames[name]
+                for trigram in self.trigrams(name):
+                    names = self.postings[trigram]
+                    names.discard(name)
+                    if not names:
+                        del self.postings[trigram]
+                for sorted_names, key in [(self.sorted_names, name), (self.sorted_reversed_names, name[::-1]), ]:
+                    del sorted_names[bisect.bisect_left(sorted_names, key)]
+
+    def _fqnames(self, names):
+        return set(fqname for name in names for fqname in self.fqnames[name])
+
+    def prefixed(self, prefix):
+        """
+        Return fqnames of the names starting with prefix.
+        """
+        with self.lock:
+            names = []
+            for name in self.sorted_names[bisect.bisect_left(self.sorted_names, prefix):]:
+                if not name.startswith(prefix):
+                    break
+                names.append(name)
+            return self._fqnames(names)
+
+    def suffixed(self, suffix):
+        """
+        Return fqnames of the names ending with suffix.
+        """
+        with self.lock:
+            prefix = suffix[::-1]
+            names = []
+            for name in self.sorted_reversed_names[bisect.bisect_left(self.sorted_reversed_names, prefix):]:
+                if not name.startswith(prefix):
+                    break
+                names.append(name[::-1])
+            return self._fqnames(names)
+
+    def matching(self, regex):
+        """
+        Return fqnames of the names matching the compiled regex (using regex.search).
+        """
+        with self.lock:
+            return self._fqnames(name for name in self.sorted_names if regex.search(name))
+
+    def similar(self, name, count=100):
+        """
+        Return fqnames of up to <count> names sharing the most trigrams with name
+        (relative to the lengths of both names), best candidates first.
+        """
+        trigrams = self.trigrams(name)
+        with self.lock:
+            shared = Counter()
+            for trigram in trigrams:
+                shared.update(self.postings.get(trigram, ()))
+            ranked = sorted(shared,
+                            key=lambda other: (-2 * shared[other] / (len(trigrams) + len(other) + 1), other))
+            return [fqname for other in ranked[:count] for fqname in sorted(self.fqnames[other])]
+
+
+class NameTree(MemoryIndex):
+    """
+    Tree of the names of the latest revisions of the items of a wiki (one per
+    namespace), kept in memory and updated when revisions get indexed.
+
+    For every node (a name or a parent of some name) it knows the sorted list of
+    its direct children, their initials and the count of names below it, so one
+    page of an index of sub items is made without looking at all names below.
+    All items are included, the caller has to check permissions of what it gets.
+    """
+    fields = [NAMESPACE, NAME, ]
+
+    def _reset(self):
+        self.names = {}  # itemid -> fqnames of the item
+        self.existing = {}  # (namespace, name) -> count of items with this name
+        self.below = {}  # (namespace, name) -> count of names below this node
+        self.children = {}  # (namespace, name) -> sorted list of direct child name components
+        self.initials = {}  # (namespace, name) -> initial -> count of direct children
+
+    def _add(self, doc):
+        itemid = doc[ITEMID]
+        namespace = doc.get(NAMESPACE, u'')
+        fqnames = set(CompositeName(namespace, NAME_EXACT, name) for name in doc.get(NAME) or [])
+        self.names[itemid] = fqnames
+        for fqname in fqnames:
+            self._count(fqname.namespace, fqname.value, 1)
+
+    def _remove(self, itemid):
+        for fqname in self.names.pop(itemid, set()):
+            self._count(fqname.namespace, fqname.value, -1)
+
+    def _count(self, namespace, name, delta):
+        key = namespace, name
+        self.existing[key] = self.existing.get(key, 0) + delta
+        if not self.existing[key]:
+            del self.existing[key]
+        components = name.split(u'/')
+        for i in range(len(components)):
+            parent = namespace, u'/'.join(components[:i])
+            self.below[parent] = self.below.get(parent, 0) + delta
+            if not self.below[parent]:
+                del self.below[parent]
+        # now that all counts are updated, update the lists of children:
+        for i, child in enumerate(components):
+            parent = namespace, u'/'.join(components[:i])
+            child_key = namespace, u'/'.join(components[:i + 1])
+            used = child_key in self.existing or child_key in self.below
+            children = self.children.setdefault(parent, [])
+            pos = bisect.bisect_left(children, child)
+            listed = pos < len(children) and children[pos] == child
+            if used and not listed:
+                children.insert(pos, child)
+                initials = self.initials.setdefault(parent, {})
+                initials[child[:1]] = initials.get(child[:1], 0) + 1
+            elif listed and not used:
+                del children[pos]
+                initials = self.initials[parent]
+                initials[child[:1]] -= 1
+                if not initials[child[:1]]:
+                    del initials[child[:1]]
+                if not children:
+                    del self.children[parent]
+                    del self.initials[parent]
+
+    def exists(self, namespace, name):
+        """
+        Is there an item with this name?
+        """
+        with self.lock:
+            return (namespace, name) in self.existing
+
+    def name_initials(self, namespace, name):
+        """
+        Return the sorted initials of the direct children of node name.
+        """
+        with self.lock:
+            return sorted(self.initials.get((namespace, name), {}))
+
+    def subitems(self, namespace, name, startswith=None, offset=0, limit=None):
+        """
+        Return a tuple (entries, total) for the direct children of node name
+        (optionally only those starting with startswith, in any case of its first
+        character), entries are tuples (child name component, item exists, count of
+        names below) for the children offset ... offset + limit - 1, total is the
+        count of all these children.
+        """
+        with self.lock:
+            children = self.children.get((namespace, name), [])
+            if startswith:
+                ranges = []
+                for prefix in sorted(set([startswith, startswith.swapcase()])):
+                    # all names starting with prefix sort before the upper bound:
+                    upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+                    ranges.append((bisect.bisect_left(children, prefix), bisect.bisect_left(children, upper)))
+            else:
+                ranges = [(0, len(children)), ]
+            total = sum(end - start for start, end in ranges)
+            end = total if limit is None else min(offset + limit, total)
+            selected = []
+            for start, stop in ranges:
+                selected.extend(children[start:stop])
+                if len(selected) >= end:
+                    break
+            prefix = name + u'/' if name else u''
+            entries = []
+            for child in selected[offset:end]:
+                key = namespace, prefix + child
+                entries.append((child, key in self.existing, self.below.get(key, 0)))
+            return entries, total
+
+
+class SubscriptionPatterns(MemoryIndex):
+    """
+    The NAMEPREFIX and NAMERE subscriptions of all users, kept in memory and
+    updated when user profiles get indexed.
+
+    The subscriptions are organized per namespace: name prefixes in a dict
+    (looking up all prefixes of a name finds the matching ones, without looking
+    at the subscriptions that do not match), name regexes compiled once, each
+    distinct regex only once, no matter how many users subscribed to it.
+    """
+    fields = [SUBSCRIPTION_PATTERNS, ]
+
+    def _reset(self):
+        self.subscriptions = {}  # itemid -> subscriptions of the user
+        self.users = {}  # subscription -> itemids of the users having it
+        self.prefixes = {}  # namespace -> name prefix -> subscription
+        self.regexes = {}  # namespace -> subscription -> compiled name regex
+
+    def _add(self, doc):
+        subscriptions = set(doc.get(SUBSCRIPTION_PATTERNS) or [])
+        if not subscriptions:
+            return
+        itemid = doc[ITEMID]
+        self.subscriptions[itemid] = subscriptions
+        for subscription in subscriptions:
+            users = self.users.setdefault(subscription, set())
+            if not users:
+                self._register(subscription)
+            users.add(itemid)
+
+    def _remove(self, itemid):
+        for subscription in self.subscriptions.pop(itemid, set()):
+            users = self.users[subscription]
+            users.discard(itemid)
+            if not users:
+                del self.users[subscription]
+                self._unregister(subscription)
+
+    def _register(self, subscription):
+        keyword, namespace, value = self._split(subscription)
+        if keyword == NAMEPREFIX:
+            self.prefixes.setdefault(namespace, {})[value] = subscription
+        elif keyword == NAMERE:
+            try:
+                regex = re.compile(value, re.U)
+            except re.error:
+                logging.error("Subscription pattern '{0}' has failed compilation.".format(value))
+                return
+            self.regexes.setdefault(namespace, {})[subscription] = regex
+
+    def _unregister(self, subscription):
+        keyword, namespace, value = self._split(subscription)
+        mapping, key = (self.prefixes, value) if keyword == NAMEPREFIX else (self.regexes, subscription)
+        entries = mapping.get(namespace, {})
+        entries.pop(key, None)
+        if not entries:
+            mapping.pop(namespace, None)
+
+    def _split(self, subscription):
+        keyword, value = subscription.split(u':', 1)
+        namespace, value = value.split(u':', 1)
+        return keyword, namespace, value
+
+    def matches(self, namespace, names):
+        """
+        Return the set of subscriptions matching one of the names (in namespace).
+        """
+        matched = set()
+        with self.lock:
+            prefixes = self.prefixes.get(namespace, {})
+            if prefixes:
+                for name in names:
+                    for end in range(len(name) + 1):
+                        subscription = prefixes.get(name[:end])
+                        if subscription is not None:
+                            matched.add(subscription)
+            for subscription, regex in self.regexes.get(namespace, {}).items():
+                if any(regex.search(name) for name in names):
+                    matched.add(subscription)
+        return matched
+
+
+class UserNames(MemoryIndex):
+    """
+    The names of the users (user profiles) of a wiki, kept in memory and
+    updated when user profiles get indexed.
+
+    It answers "is there a user with this name?" and "what is the itemid of
+    the user with this name?" without querying the index.
+    """
+    fields = [NAMESPACE, CONTENTTYPE, NAME, ]
+
+    def _reset(self):
+        self.names = {}  # itemid -> names of the user
+        self.itemids = {}  # name -> itemid of the user
+
+    def _add(self, doc):
+        if doc.get(NAMESPACE) != NAMESPACE_USERPROFILES or doc.get(CONTENTTYPE) != CONTENTTYPE_USER:
+            return
+        itemid = doc[ITEMID]
+        names = doc.get(NAME) or []
+        self.names[itemid] = names
+        for name in names:
+            self.itemids[name] = itemid
+
+    def _remove(self, itemid):
+        for name in self.names.pop(itemid, []):
+            if self.itemids.get(name) == itemid:
+                del self.itemids[name]
+
+    def itemid(self, name):
+        """
+        Return the itemid of the user with this name (None if there is no such user).
+        """
+        with self.lock:
+            return self.itemids.get(name)
+
+    def get_names(self, itemid):
+        """
+        Return the names of the user with this itemid (empty list if there is no such user).
+        """
+        with self.lock:
+            return list(self.names.get(itemid, []))
 
 
 class IndexingMiddleware(object):
-    def __init__(self, index_storage, backend, wiki_name=None, acl_rights_contents=[], **kw):
+    def __init__(self, index_storage, backend, wiki_name=None, acl_rights_contents=[],
+                 commit_max_docs=100, commit_max_delay=0, acl_mapping=None, snapshot_interval=0, **kw):
         """
         Store params, create schemas.
+
+        :param commit_max_docs: max. count of documents the commit queue commits in one batch
+                                (0 means: no commit queue, every revision is committed separately)
+        :param commit_max_delay: max. time [s] the commit queue waits for more documents
+        :param acl_mapping: acl_mapping of the wiki, if given, the effective ACL of the latest
+                            revisions gets indexed (see ProtectingMiddleware)
+        :param snapshot_interval: min. time [s] between snapshots of a RamStorage done (in a
+                                  background thread) after index modifications (0 means: only
+                                  by close and index maintenance)
         """
         self.index_storage = index_storage
         self.backend = backend
         self.wikiname = wiki_name
+        self.acl_rights_contents = acl_rights_contents
+        self.acl_mapping = acl_mapping
+        self.acl_hierarchic = acl_mapping is not None and any(acls['hierarchic'] for prefix, acls in acl_mapping)
+        # while building an index, we look up parent items' ACLs here first:
+        self._acl_names = None  # name -> (acl, fqname, names) of latest revisions
+        self.commit_max_docs = commit_max_docs
+        self.commit_max_delay = commit_max_delay
+        self.commit_queue = None
+        self._memory_lock = threading.RLock()  # serializes syncing the in-memory indexes
+        self._own_generations_lock = threading.Lock()
+        self._memory_change = 0  # number of the last item change applied to the in-memory indexes
+        self._reset_memory_indexes()
+        self._local = threading.local()  # .batch: revisions to index at the end of a batch (see batch())
+        self._tag_counts_lock = threading.Lock()
+        self._tag_counts = {}  # (idx_name, filter, kw) -> (index generation, tag counts)
         self.ix = {}  # open indexes
+        self._searcher_pools = {}  # idx_name -> SearcherPool of the open index
+        self._ram_storages = {}  # tmp -> RamStorage (if index_storage kind is RamStorage)
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_time = time.time()  # time of the last snapshot of the normal RamStorage
+        self._snapshot_thread = None  # thread doing a snapshot started by _snapshot_if_due
+        self._snapshot_thread_lock = threading.Lock()
+        # a read-only FileStorage is used by replicas, they only read the indexes made by another wiki process:
+        self.readonly = index_storage[0] == WHOOSH_FILESTORAGE and bool(dict(index_storage[2]).get('readonly'))
         self.schemas = {}  # existing schemas
 
         common_fields = {
@@ -325,8 +1382,6 @@ class IndexingMiddleware(object):
             DATAID: ID(stored=True),
             # TRASH from metadata
             TRASH: BOOLEAN(stored=True),
-            # data (content), converted to text/plain and tokenized
-            CONTENT: TEXT(stored=True),
         }
 
         latest_revs_fields = {
@@ -338,6 +1393,10 @@ class IndexingMiddleware(object):
             ITEMTRANSCLUSIONS: ID(stored=True),
             # tokenized ACL from metadata
             ACL: TEXT(analyzer=AclTokenizer(acl_rights_contents), multitoken_query="and", stored=True),
+            # normalized effective ACL (including before/default/after and parent ACLs)
+            EFFECTIVE_ACL: ID(stored=True),
+            # data (content), converted to text/plain and tokenized
+            CONTENT: TEXT(stored=True),
         }
         latest_revs_fields.update(**common_fields)
 
@@ -351,7 +1410,8 @@ class IndexingMiddleware(object):
             DISABLED: BOOLEAN(stored=True),
             LOCALE: ID(stored=True),
             SUBSCRIPTION_IDS: ID(),
-            SUBSCRIPTION_PATTERNS: ID(),
+            # stored for loading SubscriptionPatterns:
+            SUBSCRIPTION_PATTERNS: ID(stored=True),
         }
         latest_revs_fields.update(**userprofile_fields)
 
@@ -374,6 +1434,9 @@ class IndexingMiddleware(object):
 
         all_revs_fields = {
             ITEMID: ID(stored=True),
+            # data (content), converted to text/plain and tokenized - not stored, as
+            # many revisions have the same data (see indexed_content)
+            CONTENT: TEXT(),
         }
         all_revs_fields.update(**common_fields)
 
@@ -407,10 +1470,20 @@ class IndexingMiddleware(object):
         params, kw = list(params), dict(kw)  # better make a (mutable) copy
         if kind == WHOOSH_FILESTORAGE:
             # index_storage = 'FileStorage', (index_dir, ), {}
+            # index_storage = 'FileStorage', (index_dir, ), dict(readonly=True)  # replica
             if tmp:
                 params[0] += '.temp'
             from whoosh.filedb.filestore import FileStorage
             cls = FileStorage
+        elif kind == WHOOSH_RAMSTORAGE:
+            # index_storage = 'RamStorage', (snapshot_dir, ), {}
+            # index_storage = 'RamStorage', (), {}  # no snapshots
+            if not params:
+                params = [None, ]
+            if tmp and params[0]:
+                params[0] += '.temp'
+            from whoosh.filedb.filestore import RamStorage
+            cls = RamStorage
         else:
             raise ValueError("index_storage = {0!r} is not supported!".format(kind))
         return kind, cls, params, kw
@@ -419,9 +1492,20 @@ class IndexingMiddleware(object):
         """
         Get the whoosh storage (whoosh supports different kinds of storage,
         e.g. to filesystem or to GAE).
-        Currently we only support the FileStorage.
+        Currently we support the FileStorage and the RamStorage.
         """
         kind, cls, params, kw = self.get_storage_params(tmp)
+        if kind == WHOOSH_RAMSTORAGE:
+            # the indexes only exist in this storage object, so we always return the same one
+            storage = self._ram_storages.get(tmp)
+            if storage is None:
+                storage = self._ram_storages[tmp] = cls()
+                snapshot_dir = params[0]
+                if snapshot_dir and os.path.isdir(snapshot_dir):
+                    from whoosh.filedb.filestore import FileStorage, copy_storage
+                    copy_storage(FileStorage(snapshot_dir), storage)
+                    logging.info("loaded index snapshot from {0}".format(snapshot_dir))
+            return storage
         if kind == WHOOSH_FILESTORAGE:
             if create:
                 index_dir = params[0]
@@ -440,14 +1524,70 @@ class IndexingMiddleware(object):
         storage = self.get_storage()
         for name in INDEXES:
             self.ix[name] = storage.open_index(name)
+            self._searcher_pools[name] = SearcherPool(self.ix[name])
+        if self.commit_max_docs > 0 and not self.readonly:
+            self.commit_queue = IndexCommitQueue(self.ix, self.schemas,
+                                                 self.commit_max_docs, self.commit_max_delay,
+                                                 committed=self._committed)
+            self.commit_queue.start()
 
     def close(self):
         """
         Close all indexes.
         """
+        if self.commit_queue is not None:
+            self.commit_queue.stop()
+            self.commit_queue = None
+        for name in self._searcher_pools:
+            self._searcher_pools[name].close()
+        self._searcher_pools = {}
         for name in self.ix:
             self.ix[name].close()
         self.ix = {}
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        self.snapshot()
+        self._reset_memory_indexes()
+
+    def searcher(self, idx_name=LATEST_REVS):
+        """
+        Return a context manager giving the searcher of the current thread for
+        index idx_name (see SearcherPool). The caller must not close it.
+        """
+        return self._searcher_pools[idx_name].searcher()
+
+    def release_searchers(self):
+        """
+        Give back the searchers of the current thread (call this at the end of
+        a request), so the next request gets an up-to-date version of the indexes.
+        """
+        for pool in self._searcher_pools.values():
+            pool.release()
+
+    def searcher_stats(self):
+        """
+        Return a dict idx_name -> dict with the counts of searchers opened,
+        reopened for a newer index version and reused by this process (for monitoring).
+        """
+        return dict((name, dict(opened=pool.stats['opened'],
+                                reopened=pool.stats['reopened'],
+                                reused=pool.stats['reused']))
+                    for name, pool in self._searcher_pools.items())
+
+    def _index_modified(self):
+        """
+        The current thread modified the indexes, later accesses shall see that.
+        """
+        for pool in self._searcher_pools.values():
+            pool.modified()
+
+    def index_generation(self, idx_name=LATEST_REVS):
+        """
+        Return the generation of an index, it changes whenever the index
+        gets modified (also if another process modified it).
+        """
+        return self.ix[idx_name].latest_generation()
 
     def create(self, tmp=False):
         """
@@ -456,29 +1596,126 @@ class IndexingMiddleware(object):
         storage = self.get_storage(tmp, create=True)
         for name in INDEXES:
             storage.create_index(self.schemas[name], indexname=name)
+        self.snapshot(tmp)
 
     def destroy(self, tmp=False):
         """
         Destroy all indexes.
         """
-        # XXX this is whoosh backend specific and currently only works for FileStorage.
+        # XXX this is whoosh backend specific and currently only works for FileStorage and RamStorage.
         kind, cls, params, kw = self.get_storage_params(tmp)
-        if kind == WHOOSH_FILESTORAGE:
+        if kind == WHOOSH_RAMSTORAGE:
+            self._ram_storages.pop(tmp, None)
+        if kind in (WHOOSH_FILESTORAGE, WHOOSH_RAMSTORAGE):
             index_dir = params[0]
-            if os.path.exists(index_dir):
+            if index_dir and os.path.exists(index_dir):
                 shutil.rmtree(index_dir)
 
     def move_index(self):
         """
         Move freshly built indexes from tmp storage to normal storage
         """
-        # XXX this is whoosh backend specific and currently only works for FileStorage.
+        # XXX this is whoosh backend specific and currently only works for FileStorage and RamStorage.
         kind, cls, params, kw = self.get_storage_params(False)
         if kind == WHOOSH_FILESTORAGE:
             _, _, params_tmp, _ = self.get_storage_params(True)
             self.destroy()
             index_dir, index_dir_tmp = params[0], params_tmp[0]
             os.rename(index_dir_tmp, index_dir)
+        elif kind == WHOOSH_RAMSTORAGE:
+            # the tmp indexes might have been built by another process, get them from their snapshot:
+            storage_tmp = self.get_storage(tmp=True)
+            self.destroy(tmp=True)
+            self.destroy()
+            self._ram_storages[False] = storage_tmp
+            self.snapshot()
+
+    def snapshot(self, tmp=False):
+        """
+        Write the indexes of a RamStorage to its snapshot directory (if one is
+        configured), they get loaded from there when the RamStorage is used the
+        next time (e.g. after a restart of the wiki). Does nothing for other
+        kinds of index storage.
+
+        This is done by close, by the index maintenance methods (create,
+        rebuild, update, ...) and after index modifications if the last
+        snapshot is older than snapshot_interval, so not too many index
+        updates get lost if the process gets killed.
+        """
+        kind, cls, params, kw = self.get_storage_params(tmp)
+        storage = self._ram_storages.get(tmp)
+        if kind != WHOOSH_RAMSTORAGE or not params[0] or storage is None:
+            return
+        with self._snapshot_lock:
+            self._write_snapshot(storage, params[0])
+            if not tmp:
+                self._snapshot_time = time.time()
+
+    def _snapshot_if_due(self):
+        """
+        Start a snapshot of the RamStorage in a background thread if the last
+        snapshot is older than snapshot_interval (and no snapshot is running).
+        """
+        if not self.snapshot_interval or time.time() <= self._snapshot_time + self.snapshot_interval:
+            return
+        kind, cls, params, kw = self.get_storage_params()
+        if kind != WHOOSH_RAMSTORAGE or not params[0]:
+            return
+        with self._snapshot_thread_lock:
+            if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+                return
+            # the next one is due after the interval, even if this one fails:
+            self._snapshot_time = time.time()
+            self._snapshot_thread = threading.Thread(target=self._background_snapshot, name='IndexSnapshot')
+            self._snapshot_thread.daemon = True
+            self._snapshot_thread.start()
+
+    def _background_snapshot(self):
+        try:
+            self.snapshot()
+        except Exception:
+            logging.exception("index snapshot failed")
+
+    def _write_snapshot(self, storage, snapshot_dir):
+        """
+        Copy the files of RamStorage storage to snapshot_dir, replacing the previous snapshot.
+        """
+        from whoosh.filedb.filestore import FileStorage
+        new_dir, old_dir = snapshot_dir + '.new', snapshot_dir + '.old'
+        for path in new_dir, old_dir:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        target = FileStorage(new_dir).create()
+        while True:
+            # whoosh never modifies a file after writing it, but a commit while we copy
+            # might replace some, so we copy again until no commit happened meanwhile:
+            tocs = sorted(name for name in storage.list() if name.endswith('.toc'))
+            target.clean()
+            for name in storage.list():
+                try:
+                    data = storage.files[name]
+                except KeyError:
+                    continue  # removed meanwhile
+                f = target.create_file(name)
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+            if tocs == sorted(name for name in storage.list() if name.endswith('.toc')):
+                break
+        if os.path.exists(snapshot_dir):
+            os.rename(snapshot_dir, old_dir)
+        os.rename(new_dir, snapshot_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        logging.info("wrote index snapshot to {0}".format(snapshot_dir))
+
+    def _check_writable(self):
+        """
+        Raise ReadOnlyError if the indexes must not be modified by this process.
+        """
+        if self.readonly:
+            raise ReadOnlyError("index_storage is read-only, modifications must be done by the primary wiki")
 
     def index_revision(self, meta, content, backend_name, async=False):  # True
         """
@@ -487,32 +1724,119 @@ class IndexingMiddleware(object):
         :param meta: metadata dict
         :param content: preprocessed (filtered) indexable content
         :param async: if True, use the AsyncWriter, otherwise use normal writer
+                      (only used if there is no commit queue)
+        :returns: the latest revs index document of the revision
+        """
+        self._check_writable()
+        doc_all = backend_to_index(meta, content, self.schemas[ALL_REVS], self.wikiname, backend_name)
+        doc_latest = self._latest_document(meta, content, backend_name, self.ix[LATEST_REVS])
+        acl_names = self._acl_names_changed(doc_latest)
+        if self.batching:
+            self._local.batch.append((doc_all, doc_latest, acl_names))
+            return doc_latest
+        self._index_documents(doc_all, doc_latest, async)
+        if acl_names:
+            # the effective ACLs of sub items depend on this item's ACL and names:
+            self._refresh_effective_acls(self.ix[LATEST_REVS], acl_names)
+        self._index_modified()
+        self._update_memory_indexes(doc_latest[ITEMID], doc_latest)
+        self._snapshot_if_due()
+        return doc_latest
+
+    @property
+    def batching(self):
+        """
+        Is the current thread within a batch (see batch())?
+        """
+        return getattr(self._local, 'batch', None) is not None
+
+    @contextmanager
+    def batch(self):
+        """
+        Within the with-block, index_revision just collects the documents of the
+        revisions (of the current thread), they all get indexed at the end of the
+        block, with one commit per index.
+
+        Note: the revisions stored within the block are not in the index before
+              the end of the block (not even if the block raises an exception).
         """
-        doc = backend_to_index(meta, content, self.schemas[ALL_REVS], self.wikiname, backend_name)
+        if self.batching:
+            # nested batch, the outermost one indexes everything
+            yield
+            return
+        self._local.batch = []
+        try:
+            yield
+        finally:
+            self._index_batch()
+            self._local.batch = None
+
+    def _index_batch(self):
+        """
+        Index the revisions collected in the current batch so far.
+        """
+        batch, self._local.batch = self._local.batch, []
+        if not batch:
+            return
+        docs_latest = OrderedDict()  # itemid -> latest revs document (the last one of the item wins)
+        acl_names = []
+        for doc_all, doc_latest, names in batch:
+            docs_latest[doc_latest[ITEMID]] = doc_latest
+            acl_names.extend(names)
+        if self.commit_queue is not None:
+            self.commit_queue.put([(ALL_REVS, doc_all) for doc_all, doc_latest, names in batch] +
+                                  [(LATEST_REVS, doc_latest) for doc_latest in docs_latest.values()])
+        else:
+            with self.ix[ALL_REVS].writer() as writer:
+                for doc_all, doc_latest, names in batch:
+                    writer.update_document(**doc_all)
+            with self.ix[LATEST_REVS].writer() as writer:
+                for doc_latest in docs_latest.values():
+                    writer.update_document(**doc_latest)
+            self._committed(LATEST_REVS, writer)
+        if acl_names:
+            self._refresh_effective_acls(self.ix[LATEST_REVS], acl_names)
+        self._index_modified()
+        for itemid, doc_latest in docs_latest.items():
+            self._update_memory_indexes(itemid, doc_latest)
+        self._snapshot_if_due()
+
+    def _index_documents(self, doc_all, doc_latest, async):
+        if self.commit_queue is not None:
+            self.commit_queue.put([(ALL_REVS, doc_all), (LATEST_REVS, doc_latest), ])
+            return
         if async:
             writer = AsyncWriter(self.ix[ALL_REVS])
         else:
             writer = self.ix[ALL_REVS].writer()
         with writer as writer:
-            writer.update_document(**doc)  # update, because store_revision() may give us an existing revid
-        doc = backend_to_index(meta, content, self.schemas[LATEST_REVS], self.wikiname, backend_name)
+            writer.update_document(**doc_all)  # update, because store_revision() may give us an existing revid
         if async:
             writer = AsyncWriter(self.ix[LATEST_REVS])
         else:
             writer = self.ix[LATEST_REVS].writer()
         with writer as writer:
-            writer.update_document(**doc)
+            writer.update_document(**doc_latest)
+        self._committed(LATEST_REVS, writer)
 
     def remove_revision(self, revid, async=True):
         """
         Remove a single revision from indexes.
         """
+        self._check_writable()
+        if self.batching:
+            # we need to see all revisions of the batch to find the new latest revision
+            self._index_batch()
+        if self.commit_queue is not None:
+            # we need to see all queued revisions to find the new latest revision
+            self.commit_queue.flush()
         if async:
             writer = AsyncWriter(self.ix[ALL_REVS])
         else:
             writer = self.ix[ALL_REVS].writer()
         with writer as writer:
             writer.delete_by_term(REVID, revid)
+        acl_names = []
         if async:
             writer = AsyncWriter(self.ix[LATEST_REVS])
         else:
@@ -522,7 +1846,10 @@ class IndexingMiddleware(object):
             with self.ix[LATEST_REVS].searcher() as searcher:
                 docnum_remove = searcher.document_number(revid=revid)
                 if docnum_remove is not None:
-                    itemid = searcher.stored_fields(docnum_remove)[ITEMID]
+                    doc_remove = searcher.stored_fields(docnum_remove)
+                    itemid = doc_remove[ITEMID]
+                    if self.acl_hierarchic:
+                        acl_names = doc_remove.get(NAME, [])
             if docnum_remove is not None:
                 # we are removing a revid that is in latest revs index
                 latest_backends_revids = self._find_latest_backends_revids(self.ix[ALL_REVS], Term(ITEMID, itemid))
@@ -532,18 +1859,452 @@ class IndexingMiddleware(object):
                     latest_backend_revid = latest_backends_revids[0]
                     # we must fetch from backend because schema for LATEST_REVS is different than for ALL_REVS
                     # (and we can't be sure we have all fields stored, too)
-                    meta, _ = self.backend.retrieve(*latest_backend_revid)
-                    # we only use meta (not data), because we do not want to transform data->content again (this
-                    # is potentially expensive) as we already have the transformed content stored in ALL_REVS index:
-                    with self.ix[ALL_REVS].searcher() as searcher:
-                        doc = searcher.document(revid=latest_backend_revid[1])
-                        content = doc[CONTENT]
-                    doc = backend_to_index(meta, content, self.schemas[LATEST_REVS], self.wikiname,
-                                           backend_name=latest_backend_revid[0])
+                    meta, data = self.backend.retrieve(*latest_backend_revid)
+                    try:
+                        if (meta.get(DATAID) == doc_remove.get(DATAID) and
+                                meta.get(CONTENTTYPE) == doc_remove.get(CONTENTTYPE)):
+                            # same data as the removed revision (e.g. only metadata was changed),
+                            # no need to transform data->content again (this is potentially expensive)
+                            content = doc_remove[CONTENT]
+                        else:
+                            content = convert_to_indexable(meta, data, is_new=False)
+                    finally:
+                        data.close()
+                    doc = self._latest_document(meta, content, latest_backend_revid[0], self.ix[LATEST_REVS])
                     writer.update_document(**doc)
+                    if acl_names:
+                        acl_names = acl_names + doc[NAME]
                 else:
                     # this is no revision left in this item that could be the new "latest rev", just kill the rev
                     writer.delete_document(docnum_remove)
+                    doc = None
+        self._committed(LATEST_REVS, writer)
+        if acl_names:
+            self._refresh_effective_acls(self.ix[LATEST_REVS], acl_names)
+        self._index_modified()
+        if docnum_remove is not None:
+            self._update_memory_indexes(itemid, doc)
+        self._snapshot_if_due()
+
+    def _committed(self, idx_name, writer):
+        """
+        Remember the generation of a latest revs index commit done by this process.
+
+        :param writer: the whoosh writer (or AsyncWriter) that committed
+        """
+        if idx_name != LATEST_REVS or self._memory_generation is None:
+            # (the in-memory indexes are not loaded yet, they will get all documents)
+            return
+        if isinstance(writer, AsyncWriter):
+            if writer.ident is not None:
+                # it could not get the lock and commits later in its own thread, we
+                # do not know the generation (so the in-memory indexes will look for
+                # the documents changed by it, see _sync_memory_indexes)
+                return
+            writer = writer.writer
+        with self._own_generations_lock:
+            self._own_generations.add(writer.generation)
+
+    def _reset_memory_indexes(self):
+        """
+        Create the in-memory indexes (empty, they get loaded when needed).
+        """
+        self._link_graph = LinkGraph()
+        self._name_index = NameIndex()
+        self._name_tree = NameTree()
+        self._subscription_patterns = SubscriptionPatterns()
+        self._user_names = UserNames()
+        self._memory_indexes = [self._link_graph, self._name_index, self._name_tree, self._subscription_patterns,
+                                self._user_names, ]
+        # the stored fields the in-memory indexes need:
+        self._memory_fields = set([ITEMID, REVID, ])
+        for mindex in self._memory_indexes:
+            self._memory_fields.update(mindex.fields)
+        self._memory_generation = None  # latest revs index generation the in-memory indexes are up-to-date with
+        self._memory_segments = None  # segment id -> (deleted docs count, docnum -> itemid) at the last sync
+        self._memory_revids = {}  # itemid -> revid of the documents in the in-memory indexes
+        # itemids of the items this process updated since the last sync (their
+        # documents are in segments the last sync did not know):
+        self._memory_updated = set()
+        # (change number, names of the item before and after it) of the latest item
+        # changes, the changes up to _memory_changes_start are not known:
+        self._memory_changes = deque()
+        self._memory_changes_start = self._memory_change
+        # latest revs index generations committed by this process, the in-memory
+        # indexes got the modifications of them from us (see _sync_memory_indexes):
+        with self._own_generations_lock:
+            self._own_generations = set()
+
+    def _memory_document(self, doc):
+        """
+        Return the part of latest revs index document doc the in-memory indexes
+        need (None if it is not a document of this wiki).
+        """
+        if doc.get(WIKINAME) != self.wikiname:
+            return None
+        return dict((name, value) for name, value in doc.items() if name in self._memory_fields)
+
+    def _apply_memory_update(self, itemid, doc):
+        # caller must hold the memory lock
+        names = set(fqname.value for fqname in self._link_graph.names.get(itemid, ()))
+        if doc is not None:
+            names.update(doc.get(NAME) or [])
+        self._memory_change += 1
+        self._memory_changes.append((self._memory_change, names))
+        if len(self._memory_changes) > MEMORY_CHANGES:
+            self._memory_changes_start = self._memory_changes.popleft()[0]
+        for mindex in self._memory_indexes:
+            mindex.update(itemid, doc)
+        if doc is None:
+            self._memory_revids.pop(itemid, None)
+        else:
+            self._memory_revids[itemid] = doc[REVID]
+
+    def _update_memory_indexes(self, itemid, doc):
+        """
+        Update the in-memory indexes (if loaded) for a revision this process
+        indexed or removed, doc is the new latest revs index document of the
+        item (None if it has no revisions any more).
+        """
+        if doc is not None:
+            doc = self._memory_document(doc)
+            if doc is None:
+                return
+        with self._memory_lock:
+            if self._memory_segments is not None:
+                self._apply_memory_update(itemid, doc)
+                self._memory_updated.add(itemid)
+
+    def _memory_index(self, mindex):
+        """
+        Return in-memory index mindex, up-to-date with the latest revs index.
+        """
+        self._sync_memory_indexes()
+        return mindex
+
+    def _sync_memory_indexes(self):
+        """
+        Bring the in-memory indexes up-to-date with the latest revs index: load
+        them if this was not done yet, otherwise update them for the documents
+        someone else (e.g. another process) changed since the last sync.
+
+        The modifications done by this process get applied when indexing (see
+        _update_memory_indexes), so if all later generations were committed
+        by this process (see _committed), there is nothing to do.
+        """
+        generation = self.index_generation()
+        if generation == self._memory_generation:
+            return
+        with self._memory_lock:
+            synced = self._memory_generation
+            if generation == synced:
+                return
+            own = False
+            if synced is not None and synced < generation:
+                with self._own_generations_lock:
+                    own = all(gen in self._own_generations for gen in range(synced + 1, generation + 1))
+            if not own:
+                with self.ix[LATEST_REVS].searcher() as searcher:
+                    reader = searcher.reader()
+                    if reader.generation() is not None:  # None for an empty index
+                        generation = reader.generation()
+                    if self._memory_segments is None:
+                        self._load_memory_indexes(reader, generation)
+                    else:
+                        self._update_memory_segments(searcher)
+            for mindex in self._memory_indexes:
+                mindex.generation = generation
+            self._memory_generation = generation
+            with self._own_generations_lock:
+                self._own_generations = set(gen for gen in self._own_generations if gen > generation)
+
+    def _segment_readers(self, reader):
+        """
+        Return a dict segment id -> segment reader for the segments of whoosh reader.
+        """
+        return dict((leaf.segment().segment_id(), leaf) for leaf, offset in reader.leaf_readers()
+                    if leaf.segment() is not None)
+
+    def _load_memory_indexes(self, reader, generation):
+        """
+        Load the in-memory indexes from all documents of whoosh reader.
+        """
+        docs = []
+        segments = {}
+        for segment_id, leaf in self._segment_readers(reader).items():
+            docnums = {}
+            for docnum, doc in leaf.iter_docs():
+                doc = self._memory_document(doc)
+                if doc is not None:
+                    docnums[docnum] = doc[ITEMID]
+                    docs.append(doc)
+            segments[segment_id] = leaf.doc_count_all() - leaf.doc_count(), docnums
+        for mindex in self._memory_indexes:
+            mindex.load(docs, generation)
+        self._memory_revids = dict((doc[ITEMID], doc[REVID]) for doc in docs)
+        self._memory_segments = segments
+        self._memory_updated = set()
+        self._memory_changes.clear()
+        self._memory_changes_start = self._memory_change
+
+    def _update_memory_segments(self, searcher):
+        """
+        Update the in-memory indexes for the documents changed since the last sync.
+
+        whoosh never changes the documents of a segment, it only marks them
+        deleted, so added documents are the ones in segments we did not know
+        yet (new or merged ones, the latter also contain documents we know,
+        their revids tell) and removed documents are the ones deleted since the
+        last sync or in segments that are gone (merged ones). The items this
+        process updated meanwhile are looked up, as their documents might have
+        been removed from segments we did not know.
+        """
+        reader = searcher.reader()
+        removed = set()  # itemids of removed documents
+        added = {}  # itemid -> added document
+        segments = {}
+        for segment_id, leaf in self._segment_readers(reader).items():
+            deleted_count = leaf.doc_count_all() - leaf.doc_count()
+            known = self._memory_segments.get(segment_id)
+            if known is None:
+                docnums = {}
+                for docnum, doc in leaf.iter_docs():
+                    doc = self._memory_document(doc)
+                    if doc is not None:
+                        docnums[docnum] = doc[ITEMID]
+                        added[doc[ITEMID]] = doc
+            else:
+                known_deleted_count, docnums = known
+                if deleted_count != known_deleted_count:
+                    deleted = set(docnum for docnum in docnums if leaf.is_deleted(docnum))
+                    removed.update(docnums[docnum] for docnum in deleted)
+                    docnums = dict((docnum, itemid) for docnum, itemid in docnums.items() if docnum not in deleted)
+            segments[segment_id] = deleted_count, docnums
+        for segment_id, (deleted_count, docnums) in self._memory_segments.items():
+            if segment_id not in segments:
+                removed.update(docnums.values())
+        for itemid in self._memory_updated - set(added):
+            doc = searcher.document(**{ITEMID: itemid})
+            if doc is not None:
+                doc = self._memory_document(doc)
+            if doc is None:
+                removed.add(itemid)
+            else:
+                added[itemid] = doc
+        for itemid in removed:
+            if itemid not in added and itemid in self._memory_revids:
+                self._apply_memory_update(itemid, None)
+        for itemid, doc in added.items():
+            if self._memory_revids.get(itemid) != doc[REVID]:
+                self._apply_memory_update(itemid, doc)
+        logging.debug("in-memory indexes: {0} added, {1} removed documents since the last sync".format(
+                      len(added), len(removed)))
+        self._memory_segments = segments
+        self._memory_updated = set()
+
+    def changed_names(self, since):
+        """
+        Return the names of the items changed (also by other processes) since
+        the in-memory indexes were at change number since.
+
+        :param since: change number returned by an earlier call (or None)
+        :returns: (change number, set of the names the changed items had before
+                  and after the changes, None if the changes are not known)
+        """
+        self._sync_memory_indexes()
+        with self._memory_lock:
+            if since is None or since < self._memory_changes_start:
+                return self._memory_change, None
+            names = set()
+            for change, item_names in reversed(self._memory_changes):
+                if change <= since:
+                    break
+                names.update(item_names)
+            return self._memory_change, names
+
+    def link_graph(self):
+        """
+        Return the link graph of the latest revisions of this wiki (see LinkGraph).
+        """
+        return self._memory_index(self._link_graph)
+
+    def name_index(self):
+        """
+        Return the name index of the latest revisions of this wiki (see NameIndex).
+        """
+        return self._memory_index(self._name_index)
+
+    def name_tree(self):
+        """
+        Return the name tree of the latest revisions of this wiki (see NameTree).
+        """
+        return self._memory_index(self._name_tree)
+
+    def subscription_patterns(self):
+        """
+        Return the name prefix / regex subscriptions of the users of this wiki (see SubscriptionPatterns).
+        """
+        return self._memory_index(self._subscription_patterns)
+
+    def user_names(self):
+        """
+        Return the names of the users of this wiki (see UserNames).
+        """
+        return self._memory_index(self._user_names)
+
+    def _latest_document(self, meta, content, backend_name, index=None):
+        """
+        Convert a latest revision to a whoosh document for the latest revs index.
+
+        :param index: latest revs index to look up parent items (for hierarchic ACLs)
+        """
+        doc = backend_to_index(meta, content, self.schemas[LATEST_REVS], self.wikiname, backend_name)
+        self._add_effective_acl(doc, meta, index)
+        return doc
+
+    def _add_effective_acl(self, doc, meta, index=None):
+        if self.acl_mapping is not None:
+            doc[EFFECTIVE_ACL] = self._effective_acl(meta, index)
+
+    def _effective_acl(self, meta, index=None):
+        """
+        Determine the effective ACL of a latest revision the same way as the
+        ProtectingMiddleware does and normalize it to index terms.
+
+        :param index: latest revs index to look up parent items (for hierarchic ACLs)
+        :returns: list of terms (see acl_index_terms)
+        """
+        searchers = []
+
+        def lookup(name):
+            if self._acl_names is not None and name in self._acl_names:
+                return self._acl_names[name]
+            if index is None:
+                return None
+            if not searchers:
+                searchers.append(index.searcher())
+            doc = searchers[0].document(**{NAME_EXACT: name})
+            if doc is None:
+                return None
+            names = doc.get(NAME, [])
+            return doc.get(ACL), CompositeName(doc.get(NAMESPACE, u''), NAME_EXACT, names[0]), names
+
+        def item_acls(acl, fqname, names):
+            # see ProtectingMiddleware._get_acls
+            if acl is not None:
+                return [acl, ]
+            if get_configured_acls(self.acl_mapping, fqname)['hierarchic']:
+                acl_list = []
+                for parent_name in get_parent_names(names):
+                    parent = lookup(parent_name)
+                    if parent is not None:
+                        acl_list.extend(item_acls(*parent))
+                if acl_list:
+                    return acl_list
+            return [None, ]
+
+        names = get_names(meta)
+        fqname = self._acl_fqname(meta, names)
+        acl_cfg = get_configured_acls(self.acl_mapping, fqname)
+        try:
+            acls = item_acls(meta.get(ACL), fqname, names)
+        finally:
+            for searcher in searchers:
+                searcher.close()
+        # see ProtectedItem.full_acls
+        full_acls = [u' '.join([acl_cfg['before'], acl if acl is not None else acl_cfg['default'], acl_cfg['after']])
+                     for acl in acls]
+        return acl_index_terms(full_acls, acl_cfg['default'], self.acl_rights_contents)
+
+    def _acl_fqname(self, meta, names):
+        namespace = meta.get(NAMESPACE, u'')
+        if names:
+            return CompositeName(namespace, NAME_EXACT, names[0])
+        return CompositeName(namespace, ITEMID, meta.get(ITEMID))
+
+    def _acl_names_changed(self, doc_latest):
+        """
+        Return the names of the items whose sub items' effective ACLs might change
+        if doc_latest gets indexed (only for hierarchic ACLs).
+        """
+        if not self.acl_hierarchic:
+            return []
+        with self.ix[LATEST_REVS].searcher() as searcher:
+            doc_old = searcher.document(**{ITEMID: doc_latest[ITEMID]})
+        names = doc_latest.get(NAME, [])
+        if doc_old is None:
+            return names
+        names_old = doc_old.get(NAME, [])
+        if doc_old.get(ACL) == doc_latest.get(ACL) and names_old == names:
+            return []
+        return names_old + names
+
+    def _build_acl_names(self, backends_revids):
+        """
+        Build the name -> (acl, fqname, names) mapping of the given latest revisions,
+        so the effective ACLs can be determined while the latest revs index is built.
+        """
+        acl_names = {}
+        for backend_name, revid in backends_revids:
+            try:
+                meta, data = self.backend.retrieve(backend_name, revid)
+            except KeyError:
+                continue
+            data.close()
+            names = get_names(meta)
+            entry = meta.get(ACL), self._acl_fqname(meta, names), names
+            for name in names:
+                acl_names[name] = entry
+        return acl_names
+
+    def _refresh_effective_acls(self, index, names=None):
+        """
+        Update the effective ACLs of the sub items of the items with the given names
+        (or of all items, if names is None) in the latest revs index.
+        """
+        if not self.acl_hierarchic:
+            return
+        if names is None:
+            query = Every()
+        elif names:
+            query = Or([Prefix(NAME_EXACT, name + u'/') for name in set(names)])
+        else:
+            return
+        with index.searcher() as searcher:
+            docs = [hit.fields() for hit in searcher.search(query, limit=None)]
+        updated = []
+        for doc in docs:
+            # the stored fields have all we need to determine the effective ACL:
+            effective_acl = self._effective_acl(doc, index)
+            if effective_acl == doc.get(EFFECTIVE_ACL):
+                continue
+            if doc.get(CONTENTTYPE) == CONTENTTYPE_USER:
+                # user profiles have unstored fields we can not rebuild from the stored ones
+                backend_name = doc[BACKENDNAME]
+                try:
+                    meta, data = self.backend.retrieve(backend_name, doc[REVID])
+                except KeyError:
+                    continue
+                data.close()
+                doc_new = backend_to_index(meta, doc[CONTENT], self.schemas[LATEST_REVS], self.wikiname,
+                                           backend_name)
+            else:
+                doc_new = dict(doc)
+                doc_new[NAME_EXACT] = doc_new[NAME]  # the only unstored field of other items
+            doc_new[EFFECTIVE_ACL] = effective_acl
+            updated.append(doc_new)
+        if not updated:
+            return
+        logging.debug("updating effective ACLs of {0} sub items".format(len(updated)))
+        if index is self.ix.get(LATEST_REVS) and self.commit_queue is not None:
+            self.commit_queue.put([(LATEST_REVS, doc) for doc in updated])
+        else:
+            with AsyncWriter(index) as writer:
+                for doc in updated:
+                    writer.update_document(**doc)
+            if index is self.ix.get(LATEST_REVS):
+                # effective ACLs are not in the in-memory indexes, they need no update
+                self._committed(LATEST_REVS, writer)
 
     def _modify_index(self, index, schema, wikiname, revids, mode='add', procs=1, limitmb=256):
         """
@@ -558,6 +2319,8 @@ class IndexingMiddleware(object):
                     meta, data = self.backend.retrieve(backend_name, revid)
                     content = convert_to_indexable(meta, data, is_new=False)
                     doc = backend_to_index(meta, content, schema, wikiname, backend_name)
+                    if schema is self.schemas[LATEST_REVS]:
+                        self._add_effective_acl(doc, meta, index)
                 if mode == 'update':
                     writer.update_document(**doc)
                 elif mode == 'add':
@@ -586,7 +2349,83 @@ class IndexingMiddleware(object):
                                       for v in by_item.values()]
         return latest_backends_revids
 
-    def rebuild(self, tmp=False, procs=1, limitmb=256):
+    def _indexable_document(self, idx_name, backend_name, revid):
+        """
+        Retrieve a revision from the backend and convert it to a whoosh document.
+
+        :returns: document for index idx_name (or None if the revision is gone)
+        """
+        try:
+            meta, data = self.backend.retrieve(backend_name, revid)
+        except KeyError:
+            logging.warning("revision {0} vanished from backend {1}, not indexing it".format(revid, backend_name))
+            return None
+        try:
+            content = convert_to_indexable(meta, data, is_new=False)
+        finally:
+            data.close()
+        if idx_name == LATEST_REVS:
+            return self._latest_document(meta, content, backend_name)
+        return backend_to_index(meta, content, self.schemas[idx_name], self.wikiname, backend_name)
+
+    def _add_documents(self, index, idx_name, revids, procs=1, limitmb=256, workers=1,
+                       resume=False, checkpoint=REBUILD_CHECKPOINT):
+        """
+        add the documents for all given revids to the index
+
+        Retrieving and converting the revisions is done by <workers> processes
+        in parallel, the index writer commits every <checkpoint> documents.
+        If resume is True, revisions already present in the index are skipped,
+        so an interrupted run can continue after its last commit.
+
+        :param revids: iterable of (backend_name, revid) tuples
+        :returns: count of added documents
+        """
+        if resume:
+            with index.searcher() as searcher:
+                indexed_revids = set(searcher.reader().field_terms(REVID))
+            logging.info("{0}: resuming, skipping {1} already indexed revisions".format(
+                         idx_name, len(indexed_revids)))
+            revids = ((backend_name, revid) for backend_name, revid in revids
+                      if revid not in indexed_revids)
+        tasks = ((idx_name, backend_name, revid) for backend_name, revid in revids)
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, _rebuild_worker_init, (self, app._get_current_object()))
+            docs = pool.imap_unordered(_rebuild_worker, tasks, REBUILD_CHUNKSIZE)
+        else:
+            docs = (self._indexable_document(*task) for task in tasks)
+        count = 0
+        start = time.time()
+        try:
+            writer = index.writer(procs=procs, limitmb=limitmb)
+            try:
+                for doc in docs:
+                    if doc is None:
+                        continue
+                    writer.add_document(**doc)
+                    count += 1
+                    if count % checkpoint == 0:
+                        writer.commit()
+                        self._log_progress(idx_name, count, start)
+                        writer = index.writer(procs=procs, limitmb=limitmb)
+            except:
+                writer.cancel()
+                raise
+            writer.commit()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self._log_progress(idx_name, count, start)
+        return count
+
+    def _log_progress(self, idx_name, count, start):
+        elapsed = time.time() - start
+        rate = count / elapsed if elapsed else 0.0
+        logging.info("{0}: {1} revisions indexed ({2:.1f} revs/s)".format(idx_name, count, rate))
+
+    def rebuild(self, tmp=False, procs=1, limitmb=256, workers=1, resume=False, checkpoint=REBUILD_CHECKPOINT):
         """
         Add all items/revisions from the backends of this wiki to the index
         (which is expected to have no items/revisions from this wiki yet).
@@ -594,25 +2433,44 @@ class IndexingMiddleware(object):
         Note: index might be shared by multiple wikis, so it is:
               create, rebuild wiki1, rebuild wiki2, ...
               create (tmp), rebuild wiki1, rebuild wiki2, ..., move
+
+        :param procs: number of processes the whoosh writer will use
+        :param limitmb: memory limit of each whoosh writer process
+        :param workers: number of processes retrieving and converting revisions
+        :param resume: continue an interrupted rebuild, skip already indexed revisions
+        :param checkpoint: commit the index every <checkpoint> documents
         """
+        if self.index_storage[0] == WHOOSH_RAMSTORAGE and procs > 1:
+            # whoosh's multiprocessing writer needs an index storage shared with its subprocesses
+            logging.warning("index_storage is a RamStorage, using procs=1")
+            procs = 1
         storage = self.get_storage(tmp)
+        if self.backend.journaling and not (resume and self._get_journal_keys(storage) is not None):
+            # all changes journaled after this point will be replayed by a journal update:
+            self._set_journal_keys(storage, self.backend.journal_keys())
         index = storage.open_index(ALL_REVS)
         try:
             # build an index of all we have (so we know what we have)
             all_revids = self.backend  # the backend is an iterator over all revids
-            self._modify_index(index, self.schemas[ALL_REVS], self.wikiname, all_revids, 'add', procs, limitmb)
+            self._add_documents(index, ALL_REVS, all_revids, procs, limitmb, workers, resume, checkpoint)
             latest_backends_revids = self._find_latest_backends_revids(index)
         finally:
             index.close()
         # now build the index of the latest revisions:
         index = storage.open_index(LATEST_REVS)
         try:
-            self._modify_index(index, self.schemas[LATEST_REVS], self.wikiname, latest_backends_revids, 'add',
-                               procs, limitmb)
+            if self.acl_hierarchic:
+                # we need to know the parent items' ACLs before they are in the index:
+                self._acl_names = self._build_acl_names(latest_backends_revids)
+            self._add_documents(index, LATEST_REVS, latest_backends_revids, procs, limitmb, workers, resume,
+                                checkpoint)
         finally:
+            self._acl_names = None
             index.close()
+        self._index_modified()
+        self.snapshot(tmp)
 
-    def update(self, tmp=False):
+    def update(self, tmp=False, journal=False):
         """
         Make sure index reflects current backend state, add missing stuff, remove outdated stuff.
 
@@ -620,12 +2478,26 @@ class IndexingMiddleware(object):
         * after a full rebuild that was done at tmp location
         * after wiki is made read-only or taken offline
         * after the index was moved to the normal index location
+        * after a crash (changes stored into the backend might be missing in the index)
 
         Reason: new revisions that were created after the rebuild started might be missing in new index.
 
+        :param journal: only replay the backend change journal entries that are not
+                        recorded in the index as contained (needs journaling backends),
+                        this is much faster than comparing all revisions in backend and index.
         :returns: index changed (bool)
         """
         storage = self.get_storage(tmp)
+        journaling = self.backend.journaling
+        if journal:
+            if not journaling:
+                raise ValueError("the backend does not keep a change journal")
+            contained_keys = self._get_journal_keys(storage)
+            if contained_keys is not None:
+                return self._update_from_journal(storage, contained_keys, tmp)
+            logging.warning("no journal keys recorded in the index, doing a full update")
+        # the changes journaled up to now will be contained in the index:
+        journal_keys = self.backend.journal_keys() if journaling else None
         index_all = storage.open_index(ALL_REVS)
         try:
             # NOTE: self.backend iterator gives (backend_name, revid) tuples, which is NOT
@@ -656,12 +2528,118 @@ class IndexingMiddleware(object):
             backend_latest_revids = set(revid for name, revid in backend_latest_backends_revids)
             upd_revids = backend_latest_revids - ix_revids
             upd_revids = [(revids_backends[revid], revid) for revid in upd_revids]
+            if self.acl_hierarchic:
+                self._acl_names = self._build_acl_names(upd_revids)
             self._modify_index(index_latest, self.schemas[LATEST_REVS], self.wikiname, upd_revids, 'update')
             self._modify_index(index_latest, self.schemas[LATEST_REVS], self.wikiname, del_revids, 'delete')
+            self._acl_names = None
+            if changed:
+                self._refresh_effective_acls(index_latest)
         finally:
+            self._acl_names = None
             index_latest.close()
+        if journal_keys is not None:
+            self._set_journal_keys(storage, journal_keys)
+        self._index_modified()
+        self.snapshot(tmp)
         return changed
 
+    def _update_from_journal(self, storage, contained_keys, tmp=False):
+        """
+        Replay the backend change journal entries that are not contained in
+        the index (their keys are not in contained_keys) to the index.
+
+        We compare keys, not sequence numbers, so entries journaled with a
+        clock that was behind are not missed. Replaying is idempotent: we do
+        not apply the journaled operations, but bring the journaled revisions
+        (and the latest revision of their items) in the index in sync with
+        their current state in the backend.
+
+        :returns: index changed (bool)
+        """
+        journal_keys = self.backend.journal_keys()
+        changes = {}  # revid -> (backend_name, itemid)
+        for (backend_name, key), entry in self.backend.journal(journal_keys - contained_keys):
+            changes[entry[REVID]] = backend_name, entry[ITEMID]
+        existing_revids, gone_revids, itemids = [], [], set()
+        for revid, (backend_name, itemid) in changes.items():
+            try:
+                meta, data = self.backend.retrieve(backend_name, revid)
+            except KeyError:
+                gone_revids.append((backend_name, revid))
+            else:
+                data.close()
+                existing_revids.append((backend_name, revid))
+            if itemid is not None:
+                itemids.add(itemid)
+        logging.info("journal update: {0} changed revisions, {1} removed revisions".format(
+                     len(existing_revids), len(gone_revids)))
+        index_all = storage.open_index(ALL_REVS)
+        try:
+            self._modify_index(index_all, self.schemas[ALL_REVS], self.wikiname, existing_revids, 'update')
+            self._modify_index(index_all, self.schemas[ALL_REVS], self.wikiname, gone_revids, 'delete')
+            latest_backends_revids, gone_itemids = [], []
+            for itemid in itemids:
+                backends_revids = self._find_latest_backends_revids(index_all, Term(ITEMID, itemid))
+                if backends_revids:
+                    latest_backends_revids.extend(backends_revids)
+                else:
+                    gone_itemids.append(itemid)
+        finally:
+            index_all.close()
+        index_latest = storage.open_index(LATEST_REVS)
+        try:
+            acl_names = []
+            if self.acl_hierarchic:
+                self._acl_names = self._build_acl_names(latest_backends_revids)
+                # names before and after the update, sub items of both might need new effective ACLs:
+                acl_names = list(self._acl_names)
+                with index_latest.searcher() as searcher:
+                    for itemid in itemids:
+                        doc = searcher.document(**{ITEMID: itemid})
+                        if doc is not None:
+                            acl_names.extend(doc.get(NAME, []))
+            self._modify_index(index_latest, self.schemas[LATEST_REVS], self.wikiname, latest_backends_revids,
+                               'update')
+            with index_latest.writer() as writer:
+                for itemid in gone_itemids:
+                    writer.delete_by_term(ITEMID, itemid)
+            self._acl_names = None
+            self._refresh_effective_acls(index_latest, acl_names)
+        finally:
+            self._acl_names = None
+            index_latest.close()
+        self._set_journal_keys(storage, journal_keys)
+        if not tmp:
+            # a rebuild in progress at the tmp location might still need some entries:
+            tmp_keys = self._get_journal_keys(self.get_storage(tmp=True))
+            self.backend.prune_journal(journal_keys if tmp_keys is None else journal_keys & tmp_keys)
+        self._index_modified()
+        self.snapshot(tmp)
+        return bool(changes)
+
+    def _get_journal_keys(self, storage):
+        """
+        Get the set of the change journal keys recorded in the index storage (or None).
+        """
+        if not storage.file_exists(JOURNAL_KEYS_FILE):
+            return None
+        f = storage.open_file(JOURNAL_KEYS_FILE)
+        try:
+            return set((str(backend_name), str(key)) for backend_name, key in json.loads(f.read()))
+        finally:
+            f.close()
+
+    def _set_journal_keys(self, storage, keys):
+        """
+        Record the set of change journal keys in the index storage.
+        """
+        f = storage.create_file(JOURNAL_KEYS_FILE)
+        try:
+            f.write(json.dumps(sorted(keys)))
+        finally:
+            f.close()
+
     def optimize_backend(self):
         """
         Optimize backend / collect garbage to safe space:
@@ -685,6 +2663,8 @@ class IndexingMiddleware(object):
                 ix.optimize()
             finally:
                 ix.close()
+        self._index_modified()
+        self.snapshot(tmp)
 
     def dump(self, tmp=False, idx_name=LATEST_REVS):
         """
@@ -720,9 +2700,13 @@ class IndexingMiddleware(object):
             """
             def userid_pseudo_field(node):
                 username = node.text
-                users = user.search_users(**{NAME_EXACT: username})
-                if users:
-                    userid = users[0].meta[ITEMID]
+                userid = self.user_names().itemid(username)
+                if userid is None:
+                    # not in the in-memory index (yet?), make sure by asking the index
+                    doc = self._document(**{NAMESPACE: NAMESPACE_USERPROFILES, NAME_EXACT: username})
+                    if doc is not None:
+                        userid = doc[ITEMID]
+                if userid:
                     node = WordNode(userid)
                     node.set_fieldname(fieldname)
                     return node
@@ -740,22 +2724,50 @@ class IndexingMiddleware(object):
         """
         Search with query q, yield Revisions.
         """
-        with self.ix[idx_name].searcher() as searcher:
+        with self.searcher(idx_name) as searcher:
             # Note: callers must consume everything we yield, so the for loop
-            # ends and the "with" is left to close the index files.
+            # ends and the "with" is left to release the searcher.
             for hit in searcher.search(q, **kw):
                 doc = hit.fields()
                 latest_doc = doc if idx_name == LATEST_REVS else None
                 item = Item(self, latest_doc=latest_doc, itemid=doc[ITEMID])
                 yield item.get_revision(doc[REVID], doc=doc)
 
+    def history(self, q, idx_name=ALL_REVS, offset=0, limit=None, **kw):
+        """
+        Search with query q, return a tuple (entries, more) for the matching
+        revisions offset ... offset + limit - 1 (newest first) and whether there
+        are more of them (after these).
+
+        The entries are dicts with the HISTORY_FIELDS (and FQNAME) of the revisions,
+        made from the stored index fields only, without loading the revisions.
+        """
+        with self.searcher(idx_name) as searcher:
+            results = searcher.search(q, sortedby=[MTIME], reverse=True,
+                                      limit=None if limit is None else offset + limit + 1, **kw)
+            end = None if limit is None else offset + limit
+            entries = [self._history_entry(hit.fields()) for hit in results[offset:end]]
+            more = end is not None and results.scored_length() > end
+        return entries, more
+
+    def _history_entry(self, doc):
+        entry = dict((key, doc[key]) for key in HISTORY_FIELDS if key in doc)
+        # whoosh has a datetime object, but we want a UNIX timestamp
+        entry[MTIME] = utctimestamp(entry[MTIME])
+        names = entry.get(NAME)
+        if names:
+            entry[FQNAME] = CompositeName(entry.get(NAMESPACE, u''), NAME_EXACT, names[0])
+        else:
+            entry[FQNAME] = CompositeName(entry.get(NAMESPACE, u''), ITEMID, entry[ITEMID])
+        return entry
+
     def search_page(self, q, idx_name=LATEST_REVS, pagenum=1, pagelen=10, **kw):
         """
         Same as search, but with paging support.
         """
-        with self.ix[idx_name].searcher() as searcher:
+        with self.searcher(idx_name) as searcher:
             # Note: callers must consume everything we yield, so the for loop
-            # ends and the "with" is left to close the index files.
+            # ends and the "with" is left to release the searcher.
             for hit in searcher.search_page(q, pagenum, pagelen=pagelen, **kw):
                 doc = hit.fields()
                 latest_doc = doc if idx_name == LATEST_REVS else None
@@ -777,9 +2789,9 @@ class IndexingMiddleware(object):
 
         If no kw args are given, this yields all documents.
         """
-        with self.ix[idx_name].searcher() as searcher:
+        with self.searcher(idx_name) as searcher:
             # Note: callers must consume everything we yield, so the for loop
-            # ends and the "with" is left to close the index files.
+            # ends and the "with" is left to release the searcher.
             for doc in searcher.documents(**kw):
                 yield doc
 
@@ -797,13 +2809,105 @@ class IndexingMiddleware(object):
         """
         Return a document matching the kw args (internal use only).
         """
-        with self.ix[idx_name].searcher() as searcher:
+        with self.searcher(idx_name) as searcher:
             return searcher.document(**kw)
 
+    def scope_filter(self, searcher, item_name, transclusions=True):
+        """
+        Return a filter (set of document numbers of the searcher) for searching
+        item item_name, its sub items and (if transclusions is True) all items
+        transcluded by them, directly or indirectly.
+        """
+        prefix_name = item_name + u'/'
+        docnums = set(searcher.docs_for_query(Or([Term(NAME_EXACT, item_name), Prefix(NAME_EXACT, prefix_name), ])))
+        if transclusions:
+            fqnames = [fqname for fqname in self.name_index().prefixed(item_name)
+                       if fqname.value == item_name or fqname.value.startswith(prefix_name)]
+            for itemid in self.link_graph().transclusion_closure(fqnames):
+                docnums.update(searcher.docs_for_query(Term(ITEMID, itemid)))
+        return docnums
+
+    def tag_counts(self, idx_name=LATEST_REVS, filter=None, **kw):
+        """
+        Return a dict tag -> count of the documents matching the kw args (and
+        the optional filter query) that have this tag.
+
+        The counts are computed from the index terms (no documents get loaded)
+        and cached until the index gets modified.
+        """
+        key = idx_name, filter, tuple(sorted(kw.items()))
+        with self.searcher(idx_name) as searcher:
+            # the version of the index the (pooled) searcher sees:
+            generation = searcher.reader().generation()
+            with self._tag_counts_lock:
+                cached = self._tag_counts.get(key)
+            if cached is not None and cached[0] == generation:
+                return dict(cached[1])
+            q = And([Term(k, v) for k, v in kw.items()]) if kw else Every()
+            facet = FieldFacet(TAGS, allow_overlap=True, maptype=Count)
+            counts = searcher.search(q, filter=filter, groupedby={TAGS: facet}, limit=None, scored=False).groups(TAGS)
+        counts.pop(None, None)  # documents without tags
+        with self._tag_counts_lock:
+            if len(self._tag_counts) >= TAG_COUNTS_CACHE_SIZE:
+                self._tag_counts.clear()
+            self._tag_counts[key] = generation, counts
+        return dict(counts)
+
+    def indexed_content(self, doc):
+        """
+        Return the indexed content of the revision of index document doc.
+
+        The latest revs index stores the content. The all revs index does not,
+        we take it from the latest revision of the item if it has the same data,
+        otherwise we transform the revision data again (revisions sharing the
+        same data share the cached result, see convert_to_indexable).
+        """
+        if CONTENT in doc:
+            return doc[CONTENT]
+        latest_doc = self._document(**{ITEMID: doc[ITEMID]})
+        if (latest_doc is not None and latest_doc.get(DATAID) == doc.get(DATAID) and
+                latest_doc.get(CONTENTTYPE) == doc.get(CONTENTTYPE)):
+            return latest_doc[CONTENT]
+        try:
+            meta, data = self.backend.retrieve(doc[BACKENDNAME], doc[REVID])
+        except KeyError:
+            # revision is gone from the backend meanwhile
+            return u''
+        try:
+            return convert_to_indexable(meta, data, is_new=False)
+        finally:
+            data.close()
+
     def has_item(self, name):
         item = self[name]
         return bool(item)
 
+    def existing_names(self, names):
+        """
+        Return the set of those names that are names of existing items (like
+        has_item, but for many names with one index query).
+        """
+        names = set(names)
+        if not names:
+            return set()
+        query = Or([Term(NAME_EXACT, name) for name in names])
+        with self.searcher() as searcher:
+            return set(name for docnum in searcher.docs_for_query(query)
+                       for name in searcher.stored_fields(docnum).get(NAME, []) if name in names)
+
+    def latest_revids(self, fqnames):
+        """
+        Return a dict fqname -> revid of the latest revision, for those of the
+        fqnames that are existing items (using one searcher for all lookups).
+        """
+        revids = {}
+        with self.searcher() as searcher:
+            for fqname in set(fqnames):
+                doc = searcher.document(**fqname.query)
+                if doc is not None:
+                    revids[fqname] = doc[REVID]
+        return revids
+
     def __getitem__(self, name):
         """
         Return item with <name> (may be a new or existing item).
@@ -892,14 +2996,7 @@ class PropertiesMixin(object):
 
         :return: parent names (list of unicode)
         """
-        parent_names = []
-        for name in self.names:
-            parentname_tail = name.rsplit('/', 1)
-            if len(parentname_tail) == 2:
-                parent_name = parentname_tail[0]
-                if parent_name not in parent_names:
-                    parent_names.append(parent_name)
-        return parent_names
+        return get_parent_names(self.names)
 
     @property
     def fqparentnames(self):
@@ -1033,6 +3130,14 @@ class Item(PropertiesMixin):
         """
         preprocess a revision before it gets stored and put into index.
         """
+        if HASH_ALGORITHM not in meta and indexable_cache_enabled():
+            # compute the data hash now (the backend would compute it only when
+            # storing), so we can use cached indexable content for known data:
+            hasher = hashlib.new(HASH_ALGORITHM)
+            for block in iter(lambda: data.read(64 * 1024), ''):
+                hasher.update(block)
+            data.seek(0)
+            meta[HASH_ALGORITHM] = unicode(hasher.hexdigest())
         content = convert_to_indexable(meta, data, self.name, is_new=True)
         return meta, data, content
 
@@ -1062,6 +3167,8 @@ class Item(PropertiesMixin):
         :param return_rev: if True, return a Revision instance of the just created revision
         :returns: a Revision instance or None
         """
+        # check this before modifying the backend, the index must not get out of sync:
+        self.indexer._check_writable()
         if remote_addr is None:
             try:
                 # if we get here outside a request, this won't work:
@@ -1128,11 +3235,13 @@ class Item(PropertiesMixin):
         data.seek(0)  # rewind file
         backend_name, revid = backend.store(meta, data)
         meta[REVID] = revid
-        self.indexer.index_revision(meta, content, backend_name)
+        doc = self.indexer.index_revision(meta, content, backend_name)
+        if not self.indexer.batching:
+            doc = None  # get it from the index
         if not overwrite:
-            self._current = self.indexer._document(revid=revid)
+            self._current = doc or self.indexer._document(revid=revid)
         if return_rev:
-            return Revision(self, revid)
+            return Revision(self, revid, doc=doc)
 
     def store_all_revisions(self, meta, data):
         """
@@ -1146,6 +3255,7 @@ class Item(PropertiesMixin):
         """
         Destroy revision <revid>.
         """
+        self.indexer._check_writable()
         rev = Revision(self, revid)
         query = {DATAID: rev.meta[DATAID]}
         with flaskg.storage.indexer.ix[ALL_REVS].searcher() as searcher:
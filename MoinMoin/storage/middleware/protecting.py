@@ -15,16 +15,23 @@ Note: for method / attribute docs, please see the same methods / attributes in
 from __future__ import absolute_import, division
 
 import time
+import threading
+from collections import OrderedDict
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
 
+from flask import g as flaskg
+
+from blinker import ANY
 from whoosh.util.cache import lru_cache
+from whoosh.query import And, Or, Not, Term, Every
 
 from MoinMoin.constants.rights import (CREATE, READ, PUBREAD, WRITE, DESTROY, ACL_RIGHTS_CONTENTS)
-from MoinMoin.constants.keys import ALL_REVS, LATEST_REVS, NAME_EXACT, ITEMID
+from MoinMoin.constants.keys import ALL_REVS, LATEST_REVS, NAME, ITEMID, EFFECTIVE_ACL, TAGS
 
-from MoinMoin.security import AccessControlList
+from MoinMoin.security import AccessControlList, get_configured_acls, acl_index_terms
+from MoinMoin.signalling.signals import item_modified, items_modified
 
 from MoinMoin.util.interwiki import split_fqname
 
@@ -33,6 +40,10 @@ LOOKUP_CACHE = 100  # ACL lookup for some itemname
 PARSE_CACHE = 100  # ACL string -> ACL object parsing
 EVAL_CACHE = 500  # ACL evaluation for some username / capability
 
+# max sizes of the caches shared by all requests (see AclCache):
+SHARED_LOOKUP_CACHE = 10000  # ACL lookup for some itemid / itemname
+SHARED_PARSE_CACHE = 1000  # ACL string -> ACL object parsing
+
 
 class AccessDenied(Exception):
     """
@@ -40,6 +51,155 @@ class AccessDenied(Exception):
     """
 
 
+class AclCache(object):
+    """
+    ACL cache shared by all ProtectingMiddleware instances (requests) of a wiki.
+
+    It caches parsed ACLs and the effective ACLs of items (see
+    ProtectingMiddleware._get_acls). ACL evaluation results are not shared, as
+    they depend on the groups and the user of the request.
+
+    The effective ACLs of an item depend on its own ACL and names and on the
+    ACLs of its hierarchic parent items, so when an item is modified, the
+    entries of the items with its (old or new) names or names below them get
+    invalidated (see invalidate). As other processes might modify items too,
+    the indexer gets asked for the names of the items changed since the last
+    validation (see validate).
+    """
+    def __init__(self, parse_size=SHARED_PARSE_CACHE, lookup_size=SHARED_LOOKUP_CACHE):
+        self.lock = threading.Lock()
+        self.parse_size = parse_size
+        self.lookup_size = lookup_size
+        self.parsed = OrderedDict()
+        self.acls = OrderedDict()  # key -> (effective ACLs, names they depend on)
+        self.keys = {}  # name -> keys of the effective ACLs depending on it
+        self.change = None  # indexer change number the cache is up-to-date with
+        # incremented at each invalidation, so we do not cache results computed before it:
+        self.epoch = 0
+
+    def _get(self, cache, key):
+        # caller must hold the lock
+        value = cache.pop(key)  # raises KeyError if not cached
+        cache[key] = value  # most recently used is last
+        return value
+
+    def _set(self, cache, size, key, value):
+        # caller must hold the lock
+        cache.pop(key, None)
+        if len(cache) >= size:
+            cache.popitem(last=False)  # remove the least recently used
+        cache[key] = value
+
+    def parse_acl(self, key, parse):
+        """
+        return the cached ACL object for key or call parse() to create it
+        """
+        with self.lock:
+            try:
+                return self._get(self.parsed, key)
+            except KeyError:
+                pass
+        aclobj = parse()
+        with self.lock:
+            self._set(self.parsed, self.parse_size, key, aclobj)
+        return aclobj
+
+    def _dependencies(self, names):
+        # the names and their hierarchic parent names
+        for name in names:
+            parts = name.split(u'/')
+            for count in range(1, len(parts) + 1):
+                yield u'/'.join(parts[:count])
+
+    def _remove(self, key):
+        # caller must hold the lock
+        acls, names = self.acls.pop(key)
+        for name in self._dependencies(names):
+            keys = self.keys.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys[name]
+
+    def get_acls(self, key, lookup):
+        """
+        return the cached effective ACLs for key or call lookup() to determine them,
+        lookup returns the effective ACLs and the names of the item they belong to
+        """
+        with self.lock:
+            try:
+                return self._get(self.acls, key)[0]
+            except KeyError:
+                epoch = self.epoch
+        acls, names = lookup()
+        with self.lock:
+            if epoch == self.epoch:
+                if key in self.acls:
+                    self._remove(key)
+                if len(self.acls) >= self.lookup_size:
+                    self._remove(next(iter(self.acls)))  # remove the least recently used
+                self.acls[key] = acls, names
+                for name in self._dependencies(names):
+                    self.keys.setdefault(name, set()).add(key)
+        return acls
+
+    def validate(self, indexer):
+        """
+        invalidate the effective ACLs of the items modified since the last
+        validation (e.g. by another process), clear them all if the indexer does
+        not know these modifications
+        """
+        with self.lock:
+            since = self.change
+        change, names = indexer.changed_names(since)
+        with self.lock:
+            if names is None:
+                self._clear()
+            else:
+                self._invalidate(names)
+            self.change = change
+
+    def invalidate(self, names):
+        """
+        invalidate the effective ACLs of the items with these names or names below
+        them (call this with the old and new names of modified items)
+        """
+        with self.lock:
+            self._invalidate(names)
+
+    def _invalidate(self, names):
+        # caller must hold the lock
+        if names:
+            for name in names:
+                for key in list(self.keys.get(name, ())):
+                    self._remove(key)
+            self.epoch += 1
+
+    def clear(self):
+        """
+        clear the effective ACLs
+        """
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        # caller must hold the lock
+        self.acls.clear()
+        self.keys.clear()
+        self.epoch += 1
+
+
+@item_modified.connect_via(ANY)
+@items_modified.connect_via(ANY)
+def clear_acl_cache(app, item_name=None, item_names=None, **kwargs):
+    acl_cache = getattr(app, 'acl_cache', None)
+    if acl_cache is not None:
+        names = list(item_names or [])
+        if item_name is not None:
+            names.append(item_name)
+        acl_cache.invalidate([split_fqname(name).value for name in names])
+
+
 def pchecker(right, allowed, item):
     """some permissions need additional checking"""
     if allowed and right == PUBREAD:
@@ -54,17 +214,24 @@ def pchecker(right, allowed, item):
 
 
 class ProtectingMiddleware(object):
-    def __init__(self, indexer, user, acl_mapping):
+    def __init__(self, indexer, user, acl_mapping, acl_cache=None, group_cache=None):
         """
         :param indexer: indexing middleware instance
         :param user: a User instance (used for checking permissions)
         :param acl_mapping: list of (name_prefix, acls) tuples, longest prefix first, '' last
                             acls = dict with before, default, after, hierarchic entries
+        :param acl_cache: AclCache instance shared by all requests (optional)
+        :param group_cache: CachedGroups instance shared by all requests (optional)
         """
         self.indexer = indexer
         self.user = user
         self.acl_mapping = acl_mapping
         self.valid_rights = ACL_RIGHTS_CONTENTS
+        self.acl_cache = acl_cache
+        if acl_cache is not None:
+            acl_cache.validate(indexer)
+        self.group_cache = group_cache
+        self._read_filter = None
         # The ProtectingMiddleware exists just 1 request long, but might have
         # to parse and evaluate huge amounts of ACLs. We avoid doing same stuff
         # again and again by using some fresh lru caches for each PMW instance.
@@ -74,27 +241,29 @@ class ProtectingMiddleware(object):
         self.eval_acl = lru_cache_decorator(self._eval_acl)
         lru_cache_decorator = lru_cache(LOOKUP_CACHE)
         self.get_acls = lru_cache_decorator(self._get_acls)
+        # item name -> item exists?, see existing_names
+        self._existing = {}
 
-    def _clear_acl_cache(self):
+    def _clear_acl_cache(self, names):
         # if we have modified the backend somehow so ACL lookup is influenced,
         # this functions need to get called, so it clears the ACL cache.
         # ACL lookups afterwards will fetch fresh info from the lower layers.
+        # names = old and new names of the modified item, the shared cache
+        # invalidates the effective ACLs of it and of the items below it.
         self.get_acls.cache_clear()
+        if self.acl_cache is not None:
+            self.acl_cache.invalidate(names)
+        # modifications might also create or remove items:
+        self._existing.clear()
 
-    def _get_configured_acls(self, fqname):
-        """
-        for a fully-qualified itemname (namespace:name), get the acl configuration
-        for that (part of the) namespace.
+    def _clear_group_cache(self, names):
+        # if we have modified a group item (names = old and new names of the
+        # modified item), the members of the cached groups might have changed.
+        if self.group_cache is not None and any(self.group_cache.is_group_name(name) for name in names):
+            self.group_cache.invalidate()
 
-        @param fqname: fully qualified itemname
-        @returns: acl configuration (acl dict from the acl_mapping)
-        """
-        itemname = fqname.value if fqname.field == NAME_EXACT else u''
-        for prefix, acls in self.acl_mapping:
-            if itemname.startswith(prefix):
-                return acls
-        else:
-            raise ValueError('No acl_mapping entry found for item {0!r}'.format(fqname))
+    def _get_configured_acls(self, fqname):
+        return get_configured_acls(self.acl_mapping, fqname)
 
     def _get_acls(self, itemid=None, fqname=None):
         """
@@ -106,7 +275,15 @@ class ProtectingMiddleware(object):
         be returned.
         All lists are without considering before/default/after acls.
         """
+        if self.acl_cache is not None:
+            return self.acl_cache.get_acls((itemid, fqname), lambda: self._lookup_acls(itemid, fqname))
+        return self._lookup_acls(itemid, fqname)[0]
 
+    def _lookup_acls(self, itemid=None, fqname=None):
+        """
+        return the effective acls (see _get_acls) and the names of the item
+        (the shared cache needs to know which items they depend on)
+        """
         if itemid is not None:
             q = {ITEMID: itemid}
         elif fqname is not None:
@@ -116,10 +293,13 @@ class ProtectingMiddleware(object):
         else:
             raise ValueError("need itemid or fqname")
         item = self.get_item(**q)
+        names = list(item.names)
+        if fqname is not None:
+            names.append(fqname.value)
         acl = item.acl
         fqname = item.fqname
         if acl is not None:
-            return [acl, ]
+            return [acl, ], names
         acl_cfg = self._get_configured_acls(fqname)
         if acl_cfg['hierarchic']:
             # check parent(s), recursively
@@ -129,10 +309,15 @@ class ProtectingMiddleware(object):
                 for parentid in parentids:
                     pacls = self.get_acls(parentid, None)
                     acl_list.extend(pacls)
-                return acl_list
-        return [None, ]
+                return acl_list, names
+        return [None, ], names
 
     def _parse_acl(self, acl, default=''):
+        if self.acl_cache is not None:
+            return self.acl_cache.parse_acl((acl, default), lambda: self._make_acl(acl, default))
+        return self._make_acl(acl, default)
+
+    def _make_acl(self, acl, default=''):
         return AccessControlList([acl, ], default=default, valid=self.valid_rights)
 
     def _eval_acl(self, acl, default_acl, user_name, right):
@@ -142,20 +327,88 @@ class ProtectingMiddleware(object):
     def query_parser(self, default_fields, idx_name=LATEST_REVS):
         return self.indexer.query_parser(default_fields, idx_name=idx_name)
 
+    def _principals(self):
+        """
+        names of all ACL entries that might apply to the user: user names,
+        special users and groups.
+        """
+        principals = set(self.user.name)
+        principals.add(u'All')
+        if getattr(self.user, 'valid', False):
+            principals.add(u'Known')
+        if getattr(self.user, 'trusted', False):
+            principals.add(u'Trusted')
+        groups = getattr(flaskg, 'groups', None)
+        if groups is not None:
+            for member in list(principals):
+                principals.update(groups.groups_with_member(member))
+        return principals
+
+    def read_filter(self, idx_name=LATEST_REVS):
+        """
+        Return a whoosh query matching the documents the user might read (or None
+        if the index has no effective ACLs suitable for filtering).
+
+        It uses the effective ACLs the indexer stores for the latest revisions, so
+        the ACL filtering happens in the index. Results still need to be checked
+        (see acl_index_terms), but only very few will be rejected by that.
+        """
+        if idx_name != LATEST_REVS or self.indexer.acl_mapping is None or self.indexer.acl_mapping != self.acl_mapping:
+            return None
+        if self._read_filter is None:
+            self._read_filter = Or([Term(EFFECTIVE_ACL, u'{0}:+{1}'.format(principal, right))
+                                    for principal in sorted(self._principals())
+                                    for right in (READ, PUBREAD)])
+        return self._read_filter
+
+    def _filter_kw(self, idx_name, kw):
+        read_filter = self.read_filter(idx_name)
+        if read_filter is not None:
+            if kw.get('filter') is not None:
+                read_filter = And([kw['filter'], read_filter])
+            kw = dict(kw, filter=read_filter)
+        return kw
+
     def search(self, q, idx_name=LATEST_REVS, **kw):
+        kw = self._filter_kw(idx_name, kw)
         for rev in self.indexer.search(q, idx_name, **kw):
             rev = ProtectedRevision(self, rev)
             if rev.allows(READ) or rev.allows(PUBREAD):
                 yield rev
 
     def search_page(self, q, idx_name=LATEST_REVS, pagenum=1, pagelen=10, **kw):
+        kw = self._filter_kw(idx_name, kw)
         for rev in self.indexer.search_page(q, idx_name, pagenum, pagelen, **kw):
             rev = ProtectedRevision(self, rev)
             if rev.allows(READ) or rev.allows(PUBREAD):
                 yield rev
 
+    def history(self, q, idx_name=ALL_REVS, offset=0, limit=None, **kw):
+        """
+        Same as indexer.history, but only with revisions of items the user may read.
+
+        Note: the read permission is checked once per item, but the filtering
+              happens after paging, so pages of a history of multiple items
+              might have less entries.
+        """
+        entries, more = self.indexer.history(q, idx_name, offset, limit, **kw)
+        readable = {}
+        for entry in entries:
+            itemid = entry[ITEMID]
+            if itemid not in readable:
+                item = self.get_item(itemid=itemid)
+                readable[itemid] = item.allows(READ) or item.allows(PUBREAD)
+        return [entry for entry in entries if readable[entry[ITEMID]]], more
+
     def documents(self, idx_name=LATEST_REVS, **kw):
-        for rev in self.indexer.documents(idx_name, **kw):
+        read_filter = self.read_filter(idx_name)
+        if read_filter is not None:
+            # same as whoosh's searcher.documents(**kw), but with the filter:
+            q = And([Term(key, value) for key, value in kw.items()]) if kw else Every()
+            revs = self.indexer.search(q, idx_name, filter=read_filter, limit=None, scored=False)
+        else:
+            revs = self.indexer.documents(idx_name, **kw)
+        for rev in revs:
             rev = ProtectedRevision(self, rev)
             if rev.allows(READ) or rev.allows(PUBREAD):
                 yield rev
@@ -167,8 +420,56 @@ class ProtectingMiddleware(object):
             if rev.allows(READ) or rev.allows(PUBREAD):
                 return rev
 
+    def tag_counts(self, idx_name=LATEST_REVS, **kw):
+        """
+        Return a dict tag -> count of the documents matching the kw args the
+        user might read.
+
+        With effective ACLs in the index, the indexer counts the documents
+        some principal of the user has the read right for without any of them
+        being denied it - the user may surely read those. The remaining
+        documents of the read filter get checked and counted here, like
+        documents() does. Otherwise all documents get counted here.
+        """
+        read_filter = self.read_filter(idx_name)
+        if read_filter is None:
+            counts = {}
+            revs = self.documents(idx_name, **kw)
+        else:
+            principals = sorted(self._principals())
+            granted = Or([Term(EFFECTIVE_ACL, u'{0}:+{1}'.format(principal, READ)) for principal in principals])
+            denied = Or([Term(EFFECTIVE_ACL, u'{0}:-{1}'.format(principal, READ)) for principal in principals])
+            readable = And([granted, Not(denied)])
+            counts = self.indexer.tag_counts(idx_name, filter=readable, **kw)
+            q = And([Term(key, value) for key, value in kw.items()]) if kw else Every()
+            revs = self.indexer.search(q, idx_name, filter=And([read_filter, Not(readable)]), limit=None, scored=False)
+            revs = (ProtectedRevision(self, rev) for rev in revs)
+            revs = (rev for rev in revs if rev.allows(READ) or rev.allows(PUBREAD))
+        for rev in revs:
+            for tag in rev.meta.get(TAGS, []):
+                counts[tag] = counts.get(tag, 0) + 1
+        return counts
+
     def has_item(self, name):
-        return self.indexer.has_item(name)
+        return name in self.existing_names([name])
+
+    def existing_names(self, names):
+        """
+        Return the set of those names that are names of existing items.
+
+        The results are remembered for this request, so e.g. the link converters
+        of an item and its transclusions look up every name only once, all the
+        names not looked up yet with one index query.
+        """
+        unknown = set(name for name in names if name not in self._existing)
+        if unknown:
+            existing = self.indexer.existing_names(unknown)
+            for name in unknown:
+                self._existing[name] = name in existing
+        return set(name for name in names if self._existing[name])
+
+    def batch(self):
+        return self.indexer.batch()
 
     def __getitem__(self, name):
         item = self.indexer[name]
@@ -186,6 +487,39 @@ class ProtectingMiddleware(object):
         item = self.indexer.existing_item(**query)
         return ProtectedItem(self, item)
 
+    def _may_read(self, fqname):
+        return self.may(fqname, READ) or self.may(fqname, PUBREAD)
+
+    def wanted_items(self):
+        """
+        fqnames of non-existing items referred by items the user may read
+        """
+        graph = self.indexer.link_graph()
+        return set(fqname for fqname in graph.wanted_items()
+                   if any(self._may_read(referrer) for referrer in graph.backrefs(fqname)))
+
+    def orphaned_items(self):
+        """
+        fqnames of items the user may read that are not referred by any item
+        """
+        return set(fqname for fqname in self.indexer.link_graph().orphaned_items()
+                   if self._may_read(fqname))
+
+    def backrefs(self, fqname):
+        """
+        fqnames of items the user may read referring to fqname
+        """
+        return set(referrer for referrer in self.indexer.link_graph().backrefs(fqname)
+                   if self._may_read(referrer))
+
+    def forwardrefs(self, fqname, links=True, transclusions=True):
+        """
+        fqnames referred by item fqname (if the user may read it)
+        """
+        if not self._may_read(fqname):
+            return set()
+        return self.indexer.link_graph().forwardrefs(fqname, links, transclusions)
+
     def may(self, fqname, capability, usernames=None):
         if usernames is not None and isinstance(usernames, (str, unicode)):
             # we got a single username (maybe str), make a list of unicode:
@@ -230,6 +564,10 @@ class ProtectedItem(object):
     def name(self):
         return self.item.name
 
+    @property
+    def names(self):
+        return self.item.names
+
     @property
     def fqname(self):
         return self.item.fqname
@@ -309,20 +647,26 @@ class ProtectedItem(object):
             self.require(CREATE)
         if overwrite:
             self.require(DESTROY)
+        names = self.item.names + list(meta.get(NAME) or [])
         rev = self.item.store_revision(meta, data, overwrite=overwrite, return_rev=return_rev, fqname=fqname, **kw)
-        self.protector._clear_acl_cache()
+        self.protector._clear_acl_cache(names)
+        self.protector._clear_group_cache(names)
         if return_rev:
             return ProtectedRevision(self.protector, rev, p_item=self)
 
     def store_all_revisions(self, meta, data):
         self.require(DESTROY)
+        names = self.item.names + list(meta.get(NAME) or [])
         self.item.store_all_revisions(meta, data)
-        self.protector._clear_acl_cache()
+        self.protector._clear_acl_cache(names)
+        self.protector._clear_group_cache(names)
 
     def destroy_revision(self, revid):
         self.require(DESTROY)
+        names = self.item.names
         self.item.destroy_revision(revid)
-        self.protector._clear_acl_cache()
+        self.protector._clear_acl_cache(names)
+        self.protector._clear_group_cache(names)
 
     def destroy_all_revisions(self):
         for rev in self.item.iter_revs():
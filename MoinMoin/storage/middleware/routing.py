@@ -11,6 +11,8 @@ Routes requests to different backends depending on the namespace.
 
 from __future__ import absolute_import, division
 
+import heapq
+
 from MoinMoin.constants.keys import NAME, BACKENDNAME, NAMESPACE
 
 from MoinMoin.storage.backends import BackendBase, MutableBackendBase
@@ -137,3 +139,51 @@ class Backend(MutableBackendBase):
         if not isinstance(backend, MutableBackendBase):
             raise TypeError('backend {0} is readonly'.format(backend_name))
         backend.remove(revid, destroy_data)
+
+    def _mutable_backends(self):
+        return [(backend_name, backend) for backend_name, backend in self.backends.items()
+                if isinstance(backend, MutableBackendBase)]
+
+    @property
+    def journaling(self):
+        # we can only replay a journal if it covers all changes:
+        mutable_backends = self._mutable_backends()
+        return bool(mutable_backends) and all(backend.journaling for _, backend in mutable_backends)
+
+    def journal_keys(self):
+        """
+        return the set of the keys of the change journal entries of all mutable
+        backends, the keys are (backend_name, backend journal key) tuples.
+        """
+        if not self.journaling:
+            raise NotImplementedError("not all mutable backends keep a change journal")
+        return set((backend_name, key) for backend_name, backend in self._mutable_backends()
+                   for key in backend.journal_keys())
+
+    def journal(self, keys=None):
+        """
+        iterate over (key, entry) tuples of the change journal entries of all
+        mutable backends with these keys (all entries if keys is None), the
+        keys are (backend_name, backend journal key) tuples. The journals are
+        merged, ordered by backend journal key.
+        """
+        if not self.journaling:
+            raise NotImplementedError("not all mutable backends keep a change journal")
+
+        def backend_journal(backend_name, backend):
+            backend_keys = None if keys is None else [key for name, key in keys if name == backend_name]
+            for key, entry in backend.journal(backend_keys):
+                yield key, backend_name, entry
+
+        for key, backend_name, entry in heapq.merge(*[backend_journal(backend_name, backend)
+                                                      for backend_name, backend in self._mutable_backends()]):
+            yield (backend_name, key), entry
+
+    def prune_journal(self, keys):
+        """
+        remove the change journal entries with these (backend_name, backend journal key) keys
+        """
+        for backend_name, backend in self._mutable_backends():
+            backend_keys = [key for name, key in keys if name == backend_name]
+            if backend_keys:
+                backend.prune_journal(backend_keys)
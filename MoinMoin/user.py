@@ -139,6 +139,28 @@ def search_users(**q):
     return list(docs)
 
 
+def get_userid(name):
+    """ Return the itemid of the user with this name (None if there is no such user) """
+    # like for search_users, a list of names might be given (users have just one name)
+    if isinstance(name, list):
+        name = name[0]
+    userid = get_user_backend().user_names().itemid(name)
+    if userid is None and name and name != ANON:
+        # not in the in-memory index (yet?), make sure by asking the index
+        users = search_users(**{NAME_EXACT: name})
+        if users:
+            userid = users[0].meta[ITEMID]
+    return userid
+
+
+def _user_exists(userid):
+    """ Return whether there is a user with this itemid """
+    if get_user_backend().user_names().get_names(userid):
+        return True
+    # not in the in-memory index (yet?), make sure by asking the index (like get_userid)
+    return bool(search_users(**{ITEMID: userid}))
+
+
 def get_editor(userid, addr, hostname):
     """ Return a tuple of type id and string or Page object
         representing the user that did the edit.
@@ -149,7 +171,7 @@ def get_editor(userid, addr, hostname):
     result = 'anon', ''
     if app.cfg.show_hosts and hostname:
         result = 'ip', hostname
-    if userid:
+    if userid and _user_exists(userid):
         userdata = User(userid)
         if userdata.mailto_author and userdata.email:
             return 'email', userdata.email
@@ -324,13 +346,9 @@ class User(object):
 
         itemid = uid
         if not itemid and auth_username:
-            users = search_users(**{NAME_EXACT: auth_username})
-            if users:
-                itemid = users[0].meta[ITEMID]
+            itemid = get_userid(auth_username)
         if not itemid and _name and _name != ANON:
-            users = search_users(**{NAME_EXACT: _name})
-            if users:
-                itemid = users[0].meta[ITEMID]
+            itemid = get_userid(_name)
         if itemid:
             self.load_from_id(itemid, password)
         else:
@@ -5,16 +5,24 @@
     MoinMoin - MoinMoin.util.notifications Tests
 """
 
+import os
+import socket
+import time
 from io import StringIO
 
 from flask import g as flaskg
 from flask import current_app as app
 from flask import url_for
 
-from MoinMoin.constants.keys import ACTION_SAVE, ACTION_TRASH
+from MoinMoin import user
+from MoinMoin.constants.keys import (ACTION_SAVE, ACTION_TRASH, ACTION_RENAME, ALL_REVS, CONTENTTYPE, NAME,
+                                     SUBSCRIPTIONS)
 from MoinMoin.items import Item
+from MoinMoin.mail.sendmail import SMTPConnection
+from MoinMoin.util import notifications
 from MoinMoin.util.diff_datastruct import diff as dict_diff
-from MoinMoin.util.notifications import Notification, get_item_last_revisions, DESTROY_REV, DESTROY_ALL
+from MoinMoin.util.notifications import (Notification, NotificationOutbox, get_item_last_revisions, wiki_context,
+                                         DESTROY_REV, DESTROY_ALL)
 
 
 class TestNotifications(object):
@@ -37,6 +45,33 @@ class TestNotifications(object):
                                    StringIO(u'xxx'), trusted=True, return_rev=True)
         assert get_item_last_revisions(app, self.item_name) == [rev3, rev2]
 
+    def test_get_last_item_revisions_since(self):
+        item = self.imw[self.item_name]
+        revs = [item.store_revision(dict(name=[self.item_name, ], mtime=mtime),
+                                    StringIO(u'x' * mtime), trusted=True, return_rev=True)
+                for mtime in [1, 2, 3, 4]]
+        # the latest revision and the one preceding the given revision:
+        assert get_item_last_revisions(app, self.item_name, revid=revs[2].revid) == [revs[3], revs[1]]
+        assert get_item_last_revisions(app, self.item_name, revid=revs[3].revid) == [revs[3], revs[2]]
+        assert get_item_last_revisions(app, self.item_name, revid=revs[0].revid) == [revs[3]]
+
+    def test_get_last_item_revisions_same_mtime(self):
+        # revisions saved within the same second: the order by modification time
+        # is ambiguous, but the current revision and its parent are known
+        item = self.imw[self.item_name]
+        rev1 = item.store_revision(dict(name=[self.item_name, ], mtime=1),
+                                   StringIO(u'x'), trusted=True, return_rev=True)
+        rev2 = item.store_revision(dict(name=[self.item_name, ], mtime=1, parentid=rev1.revid),
+                                   StringIO(u'xx'), trusted=True, return_rev=True)
+        # reindex rev1 (like merging index segments might do), so it has a higher
+        # document number than rev2:
+        doc = self.imw._document(idx_name=ALL_REVS, revid=rev1.revid)
+        with self.imw.ix[ALL_REVS].writer() as writer:
+            writer.update_document(**doc)
+        self.imw._index_modified()
+        assert get_item_last_revisions(app, self.item_name) == [rev2, rev1]
+        assert get_item_last_revisions(app, self.item_name, revid=rev2.revid) == [rev2, rev1]
+
     def test_get_content_diff(self):
         item = self.imw[self.item_name]
         rev1 = item.store_revision(dict(name=[self.item_name, ], contenttype='text/plain'),
@@ -100,3 +135,140 @@ class TestNotifications(object):
         assert notification.generate_diff_url(domain) == u"{0}{1}".format(
             domain, url_for('frontend.diff', item_name=self.item_name,
                             rev1=rev1.revid, rev2=rev2.revid))
+
+    def test_rename_subitems(self, monkeypatch):
+        # the subitems renamed together with an item get notified, too:
+        for name in [u'Parent', u'Parent/Child1', u'Parent/Child2', ]:
+            item = Item.create(name)
+            item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'x')
+        notified = []
+        monkeypatch.setattr(notifications, 'notify_subscribers',
+                            lambda app, item_name, **kwargs: notified.append((item_name, kwargs.get('action'))))
+        Item.create(u'Parent').rename(u'NewParent')
+        assert sorted(notified) == [(u'NewParent', ACTION_RENAME), (u'NewParent/Child1', ACTION_RENAME),
+                                    (u'NewParent/Child2', ACTION_RENAME), ]
+
+
+def pytest_funcarg__outbox(request):
+    # an outbox in a temporary directory instead of a configured one, its
+    # thread is not started, so it shall not interfere:
+    outbox = NotificationOutbox(str(request.getfuncargvalue('tmpdir')), delay=3600)
+    request.getfuncargvalue('monkeypatch').setattr(app._get_current_object(), 'outbox', outbox)
+    return outbox
+
+
+class TestNotificationOutbox(object):
+    reinit_storage = True
+
+    def test_outbox(self, outbox):
+        item = Item.create(u'OutboxItem')
+        item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'first')
+        item = Item.create(u'OutboxItem')
+        item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'second')
+        item = Item.create(u'OtherOutboxItem')
+        item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'other')
+        entries = outbox.entries()
+        assert [entry['item_names'] for path, entry in entries] == [[u'OutboxItem'], [u'OutboxItem'],
+                                                                    [u'OtherOutboxItem']]
+        assert all(entry['revid'] for path, entry in entries)
+        # nothing is due before the delay has passed:
+        groups, wait = outbox.due()
+        assert groups == []
+        assert 0 < wait <= 3600
+        # changes of the same item get grouped:
+        now = time.time() + 3600
+        groups, wait = outbox.due(now)
+        assert [[entry['item_names'] for path, entry in group] for group in groups] == [
+            [[u'OutboxItem'], [u'OutboxItem']], [[u'OtherOutboxItem']]]
+        assert wait is None
+        # send_due() just logs failures, so try sending a group directly first:
+        outbox._send(app, u'OutboxItem', [entry for path, entry in groups[0]], None)
+        # sending removes the entries from the outbox:
+        assert outbox.send_due(app, now=now) is None
+        assert outbox.entries() == []
+
+    def test_bulk_change(self, outbox):
+        for name in [u'Parent', u'Parent/Child1', u'Parent/Child2', ]:
+            item = Item.create(name)
+            item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'x')
+        for path, entry in outbox.entries():
+            os.remove(path)
+        Item.create(u'Parent').rename(u'NewParent')
+        # one entry for the renamed item, one for the change set of its subitems:
+        entries = outbox.entries()
+        assert [sorted(entry['item_names']) for path, entry in entries] == [
+            [u'NewParent'], [u'NewParent/Child1', u'NewParent/Child2']]
+        groups, wait = outbox.due(time.time() + 3600)
+        assert len(groups) == 2
+
+    def test_retry(self, outbox, monkeypatch):
+        item = Item.create(u'OutboxItem')
+        item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'first')
+
+        send = outbox._send
+
+        def fail(app, item_name, entries, connection):
+            raise IOError('mail server down')
+        monkeypatch.setattr(outbox, '_send', fail)
+        now = time.time() + 3600
+        # failed entries stay queued and get retried later, waiting longer after each failure:
+        assert outbox.send_due(app, now=now) == 60
+        [(path, entry)] = outbox.entries()
+        assert entry['attempts'] == 1
+        assert outbox.due(now + 59) == ([], 1)
+        assert outbox.send_due(app, now=now + 60) == 120
+        [(path, entry)] = outbox.entries()
+        assert entry['attempts'] == 2
+        monkeypatch.setattr(outbox, '_send', send)
+        assert outbox.send_due(app, now=now + 180) is None
+        assert outbox.entries() == []
+
+    def test_retry_mail_server_down(self, outbox, monkeypatch):
+        user.create_user(username=u'Subscriber', password=u'Xiwejr622', email=u'subscriber@example.org',
+                         validate=False, locale=u'en')
+        subscriber = user.User(name=u'Subscriber', password=u'Xiwejr622')
+        subscriber.profile._meta[SUBSCRIPTIONS] = [u'{0}:{1}:{2}'.format(NAME, u'', u'OutboxItem'), ]
+        subscriber.save(force=True)
+        item = Item.create(u'OutboxItem')
+        item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'first', comment=u'first')
+
+        recipients_tried = []
+
+        def refuse(self, mail_from, recipients, msg):
+            recipients_tried.append(recipients)
+            raise socket.error('connection refused')
+        monkeypatch.setattr(SMTPConnection, 'sendmail', refuse)
+        monkeypatch.setattr(app.cfg, 'mail_smarthost', u'localhost')
+        monkeypatch.setattr(app.cfg, 'mail_from', u'wiki@example.org')
+        monkeypatch.setattr(app.cfg, 'mail_enabled', True)
+        # sendmail does not raise, but the entry stays queued for retrying:
+        assert outbox.send_due(app, now=time.time() + 3600) == 60
+        assert recipients_tried == [[u'subscriber@example.org', ], ]
+        [(path, entry)] = outbox.entries()
+        assert entry['attempts'] == 1
+        assert entry['item_names'] == [u'OutboxItem', ]
+
+    def test_recover(self, outbox):
+        item = Item.create(u'OutboxItem')
+        item._save({CONTENTTYPE: u'text/plain;charset=utf-8'}, u'first')
+        [(path, entry)] = outbox.entries()
+        # a process claimed the entry and died while sending it:
+        os.rename(path, path + '.sending')
+        claim_time = time.time()
+        os.utime(path + '.sending', (claim_time, claim_time))
+        assert outbox.entries() == []
+        outbox.recover(claim_time + 599)
+        assert outbox.entries() == []
+        outbox.recover(claim_time + 601)
+        assert outbox.entries() == [(path, entry)]
+
+    def test_wiki_context(self, monkeypatch):
+        monkeypatch.setitem(app.cfg.interwiki_map, app.cfg.interwikiname, 'http://wiki.example.org/mywiki/')
+        with wiki_context(app):
+            assert url_for('frontend.show_item', item_name=u'Foo') == '/mywiki/Foo'
+            assert url_for('frontend.show_item', item_name=u'Foo', _external=True) == \
+                'http://wiki.example.org/mywiki/Foo'
+        monkeypatch.setitem(app.config, 'SERVER_NAME', 'example.org:8080')
+        monkeypatch.setitem(app.config, 'APPLICATION_ROOT', '/wiki')
+        with wiki_context(app):
+            assert url_for('frontend.show_item', item_name=u'Foo', _external=True) == 'http://example.org:8080/wiki/Foo'
@@ -77,3 +77,42 @@ def test_Registry_lifecycle():
 
     pytest.raises(ValueError, r.unregister, factory_none)
     assert len(r._entries) == 0
+
+
+class CachingRegistry(Registry):
+    def _lookup_key(self, *args, **kw):
+        return args
+
+
+def test_Registry_lookup_cache():
+    calls = []
+
+    def factory_counting(arg):
+        calls.append(arg)
+        if arg == 'a':
+            return 4
+
+    r = CachingRegistry()
+    r.register(factory_counting)
+    r.register(factory_all)
+    assert r.get('a') == 4
+    assert r.get('a') == 4
+    assert r.get('b') == 1
+    assert r.get('b') == 1
+    # the lookup of 'b' was remembered, factory_counting is not called again
+    assert calls == ['a', 'a', 'b']
+    assert r.stats() == dict(entries=2, lookups=2, hits=2, misses=2)
+
+    # registering a factory forgets the remembered lookups
+    r.register(factory_special, r.PRIORITY_FIRST)
+    assert r.get('a') == 2
+    assert r.stats()['lookups'] == 1
+
+    r.unregister(factory_special)
+    assert r.get('a') == 4
+
+    # Registry does not remember lookups
+    r = Registry()
+    r.register(factory_all)
+    assert r.get('a') == 1
+    assert r.stats() == dict(entries=1, lookups=0, hits=0, misses=0)
@@ -5,23 +5,34 @@
     MoinMoin - Notifications
 """
 
+import os
+import json
+import time
+import threading
+from base64 import b64encode, b64decode
+from collections import OrderedDict
+from contextlib import contextmanager
 from io import BytesIO
+from uuid import uuid4
 
 from blinker import ANY
 from urlparse import urljoin
+from werkzeug.test import create_environ
 from whoosh.query import Term, And
 
 from flask import url_for, g as flaskg
 
 from MoinMoin.constants.keys import (ACTION_COPY, ACTION_RENAME, ACTION_REVERT,
                                      ACTION_SAVE, ACTION_TRASH, ALL_REVS, CONTENTTYPE,
-                                     MTIME, NAME_EXACT, WIKINAME)
+                                     MTIME, NAME_EXACT, PARENTID, WIKINAME)
 from MoinMoin.i18n import _, L_, N_
 from MoinMoin.i18n import force_locale
 from MoinMoin.items.content import Content
-from MoinMoin.mail.sendmail import sendmail
+from MoinMoin.constants.misc import ANON
+from MoinMoin.mail.sendmail import sendmail, SMTPConnection
 from MoinMoin.themes import render_template
-from MoinMoin.signalling.signals import item_modified
+from MoinMoin.signalling.signals import item_modified, items_modified
+from MoinMoin.util.clock import Clock
 from MoinMoin.util.subscriptions import get_subscribers
 from MoinMoin.util.diff_datastruct import make_text_diff, diff as dict_diff
 
@@ -73,6 +84,7 @@ class Notification(object):
         self.content = kwargs.get('content', None)
         self.meta = kwargs.get('meta', None)
         self.comment = kwargs.get('comment', None)
+        self.user_name = kwargs.get('user_name') or flaskg.user.name0
         self.wiki_name = self.app.cfg.interwikiname
 
         if self.action == ACTION_SAVE:
@@ -81,7 +93,7 @@ class Notification(object):
         if self.action == ACTION_TRASH:
             self.meta = self.revs[0].meta
 
-        kw = dict(item_name=self.item_name, wiki_name=self.wiki_name, user_name=flaskg.user.name0)
+        kw = dict(item_name=self.item_name, wiki_name=self.wiki_name, user_name=self.user_name)
         self.notification_sentence = L_(MESSAGES[self.action], **kw)
 
     def get_content_diff(self):
@@ -177,46 +189,406 @@ class Notification(object):
         return txt_template, html_template
 
 
-def get_item_last_revisions(app, item_name):
+def get_item_last_revisions(app, item_name, revid=None):
     """ Get 2 or less most recent item revisions from the index
 
+    The first one is the current revision of the item. The second one is the
+    parent of the oldest change to cover, if it is known. Otherwise it is the
+    next older revision by modification time (ambiguous for revisions saved
+    within the same second).
+
     :param app: local proxy app
     :param item_name: the name of the item
+    :param revid: revid of the oldest change to cover (default: the latest change) -
+                  the 2nd revision returned is the one preceding it
     :return: a list of revisions
     """
+    latest = flaskg.storage.document(**{WIKINAME: app.cfg.interwikiname, NAME_EXACT: item_name})
+    if latest is not None:
+        if revid is None or revid == latest.revid:
+            oldest = latest
+        else:
+            oldest = flaskg.storage.document(idx_name=ALL_REVS, revid=revid)
+        parentid = oldest.meta.get(PARENTID) if oldest is not None else None
+        previous = flaskg.storage.document(idx_name=ALL_REVS, revid=parentid) if parentid else None
+        if previous is not None:
+            return [latest, previous]
+    # no parent known (or the item has been deleted), use the modification times
+    # (besides the revision preceding the latest one, we might get the latest one):
     terms = [Term(WIKINAME, app.cfg.interwikiname), Term(NAME_EXACT, item_name), ]
     query = And(terms)
-    return list(
-        flaskg.storage.search(query, idx_name=ALL_REVS, sortedby=[MTIME],
-                              reverse=True, limit=2))
-
-
-@item_modified.connect_via(ANY)
-def send_notifications(app, item_name, **kwargs):
-    """ Send mail notifications to subscribers on item change
+    revs = list(flaskg.storage.search(query, idx_name=ALL_REVS, sortedby=[MTIME], reverse=True,
+                                      limit=3 if revid is None else None))
+    if latest is None:
+        if not revs:
+            return []
+        latest = revs[0]
+    revs = [rev for rev in revs if rev.revid != latest.revid]
+    revids = [rev.revid for rev in revs]
+    if revid is None or revid == latest.revid:
+        index = 0
+    else:
+        index = revids.index(revid) + 1 if revid in revids else len(revs)
+    return [latest] + revs[index:index + 1]
+
+
+def notify_subscribers(app, item_name, revid=None, editors=None, user_name=None, connection=None, **kwargs):
+    """ Send mail notifications about an item change to the subscribers of the item
 
     :param app: local proxy app
     :param item_name: name of the changed item
+    :param revid: revid of the oldest change to cover (default: the latest change)
+    :param editors: itemids of the users who did the change(s), they get no mail
+                    (default: the current user)
+    :param user_name: name(s) of the users who did the change(s) (default: the current user)
+    :param connection: SMTP connection to reuse
     :param kwargs: key/value pairs that contain extra information about the item
                    required in order to create a notification
+    :returns: (is_ok, description of error or OK message), see sendmail
     """
+    u = flaskg.user
+    if editors is None:
+        editors = [u.itemid, ]
+    user_name = user_name or u.name0
     action = kwargs.get('action')
-    revs = get_item_last_revisions(app, item_name) if action not in [
+    revs = get_item_last_revisions(app, item_name, revid) if action not in [
         DESTROY_REV, DESTROY_ALL, ] else []
-    notification = Notification(app, item_name, revs, **kwargs)
+    if not revs and action not in [DESTROY_REV, DESTROY_ALL, ]:
+        logging.debug("no revisions of {0!r} found, not sending notifications".format(item_name))
+        return 1, _("No revisions, nothing to do")
+    notification = Notification(app, item_name, revs, user_name=user_name, **kwargs)
     content_diff = notification.get_content_diff()
     meta_diff = notification.get_meta_diff()
 
-    u = flaskg.user
     meta = kwargs.get('meta') if action in [DESTROY_REV, DESTROY_ALL, ] else revs[0].meta._meta
     subscribers = {subscriber for subscriber in get_subscribers(**meta) if
-                   subscriber.itemid != u.itemid}
+                   subscriber.itemid not in editors}
     subscribers_locale = {subscriber.locale for subscriber in subscribers}
     for locale in subscribers_locale:
         with force_locale(locale):
             txt_msg, html_msg = notification.render_templates(content_diff, meta_diff)
             subject = L_('[%(moin_name)s] Update of "%(item_name)s" by %(user_name)s',
-                         moin_name=app.cfg.interwikiname, item_name=item_name, user_name=u.name0)
+                         moin_name=app.cfg.interwikiname, item_name=item_name, user_name=user_name)
             subscribers_emails = [subscriber.email for subscriber in subscribers
                                   if subscriber.locale == locale]
-            sendmail(subject, txt_msg, to=subscribers_emails, html=html_msg)
+            ok, msg = sendmail(subject, txt_msg, to=subscribers_emails, html=html_msg, connection=connection)
+            if not ok:
+                return ok, msg
+    return 1, _("Notifications sent")
+
+
+@item_modified.connect_via(ANY)
+def send_notifications(app, item_name, **kwargs):
+    """ Send mail notifications to subscribers on item change
+
+    If the wiki has a notification outbox, the change is just queued there,
+    the notifications get sent later by the outbox thread.
+
+    :param app: local proxy app
+    :param item_name: name of the changed item
+    :param kwargs: key/value pairs that contain extra information about the item
+                   required in order to create a notification
+    """
+    outbox = getattr(app, 'outbox', None)
+    if outbox is not None:
+        outbox.put([item_name, ], flaskg.user, **kwargs)
+    else:
+        notify_subscribers(app, item_name, **kwargs)
+
+
+@items_modified.connect_via(ANY)
+def send_bulk_notifications(app, item_names, **kwargs):
+    """ Send mail notifications to subscribers on a bulk change of many items
+
+    If the wiki has a notification outbox, the change set is just queued there
+    (as one entry), the notifications get sent later by the outbox thread.
+
+    :param app: local proxy app
+    :param item_names: names of the changed items
+    :param kwargs: key/value pairs that contain extra information about the change
+    """
+    action = kwargs.get('action')
+    outbox = getattr(app, 'outbox', None)
+    if outbox is not None:
+        outbox.put(item_names, flaskg.user, action=action)
+    else:
+        for item_name in item_names:
+            notify_subscribers(app, item_name, action=action)
+
+
+@contextmanager
+def wiki_context(app):
+    """
+    Context for working on the wiki outside of requests (e.g. in a thread).
+
+    URLs get built for the base URL of the wiki: made from SERVER_NAME,
+    APPLICATION_ROOT and PREFERRED_URL_SCHEME of the flask config if
+    SERVER_NAME is set, otherwise the URL of the wiki in the interwiki map.
+    Besides the app context, a request context for the base URL is needed, as
+    Flask-Babel only translates within requests.
+
+    :param app: the moin wsgi application
+    """
+    config = app.config
+    if config['SERVER_NAME']:
+        base_url = '{0}://{1}{2}'.format(config['PREFERRED_URL_SCHEME'], config['SERVER_NAME'],
+                                         config['APPLICATION_ROOT'] or '/')
+    else:
+        base_url = app.cfg.interwiki_map[app.cfg.interwikiname]
+    # a new app context gets a flaskg of its own, even if the app is active already:
+    with app.app_context(), app.request_context(create_environ(base_url=base_url)):
+        yield
+
+
+class NotificationOutbox(object):
+    """
+    Queue of item changes waiting to get notified to the subscribers.
+
+    Saving an item just writes a small entry into the outbox directory, so
+    the cost of saving does not depend on the count of subscribers.
+    A background thread sends the notifications, reusing its SMTP connection.
+    Changes of the same item within `delay` seconds are sent together as one
+    digest mail (covering the changes from the oldest to the latest). Bulk
+    changes of many items (renaming or deleting an item with subitems) are
+    queued as one entry.
+
+    The queued entries are files, so they survive a restart of the wiki and
+    many wiki processes can share the same outbox directory. If sending fails,
+    the entries stay queued and sending gets retried later, waiting twice as
+    long after each failure (from `retry_delay` up to `max_retry_delay` seconds).
+    Entries claimed for sending by a process that died get queued again after
+    `claim_timeout` seconds.
+    """
+    def __init__(self, path, delay=60, retry_delay=60, max_retry_delay=3600, claim_timeout=600):
+        """
+        :param path: outbox directory (gets created if it does not exist)
+        :param delay: time [s] to wait for more changes of the same item
+        :param retry_delay: time [s] to wait before retrying to send after the first failure
+        :param max_retry_delay: max. time [s] to wait before retrying to send
+        :param claim_timeout: time [s] after which claimed entries not sent yet get queued again
+        """
+        self.path = path
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.claim_timeout = claim_timeout
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.thread = None
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+
+    def start(self, app):
+        """
+        :param app: the moin wsgi application, the thread uses its storage and config
+        """
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, args=(app, ), name='NotificationOutbox')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the outbox thread, queued entries stay in the outbox.
+        """
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+
+    def put(self, item_names, user, **kwargs):
+        """
+        Queue a change of an item or a change set of many items.
+
+        :param item_names: names of the changed items
+        :param user: user who did the change
+        :param kwargs: as given to the item_modified / items_modified signal
+        """
+        action = kwargs.get('action')
+        entry = dict(item_names=list(item_names), action=action, revid=kwargs.get('revid'), time=time.time(),
+                     user_itemid=user.itemid if user.valid else None, user_name=user.name0)
+        if action in [DESTROY_REV, DESTROY_ALL, ]:
+            # the destroyed revision will be gone when the entry gets sent
+            entry.update(meta=dict(kwargs['meta']), comment=kwargs.get('comment'),
+                         content=b64encode(kwargs['content'].read()))
+        name = '{0:017.6f}-{1}'.format(entry['time'], uuid4().hex)
+        self._write(os.path.join(self.path, name + '.json'), entry)
+        self.wakeup.set()
+
+    def _write(self, path, entry):
+        tmp_path = path[:-len('.json')] + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            json.dump(entry, f)
+        # only complete entries get a .json name:
+        os.rename(tmp_path, path)
+
+    def entries(self):
+        """
+        Get all queued entries, oldest first.
+
+        :return: list of (path, entry) tuples
+        """
+        entries = []
+        for fname in sorted(os.listdir(self.path)):
+            if fname.endswith('.json'):
+                path = os.path.join(self.path, fname)
+                try:
+                    with open(path, 'rb') as f:
+                        entries.append((path, json.load(f)))
+                except (IOError, OSError):
+                    # was just sent by another process
+                    continue
+        return entries
+
+    def recover(self, now=None):
+        """
+        Queue the entries again that were claimed for sending more than
+        `claim_timeout` seconds ago (the claiming process died while sending).
+
+        :param now: current time (default: time.time())
+        """
+        if now is None:
+            now = time.time()
+        for fname in os.listdir(self.path):
+            if fname.endswith('.json.sending'):
+                path = os.path.join(self.path, fname)
+                try:
+                    if os.path.getmtime(path) + self.claim_timeout < now:
+                        os.rename(path, path[:-len('.sending')])
+                except OSError:
+                    # was just sent or recovered by another process
+                    continue
+
+    def due(self, now=None):
+        """
+        Group the queued entries by item, get the groups due for sending.
+
+        A group is due if its item has not changed for `delay` seconds and
+        the time to retry sending has come (if sending failed before).
+        Destroyed revisions and bulk changes are notified separately.
+
+        :param now: current time (default: time.time())
+        :return: (groups, wait) - list of groups (lists of (path, entry) tuples) and
+                 time [s] until the next group gets due (None if nothing else is queued)
+        """
+        if now is None:
+            now = time.time()
+        groups = OrderedDict()
+        for path, entry in self.entries():
+            if entry['action'] in [DESTROY_REV, DESTROY_ALL, ] or len(entry['item_names']) != 1:
+                groups[path] = [(path, entry)]
+            else:
+                groups.setdefault(entry['item_names'][0], []).append((path, entry))
+        due, wait = [], None
+        for group in groups.values():
+            remaining = max([group[-1][1]['time'] + self.delay] +
+                            [entry.get('retry', 0) for path, entry in group]) - now
+            if remaining <= 0:
+                due.append(group)
+            elif wait is None or remaining < wait:
+                wait = remaining
+        return due, wait
+
+    def send_due(self, app, connection=None, now=None):
+        """
+        Send notifications for the groups of entries due for sending.
+
+        :param app: the moin wsgi application
+        :param connection: SMTP connection to reuse
+        :param now: current time (default: time.time())
+        :return: time [s] until the next group gets due (None if nothing else is queued)
+        """
+        if now is None:
+            now = time.time()
+        self.recover(now)
+        groups, wait = self.due(now)
+        for group in groups:
+            # claim the entries, so no other process sends them
+            # (the claim time is the modification time, see recover):
+            claimed = []
+            for path, entry in group:
+                try:
+                    os.utime(path, None)
+                    os.rename(path, path + '.sending')
+                except OSError:
+                    continue
+                claimed.append((path + '.sending', entry))
+            if not claimed:
+                continue
+            entries = [entry for path, entry in claimed]
+            item_names = entries[0]['item_names']
+            sent = 0
+            try:
+                for item_name in item_names:
+                    self._send(app, item_name, entries, connection)
+                    sent += 1
+            except Exception:
+                logging.exception("sending notifications about {0!r} failed".format(item_names[sent]))
+                retry = self._retry(claimed, item_names[sent:], now)
+                wait = retry if wait is None else min(wait, retry)
+            else:
+                for path, entry in claimed:
+                    os.remove(path)
+        return wait
+
+    def _retry(self, claimed, item_names, now):
+        """
+        Queue claimed entries again after sending failed, with the names of the
+        items not notified yet.
+
+        :return: time [s] until retrying
+        """
+        attempts = max(entry.get('attempts', 0) for path, entry in claimed) + 1
+        retry = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        for path, entry in claimed:
+            entry.update(item_names=item_names, attempts=attempts, retry=now + retry)
+            self._write(path[:-len('.sending')], entry)
+            os.remove(path)
+        return retry
+
+    def _send(self, app, item_name, entries, connection):
+        from MoinMoin.app import setup_wiki_env
+        from MoinMoin.user import User
+        first, last = entries[0], entries[-1]
+        actions = set(entry['action'] for entry in entries)
+        kwargs = dict(action=last['action'] if len(actions) == 1 else ACTION_SAVE)
+        if last['action'] in [DESTROY_REV, DESTROY_ALL, ]:
+            kwargs.update(meta=last['meta'], comment=last['comment'], content=BytesIO(b64decode(last['content'])))
+        editors = [entry['user_itemid'] for entry in entries]
+        user_names = []
+        for entry in entries:
+            if entry['user_name'] not in user_names:
+                user_names.append(entry['user_name'])
+        with wiki_context(app):
+            flaskg.clock = Clock()
+            flaskg.unprotected_storage = app.storage
+            if last['user_itemid']:
+                userobj = User(uid=last['user_itemid'])
+            else:
+                userobj = User(name=ANON, auth_method='invalid')
+            setup_wiki_env(userobj)
+            try:
+                ok, msg = notify_subscribers(app, item_name, revid=first['revid'], editors=editors,
+                                             user_name=u', '.join(user_names), connection=connection, **kwargs)
+            finally:
+                app.storage.release_searchers()
+            if not ok and app.cfg.mail_enabled:
+                # sendmail does not raise, but we want to retry later (e.g. the mail server was down)
+                raise IOError(msg)
+
+    def _run(self, app):
+        connection = SMTPConnection(app.cfg)
+        while not self.stopping.is_set():
+            try:
+                wait = self.send_due(app, connection)
+            except Exception:
+                logging.exception("sending queued notifications failed")
+                wait = None
+            if wait is None:
+                # nothing queued, do not keep the SMTP connection open while idle
+                connection.close()
+                # look for entries queued by other processes now and then:
+                wait = max(self.delay, 1)
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+        connection.close()
@@ -7,6 +7,9 @@ MoinMoin - Module registry
 Every module registers a factory for itself at the registry with a given
 priority.  During the lookup each factory is called with the given arguments and
 can return a callable to consider itself as a match.
+
+Registries can remember which factory matched which arguments (see
+RegistryBase._lookup_key), so repeated lookups call just that factory.
 """
 
 
@@ -29,12 +32,28 @@ class RegistryBase(object):
                 return self.priority < other.priority
             return NotImplemented
 
+    # max. count of remembered lookups
+    LOOKUP_CACHE_SIZE = 1000
+
     def __init__(self):
         self._entries = []
+        self._lookups = {}  # lookup key -> matching entry (None if no entry matched)
+        self.hits = 0
+        self.misses = 0
 
     def __repr__(self):
         return '<{0}: {1!r}>'.format(self.__class__.__name__, self._entries)
 
+    def _lookup_key(self, *args, **kw):
+        """
+        Return a hashable key for remembering the entry matching these
+        arguments or None to not remember it.
+
+        Only registries whose factories decide solely based on the arguments
+        (and not on e.g. the state of the objects given) may remember lookups.
+        """
+        return None
+
     def get(self, *args, **kw):
         """
         Lookup a matching module
@@ -42,10 +61,35 @@ class RegistryBase(object):
         Each registered factory is called with the given arguments and
         the first matching wins.
         """
+        key = self._lookup_key(*args, **kw)
+        if key is not None:
+            try:
+                entry = self._lookups[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if entry is None:
+                    return None
+                conv = entry(*args, **kw)
+                if conv is not None:
+                    return conv
         for entry in self._entries:
             conv = entry(*args, **kw)
             if conv is not None:
-                return conv
+                break
+        else:
+            entry = conv = None
+        if key is not None and len(self._lookups) < self.LOOKUP_CACHE_SIZE:
+            self._lookups[key] = entry
+        return conv
+
+    def stats(self):
+        """
+        Return a dict with statistics about the lookups of this registry
+        """
+        return dict(entries=len(self._entries), lookups=len(self._lookups),
+                    hits=self.hits, misses=self.misses)
 
     def _register(self, entry):
         if entry not in self._entries:
@@ -57,6 +101,7 @@ class RegistryBase(object):
             else:
                 entries.append(entry)
             self._entries = entries
+            self._lookups = {}
 
     def unregister(self, factory):
         """
@@ -70,6 +115,7 @@ class RegistryBase(object):
             # TODO: Is this necessary?
             raise ValueError
         self._entries = entries
+        self._lookups = {}
 
 
 class Registry(RegistryBase):
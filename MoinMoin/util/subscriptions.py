@@ -15,7 +15,7 @@ from whoosh.query import Term, Or
 
 from MoinMoin.constants.keys import (DEFAULT_LOCALE, EMAIL, EMAIL_UNVALIDATED, ITEMID,
                                      LATEST_REVS, LOCALE, NAME, NAMERE, NAMEPREFIX,
-                                     NAMESPACE, SUBSCRIPTION_IDS, SUBSCRIPTION_PATTERNS, TAGS)
+                                     NAMESPACE, SUBSCRIPTION_IDS, TAGS)
 from MoinMoin import log
 logging = log.getLogger(__name__)
 
@@ -44,10 +44,13 @@ def get_subscribers(**meta):
             terms.extend(Term(SUBSCRIPTION_IDS, "{0}:{1}:{2}".format(TAGS, namespace, tag))
                          for tag in tags)
     query = Or(terms)
-    with flaskg.storage.indexer.ix[LATEST_REVS].searcher() as searcher:
+    indexer = flaskg.storage.indexer
+    if namespace is not None and name:
+        patterns = indexer.subscription_patterns().matches(namespace, name)
+    else:
+        patterns = set()
+    with indexer.searcher() as searcher:
         result_iterators = [searcher.search(query, limit=None), ]
-        subscription_patterns = searcher.lexicon(SUBSCRIPTION_PATTERNS)
-        patterns = get_matched_subscription_patterns(subscription_patterns, **meta)
         result_iterators.extend(searcher.documents(subscription_patterns=pattern) for pattern in patterns)
         subscribers = set()
         for user in chain.from_iterable(result_iterators):
@@ -64,6 +67,9 @@ def get_subscribers(**meta):
 def get_matched_subscription_patterns(subscription_patterns, **meta):
     """ Get all the subscriptions with patterns that match at least one of item names
 
+    Note: this is for checking few subscriptions (e.g. of one user), the subscriptions
+    of all users are matched by the indexer's subscription_patterns().
+
     :param subscription_patterns: a list of subscription patterns (the ones that
                                     start with NAMERE or NAMEPREFIX)
     :param meta: key/value pairs from item metadata - name and namespace keys